@@ -15,10 +15,26 @@ django_asgi_app = get_asgi_application()
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import questionnaires.routing # Este import ahora es seguro.
+from questionnaires import ingest
+
+
+async def lifespan(scope, receive, send):
+    # Eventos de arranque/apagado del servidor ASGI (uvicorn). Al apagar
+    # escribimos los votos que siguen en la cola de escritura diferida.
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await ingest.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
 
 # PASO 4: Definir el router de protocolos.
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
+    "lifespan": lifespan,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             questionnaires.routing.websocket_urlpatterns
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -49,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -92,6 +94,16 @@ DATABASES = {
     }
 }
 
+# Caché del formulario público y de las estadísticas: local a cada proceso,
+# sin E/S en un acierto. Es segura con varios workers porque las claves llevan
+# la versión que se lee de la BD (updated_at y stats_version del cuestionario).
+# Con Redis o Memcached los workers comparten además lo ya serializado.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -170,8 +182,123 @@ LOGIN_URL = '/login/'
 
 ASGI_APPLICATION = 'App.asgi.application'
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+# Channel layer compartido entre varios procesos ASGI de la misma máquina (core/layers.py).
+# En Windows no hay sockets Unix para asyncio: se usa el de memoria (un solo proceso).
+if sys.platform != 'win32':
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "core.layers.UnixSocketChannelLayer",
+            "CONFIG": {
+                "path": os.environ.get('SIDE_CHANNEL_SOCKET', '/tmp/side-channels.sock'),
+                "expiry": 60,
+                "capacity": 100,
+            },
+        }
     }
-}
\ No newline at end of file
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer"
+        }
+    }
+
+# Logs estructurados (mensaje + campos clave=valor) en la consola
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            '()': 'core.logformat.KeyValueFormatter',
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+        },
+    },
+    'loggers': {
+        'questionnaires': {'handlers': ['console'], 'level': 'INFO'},
+        'core': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# Métricas en /metrics (core/metrics.py): solo se sirven a estas IPs
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Envío agrupado de estadísticas por sala de encuesta (questionnaires/broadcast.py)
+# Se envía como máximo un mensaje por sala cada SURVEY_BROADCAST_TICK_MS,
+# o antes si se acumulan SURVEY_BROADCAST_MAX_BATCH votos.
+SURVEY_BROADCAST_TICK_MS = 150
+SURVEY_BROADCAST_MAX_BATCH = 200
+
+# Protocolo v2: número de deltas que se guardan por sala para atender 'resync'
+SURVEY_RESYNC_BUFFER = 256
+
+# Caché por proceso del estado de las salas (questionnaires/rooms.py):
+# número máximo de salas inactivas guardadas y segundos antes de expulsarlas.
+SURVEY_ROOM_CACHE_SIZE = 1000
+SURVEY_ROOM_CACHE_TTL = 300
+
+# Cola de salida de cada socket (questionnaires/outbound.py): un cliente con
+# cambios sin enviar durante más de este tiempo se desconecta para que haga 'resync'.
+SURVEY_OUTBOUND_MAX_LAG_MS = 5000
+
+# Formulario público ya serializado (questionnaires/public_cache.py): alias de
+# la caché de Django y segundos que se guarda cada versión. La versión sale de
+# updated_at del cuestionario, así que vale cualquier caché, también la local.
+SURVEY_PUBLIC_CACHE = 'default'
+SURVEY_PUBLIC_CACHE_TTL = 3600
+
+# Caché por proceso access_code -> cuestionario (questionnaires/resolver.py):
+# tamaño y segundos de vida de los códigos que existen y de los que no. Las
+# señales invalidan solo en el proceso que hizo el cambio: en los demás
+# workers, activar o desactivar tarda hasta SURVEY_ACCESS_CODE_CACHE_TTL en
+# verse al leer. Los envíos y votos lo confirman siempre en la BD.
+SURVEY_ACCESS_CODE_CACHE_SIZE = 10000
+SURVEY_ACCESS_CODE_CACHE_TTL = 60
+SURVEY_ACCESS_CODE_NEGATIVE_CACHE_SIZE = 10000
+SURVEY_ACCESS_CODE_NEGATIVE_CACHE_TTL = 30
+
+# Cuerpo de /api/questionnaires/<id>/stats/ por versión de estadísticas
+# (questionnaires/stats_cache.py): alias de la caché y segundos que se guarda.
+SURVEY_STATS_CACHE = 'default'
+SURVEY_STATS_CACHE_TTL = 600
+
+# Panel general en vivo (questionnaires/dashboard.py): los cambios que llegan
+# dentro de este intervalo se juntan en un solo recálculo por proceso.
+DASHBOARD_PUSH_DEBOUNCE_MS = 2000
+
+# Importación masiva (questionnaires/importer.py): cuestionarios por transacción
+# y tamaño máximo de un registro del archivo.
+SURVEY_IMPORT_BATCH_SIZE = 200
+SURVEY_IMPORT_MAX_RECORD_BYTES = 16 * 1024 * 1024
+
+# Exportación de respuestas (questionnaires/export.py): submissions por página.
+SURVEY_EXPORT_CHUNK_SIZE = 2000
+
+# Tablas cruzadas (questionnaires/crosstabs.py): matrices de respuestas que se
+# guardan por proceso, una por cuestionario y versión de estadísticas.
+SURVEY_CROSSTAB_CACHE_SIZE = 16
+
+# Snapshots columnares de respuestas (questionnaires/snapshots.py), creados con
+# 'manage.py build_answer_snapshots'. Por defecto en MEDIA_ROOT/snapshots.
+SURVEY_SNAPSHOT_DIR = os.path.join(MEDIA_ROOT, 'snapshots')
+SURVEY_SNAPSHOT_CHUNK_SIZE = 5000
+
+# Formulario público, envío y comprobación como vistas async (questionnaires/views.py).
+# Con ASGI no ocupan un hilo por petición; con WSGI conviene False (las vistas DRF).
+SURVEY_ASYNC_PUBLIC_VIEWS = True
+
+# Hilos para las consultas de los sockets de votación (questionnaires/db_executor.py).
+# Cada hilo tiene su conexión: es también el máximo de conexiones que abre el pool.
+# 0 usa el hilo compartido de Django (todas las salas en fila).
+SURVEY_DB_EXECUTOR_WORKERS = 8
+
+# Ingesta de votos del WebSocket: 'sync' (una transacción por voto) o
+# 'write_behind' (cola por proceso escrita por lotes, ver questionnaires/ingest.py).
+SURVEY_VOTE_INGESTION = 'sync'
+SURVEY_VOTE_QUEUE_SIZE = 10000
+SURVEY_VOTE_BATCH_SIZE = 500
+SURVEY_VOTE_FLUSH_MS = 200
@@ -0,0 +1,419 @@
+# core/layers.py
+"""
+Channel layer para varios procesos ASGI en una misma máquina, sin Redis.
+
+Los procesos se conectan a un "hub" por un socket Unix. El hub solo enruta:
+guarda qué canales pertenecen a cada grupo y reenvía cada mensaje al proceso
+dueño del canal. Las colas de cada canal viven en el proceso que lo recibe,
+con su capacidad y su caducidad, igual que en InMemoryChannelLayer.
+
+El hub puede ejecutarse aparte con `python manage.py runchannelhub`. Si no hay
+ninguno, el primer proceso que lo necesita lo levanta dentro de su propio event
+loop (se elige con un flock sobre '<path>.lock'). Si ese proceso muere, los demás
+se reconectan, uno de ellos asume el hub y todos vuelven a registrar sus grupos.
+
+Solo se pueden recibir mensajes en canales de proceso (los que devuelve
+new_channel), que son los que usan los consumers.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import random
+import socket
+import string
+import struct
+import time
+import uuid
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>I')
+RECONNECT_DELAY = 0.05
+RECONNECT_ATTEMPTS = 100
+# Frames que el hub guarda para un proceso que aún no los ha leído
+OUTBOX_SIZE = 10000
+
+
+async def read_frame(reader):
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return json.loads(await reader.readexactly(length))
+
+
+def write_frame(writer, frame):
+    data = json.dumps(frame, separators=(',', ':')).encode()
+    writer.write(HEADER.pack(len(data)) + data)
+
+
+def channel_owner(channel):
+    # Los canales de proceso tienen la forma "<prefijo>.<cliente>!<aleatorio>"
+    return channel.rsplit('!', 1)[0].rsplit('.', 1)[-1]
+
+
+class _Outbox:
+    """
+    Cola de salida del hub hacia un proceso. La escribe una tarea propia: un
+    proceso lento (con su socket lleno) no frena las entregas a los demás.
+    """
+
+    def __init__(self, writer, size=OUTBOX_SIZE):
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize=size)
+        self.dropped = 0
+        self.task = asyncio.ensure_future(self._run())
+
+    def put(self, frame):
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            if not self.dropped:
+                logger.warning("Cola del hub llena: se descartan mensajes de un proceso que no lee")
+            self.dropped += 1
+
+    async def _run(self):
+        try:
+            while True:
+                frames = [await self.queue.get()]
+                while not self.queue.empty():
+                    frames.append(self.queue.get_nowait())
+                now = time.time()
+                for frame in frames:
+                    # Lo que caducó mientras esperaba ya no le sirve al proceso
+                    if frame['expires'] >= now:
+                        write_frame(self.writer, frame)
+                await self.writer.drain()
+                self.dropped = 0
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    def close(self):
+        self.task.cancel()
+
+
+class ChannelHub:
+    """Enrutador de mensajes entre procesos. No guarda mensajes, solo grupos."""
+
+    def __init__(self, group_expiry=86400):
+        self.group_expiry = group_expiry
+        self.clients = {}  # client_id -> _Outbox
+        self.groups = {}  # grupo -> {canal: timestamp}
+
+    async def handle(self, reader, writer):
+        client_id = None
+        outbox = None
+        try:
+            while True:
+                frame = await read_frame(reader)
+                op = frame['op']
+                if op == 'hello':
+                    client_id = frame['client']
+                    if outbox is None:
+                        outbox = _Outbox(writer)
+                    self.clients[client_id] = outbox
+                elif op == 'group_add':
+                    self.groups.setdefault(frame['group'], {})[frame['channel']] = time.time()
+                elif op == 'group_discard':
+                    self._discard(frame['group'], frame['channel'])
+                elif op == 'send':
+                    self.deliver([frame['channel']], frame['message'], frame['expires'])
+                elif op == 'group_send':
+                    self.deliver(self.group_channels(frame['group']), frame['message'], frame['expires'])
+                elif op == 'flush' and client_id:
+                    self.discard_client(client_id)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # CancelledError: el event loop se está cerrando
+            pass
+        except Exception:
+            logger.exception("Error en el hub de canales")
+        finally:
+            if client_id and self.clients.get(client_id) is outbox:
+                del self.clients[client_id]
+                self.discard_client(client_id)
+            if outbox is not None:
+                outbox.close()
+            writer.close()
+
+    def group_channels(self, group):
+        members = self.groups.get(group)
+        if not members:
+            return []
+        limit = time.time() - self.group_expiry
+        for channel in [c for c, added in members.items() if added < limit]:
+            del members[channel]
+        return list(members)
+
+    def deliver(self, channels, message, expires):
+        by_owner = {}
+        for channel in channels:
+            by_owner.setdefault(channel_owner(channel), []).append(channel)
+        for owner, owned in by_owner.items():
+            outbox = self.clients.get(owner)
+            if outbox is None or outbox.writer.is_closing():
+                continue
+            outbox.put({'op': 'deliver', 'channels': owned, 'message': message, 'expires': expires})
+
+    def discard_client(self, client_id):
+        for group in list(self.groups):
+            for channel in [c for c in self.groups[group] if channel_owner(c) == client_id]:
+                self._discard(group, channel)
+
+    def _discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+
+
+class _RunningHub:
+    def __init__(self, loop, server, sock, lock_fd):
+        self.loop = loop
+        self.server = server
+        self.sock = sock
+        self.lock_fd = lock_fd
+
+    def close(self):
+        try:
+            if not self.loop.is_closed():
+                self.server.close()
+        finally:
+            self.sock.close()
+            os.close(self.lock_fd)
+
+
+_running_hub = None
+
+
+async def start_hub(path, group_expiry=86400):
+    """
+    Intenta servir el hub en 'path' dentro del event loop actual.
+    Devuelve False si otro proceso ya es el hub.
+    """
+    global _running_hub
+    loop = asyncio.get_running_loop()
+    if _running_hub is not None:
+        if _running_hub.loop is loop and _running_hub.server.is_serving():
+            return True
+        # El hub anterior pertenecía a un event loop que ya no existe
+        _running_hub.close()
+        _running_hub = None
+
+    lock_fd = os.open(path + '.lock', os.O_CREAT | os.O_RDWR, 0o600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(lock_fd)
+        return False
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # Tenemos el lock: si el socket existe es de un hub muerto
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        sock.bind(path)
+        os.chmod(path, 0o600)
+        sock.listen(128)
+        hub = ChannelHub(group_expiry)
+        server = await asyncio.start_unix_server(hub.handle, sock=sock)
+    except Exception:
+        sock.close()
+        os.close(lock_fd)
+        raise
+    _running_hub = _RunningHub(loop, server, sock, lock_fd)
+    logger.info("Hub de canales escuchando en %s (pid %s)", path, os.getpid())
+    return True
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """
+    Channel layer que comparte grupos y mensajes entre procesos locales a través
+    de un hub en un socket Unix. Configuración (CHANNEL_LAYERS['default']['CONFIG']):
+
+    - path: ruta del socket del hub.
+    - expiry: segundos que un mensaje puede esperar en una cola antes de descartarse.
+    - capacity / channel_capacity: tamaño máximo de cada cola de canal.
+    - group_expiry: segundos tras los que un canal sale de un grupo.
+    - autostart_hub: si no hay hub, este proceso puede levantarlo.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path='/tmp/side-channels.sock', expiry=60, group_expiry=86400,
+                 capacity=100, channel_capacity=None, autostart_hub=True, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.path = path
+        self.group_expiry = group_expiry
+        self.autostart_hub = autostart_hub
+        self.client_id = uuid.uuid4().hex[:12]
+        self.channels = {}  # canal local -> asyncio.Queue de (expires, mensaje)
+        self.groups = {}  # grupo -> {canales locales}, para volver a registrarlos al reconectar
+        self._loop = None
+        self._lock = None
+        self._writer = None
+        self._reader_task = None
+        self._last_clean = time.time()
+
+    # --- API de channel layer ---
+
+    async def new_channel(self, prefix='specific.'):
+        suffix = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        return f'{prefix}{self.client_id}!{suffix}'
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        expires = time.time() + self.expiry
+        await self._connection()
+        if channel_owner(channel) == self.client_id:
+            if not self._deliver_local(channel, message, expires):
+                raise ChannelFull(channel)
+            return
+        await self._write({'op': 'send', 'channel': channel, 'message': message, 'expires': expires})
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        assert '!' in channel, "Solo se pueden recibir mensajes en canales de proceso"
+        await self._connection()
+        queue = self._queue(channel)
+        while True:
+            expires, message = await queue.get()
+            if expires >= time.time():
+                return message
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._connection()
+        self.groups.setdefault(group, set()).add(channel)
+        await self._write({'op': 'group_add', 'group': group, 'channel': channel})
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        members = self.groups.get(group)
+        if members is not None:
+            members.discard(channel)
+            if not members:
+                del self.groups[group]
+        await self._connection()
+        await self._write({'op': 'group_discard', 'group': group, 'channel': channel})
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_group_name(group)
+        await self._connection()
+        await self._write({'op': 'group_send', 'group': group, 'message': message, 'expires': time.time() + self.expiry})
+
+    async def flush(self):
+        self.channels = {}
+        self.groups = {}
+        if self._writer is not None and not self._writer.is_closing():
+            await self._write({'op': 'flush'})
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+
+    def queue_depths(self):
+        """Tamaño de la cola de cada canal local (útil para métricas)."""
+        return {channel: queue.qsize() for channel, queue in self.channels.items()}
+
+    # --- Entrega local ---
+
+    def _queue(self, channel):
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return queue
+
+    def _deliver_local(self, channel, message, expires):
+        try:
+            self._queue(channel).put_nowait((expires, message))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def _clean_expired(self):
+        now = time.time()
+        if now - self._last_clean < self.expiry:
+            return
+        self._last_clean = now
+        grouped = set().union(*self.groups.values()) if self.groups else set()
+        for channel, queue in list(self.channels.items()):
+            while not queue.empty() and queue._queue[0][0] < now:
+                queue.get_nowait()
+            if queue.empty() and channel not in grouped and not queue._getters:
+                del self.channels[channel]
+
+    # --- Conexión con el hub ---
+
+    async def _connection(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Las colas y el socket pertenecen a un event loop concreto
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._writer = None
+            self.channels = {}
+            self.groups = {}
+        if self._writer is None or self._writer.is_closing():
+            async with self._lock:
+                if self._writer is None or self._writer.is_closing():
+                    await self._connect()
+
+    async def _connect(self):
+        for attempt in range(RECONNECT_ATTEMPTS):
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if self.autostart_hub and await start_hub(self.path, self.group_expiry):
+                    continue
+                await asyncio.sleep(RECONNECT_DELAY)
+        else:
+            raise ConnectionError(f"No se pudo conectar con el hub de canales en {self.path}")
+
+        write_frame(writer, {'op': 'hello', 'client': self.client_id})
+        for group, channels in self.groups.items():
+            for channel in channels:
+                write_frame(writer, {'op': 'group_add', 'group': group, 'channel': channel})
+        await writer.drain()
+        self._writer = writer
+        self._reader_task = asyncio.ensure_future(self._read_loop(reader, writer))
+
+    async def _write(self, frame):
+        write_frame(self._writer, frame)
+        await self._writer.drain()
+
+    async def _read_loop(self, reader, writer):
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame['op'] != 'deliver':
+                    continue
+                for channel in frame['channels']:
+                    if not self._deliver_local(channel, frame['message'], frame['expires']):
+                        logger.warning("Canal %s lleno; se descarta un mensaje", channel)
+                self._clean_expired()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+        if self._writer is writer:
+            # El hub se cayó: nos reconectamos (o lo asumimos) para no perder los grupos
+            self._writer = None
+            logger.warning("Conexión con el hub de canales perdida; reconectando")
+            try:
+                await self._connection()
+            except ConnectionError:
+                logger.exception("No se pudo restablecer la conexión con el hub de canales")
@@ -0,0 +1,21 @@
+# core/logformat.py
+import logging
+
+# Atributos que trae cualquier LogRecord; el resto viene de extra={...}
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class KeyValueFormatter(logging.Formatter):
+    """
+    Formato de log estructurado: el mensaje seguido de los campos pasados en
+    extra={...} como clave=valor, fácil de filtrar con grep o de ingerir.
+    """
+
+    def format(self, record):
+        line = super().format(record)
+        fields = ' '.join(
+            f'{key}={value!r}' if isinstance(value, str) and ' ' in value else f'{key}={value}'
+            for key, value in vars(record).items()
+            if key not in _STANDARD_ATTRS and not key.startswith('_')
+        )
+        return f'{line} {fields}' if fields else line
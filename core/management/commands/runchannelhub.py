@@ -0,0 +1,29 @@
+# core/management/commands/runchannelhub.py
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.layers import start_hub
+
+
+class Command(BaseCommand):
+    help = "Ejecuta el hub del channel layer multiproceso (core.layers.UnixSocketChannelLayer) como proceso aparte."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help="Ruta del socket. Por defecto, la de CHANNEL_LAYERS['default'].")
+
+    def handle(self, *args, **options):
+        config = settings.CHANNEL_LAYERS.get('default', {}).get('CONFIG', {})
+        path = options['path'] or config.get('path', '/tmp/side-channels.sock')
+        group_expiry = config.get('group_expiry', 86400)
+        try:
+            asyncio.run(self.serve(path, group_expiry))
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self, path, group_expiry):
+        if not await start_hub(path, group_expiry):
+            raise CommandError(f"Ya hay un hub de canales activo en {path}.")
+        self.stdout.write(self.style.SUCCESS(f"Hub de canales escuchando en {path}"))
+        await asyncio.Event().wait()
@@ -0,0 +1,264 @@
+# core/metrics.py
+"""
+Registro de métricas del proceso en formato de texto de Prometheus.
+
+Los contadores no usan locks al sumar: cada hilo suma en su propia celda y al
+exportar se suman todas (más lo que dejaron los hilos que ya terminaron). El camino caliente (inc/observe) no reserva memoria: las
+celdas se crean la primera vez que un hilo toca cada serie y las series con
+etiquetas se guardan al pedirlas con labels().
+
+Las métricas que ya existen en otro sitio (profundidad de colas, sockets por
+sala) se registran como funciones que se evalúan solo al exportar.
+
+Cada proceso tiene su propio registro: con varios workers, Prometheus debe
+consultar cada uno (o sumar las series por instancia).
+"""
+import threading
+import weakref
+from bisect import bisect_left
+
+from channels.layers import get_channel_layer
+
+# Latencias en segundos y tamaños (consultas, sockets) por defecto
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class _Cells:
+    """
+    Una celda (lista de números) por hilo; solo su hilo la modifica. Cuando
+    un hilo termina su celda se suma a 'base' y se descarta, así los pools
+    que renuevan hilos no hacen crecer la lista.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.local = threading.local()
+        self.cells = []
+        self.base = [0] * size
+        self.lock = threading.Lock()
+
+    def get(self):
+        try:
+            return self.local.cell
+        except AttributeError:
+            cell = self.local.cell = [0] * self.size
+            # El testigo solo vive en el threading.local del hilo: al morir este, se recoge
+            token = self.local.token = _ThreadToken()
+            weakref.finalize(token, self._retire, cell)
+            with self.lock:
+                self.cells.append(cell)
+            return cell
+
+    def _retire(self, cell):
+        with self.lock:
+            for index, value in enumerate(cell):
+                self.base[index] += value
+            self.cells.remove(cell)
+
+    def total(self, index):
+        with self.lock:
+            return self.base[index] + sum(cell[index] for cell in self.cells)
+
+
+class _ThreadToken:
+    pass
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in list(self.children.items()):
+            lines.extend(self._expose_child(values, child))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self._cells = _Cells(1)
+
+    def inc(self, amount=1):
+        self._cells.get()[0] += amount
+
+    def dec(self, amount=1):
+        self._cells.get()[0] -= amount
+
+    @property
+    def value(self):
+        return self._cells.total(0)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+    def _expose_child(self, values, child):
+        return [f'{self.name}{self._label_text(values)} {_number(child.value)}']
+
+
+class Gauge(Counter):
+    """Valor que sube y baja (inc/dec desde cualquier hilo)."""
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        self.children[()].dec(amount)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Una posición por cubeta + "+Inf", la suma y el número de observaciones
+        self._cells = _Cells(len(buckets) + 3)
+
+    def observe(self, value):
+        cell = self._cells.get()
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def _expose_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for index, bound in enumerate(self.buckets + (float('inf'),)):
+            cumulative += child._cells.total(index)
+            le = '+Inf' if bound == float('inf') else _number(bound)
+            lines.append(f'{self.name}_bucket{self._label_text(values, [("le", le)])} {cumulative}')
+        lines.append(f'{self.name}_sum{self._label_text(values)} {_number(child._cells.total(-2))}')
+        lines.append(f'{self.name}_count{self._label_text(values)} {child._cells.total(-1)}')
+        return lines
+
+
+class GaugeFunction(_Metric):
+    """
+    Gauge calculado al exportar. 'function' devuelve un número o, si hay
+    etiquetas, un diccionario {tupla_de_etiquetas: número}.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function, labelnames=()):
+        self.function = function
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return None
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        result = self.function()
+        if not self.labelnames:
+            result = {(): result}
+        for values, value in result.items():
+            lines.append(f'{self.name}{self._label_text(values)} {_number(value)}')
+        return lines
+
+
+class CounterFunction(GaugeFunction):
+    """Contador que ya se lleva en otro sitio y se lee al exportar."""
+    kind = 'counter'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        # Registrar dos veces el mismo nombre devuelve la métrica existente (recargas del autoreloader)
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_function(self, name, documentation, function, labelnames=()):
+        return self.register(GaugeFunction(name, documentation, function, labelnames))
+
+    def counter_function(self, name, documentation, function, labelnames=()):
+        return self.register(CounterFunction(name, documentation, function, labelnames))
+
+    def expose(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else str(int(value))
+    return str(value)
+
+
+registry = Registry()
+
+# --- Peticiones HTTP (core.middleware.MetricsMiddleware) ---
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', "Duración de las peticiones HTTP por vista.", ['view', 'method'])
+REQUEST_DB_QUERIES = registry.histogram(
+    'http_request_db_queries', "Consultas a la BD por petición HTTP.", ['view'], buckets=SIZE_BUCKETS)
+REQUEST_DB_SECONDS = registry.histogram(
+    'http_request_db_seconds', "Tiempo en la BD por petición HTTP.", ['view'])
+
+
+def _channel_layer_depths():
+    # Mensajes esperando en las colas locales del channel layer (si lo soporta)
+    layer = get_channel_layer()
+    depths = layer.queue_depths() if hasattr(layer, 'queue_depths') else {}
+    return {
+        ('total',): sum(depths.values()),
+        ('max',): max(depths.values(), default=0),
+    }
+
+
+CHANNEL_LAYER_QUEUE_DEPTH = registry.gauge_function(
+    'channel_layer_queue_depth', "Mensajes pendientes en las colas locales del channel layer.",
+    _channel_layer_depths, ['stat'])
@@ -0,0 +1,91 @@
+# core/middleware.py
+import contextvars
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from . import metrics
+
+
+class _QueryProbe:
+    """
+    execute_wrapper que cuenta las consultas y su tiempo de la petición actual.
+    Hay una sola instancia: se instala en cada conexión y guarda los datos en
+    una variable de contexto, así sirve igual para vistas síncronas (un hilo
+    por petición) y async (varias peticiones en el mismo hilo; las consultas
+    del ORM async corren en hilos que heredan el contexto de su petición).
+    """
+
+    def __init__(self):
+        self.current = contextvars.ContextVar('request_queries', default=None)
+
+    def start(self):
+        totals = [0, 0.0]  # consultas, segundos
+        self.current.set(totals)
+        return totals
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            totals = self.current.get()
+            if totals is not None:
+                totals[0] += 1
+                totals[1] += time.perf_counter() - started
+
+
+_probe = _QueryProbe()
+
+
+def _install_probe(connection, **kwargs):
+    if _probe not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_probe)
+
+
+# Cada hilo tiene sus conexiones (también los del ORM async): se instala al abrirlas
+connection_created.connect(_install_probe, dispatch_uid='metrics_query_probe')
+
+
+class MetricsMiddleware:
+    """Latencia, consultas y tiempo de BD de cada petición, agrupados por vista."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            # Con ASGI la cadena sigue siendo async y las vistas async no pasan por un hilo
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        totals, started = self.start()
+        try:
+            return self.get_response(request)
+        finally:
+            # También las peticiones que acaban en excepción
+            self.observe(request, totals, started)
+
+    async def __acall__(self, request):
+        totals, started = self.start()
+        try:
+            return await self.get_response(request)
+        finally:
+            self.observe(request, totals, started)
+
+    def start(self):
+        for connection in connections.all(initialized_only=True):
+            _install_probe(connection)
+        return _probe.start(), time.perf_counter()
+
+    def observe(self, request, totals, started):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unmatched'
+        metrics.REQUEST_LATENCY.labels(view, request.method).observe(elapsed)
+        metrics.REQUEST_DB_QUERIES.labels(view).observe(totals[0])
+        metrics.REQUEST_DB_SECONDS.labels(view).observe(totals[1])
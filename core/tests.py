@@ -1,3 +1,264 @@
-from django.test import TestCase
+import asyncio
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
 
-# Create your tests here.
+from channels.exceptions import ChannelFull
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+
+from core import metrics
+from core.layers import HEADER, ChannelHub, UnixSocketChannelLayer, _Outbox, channel_owner
+from core.middleware import MetricsMiddleware
+
+
+# Proceso B: se suscribe al grupo de la sala y espera el mensaje de estadísticas
+RECEIVER = textwrap.dedent('''
+    import asyncio, json, sys
+    import django
+    django.setup()
+    from core.layers import UnixSocketChannelLayer
+
+    async def main(path):
+        layer = UnixSocketChannelLayer(path=path)
+        channel = await layer.new_channel()
+        await layer.group_add('survey_MULTI1', channel)
+        print('READY', flush=True)
+        message = await asyncio.wait_for(layer.receive(channel), timeout=10)
+        print(json.dumps(message), flush=True)
+
+    asyncio.run(main(sys.argv[1]))
+''')
+
+# Proceso A: registra un voto como lo hace SurveyConsumer (a través del agregador de la sala)
+SENDER = textwrap.dedent('''
+    import asyncio, sys
+    import django
+    django.setup()
+    from core.layers import UnixSocketChannelLayer
+    from questionnaires.broadcast import broadcaster
+
+    async def main(path):
+        layer = UnixSocketChannelLayer(path=path)
+        await broadcaster.publish(layer, 'MULTI1', 7, {70: 1, 71: 0})
+        await broadcaster.flush_all()
+        await asyncio.sleep(0.2)
+
+    asyncio.run(main(sys.argv[1]))
+''')
+
+
+class UnixSocketChannelLayerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'hub.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def spawn(self, code):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        return subprocess.Popen(
+            [sys.executable, '-c', code, self.path],
+            cwd=settings.BASE_DIR, env=env, text=True,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+
+    def test_vote_on_worker_a_reaches_socket_on_worker_b(self):
+        receiver = self.spawn(RECEIVER)
+        try:
+            self.assertEqual(receiver.stdout.readline().strip(), 'READY')
+            sender = self.spawn(SENDER)
+            _, sender_errors = sender.communicate(timeout=20)
+            self.assertEqual(sender.returncode, 0, sender_errors)
+            line, receiver_errors = receiver.communicate(timeout=20)
+            self.assertEqual(receiver.returncode, 0, receiver_errors)
+        finally:
+            receiver.kill()
+
+        message = json.loads(line)
+        self.assertEqual(message['type'], 'survey_stats_update')
+        self.assertEqual(message['access_code'], 'MULTI1')
+        self.assertEqual(message['updates'], {'7': {'70': 1, '71': 0}})
+
+    def test_group_discard_stops_delivery(self):
+        async def scenario():
+            layer = UnixSocketChannelLayer(path=self.path)
+            first = await layer.new_channel()
+            second = await layer.new_channel()
+            await layer.group_add('room', first)
+            await layer.group_add('room', second)
+            await layer.group_discard('room', second)
+            await layer.group_send('room', {'type': 'hello'})
+            received = await asyncio.wait_for(layer.receive(first), timeout=5)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(second), timeout=0.2)
+            await layer.close()
+            return received
+
+        self.assertEqual(asyncio.run(scenario()), {'type': 'hello'})
+
+    def test_capacity_and_expiry(self):
+        async def scenario():
+            layer = UnixSocketChannelLayer(path=self.path, capacity=1, expiry=0)
+            channel = await layer.new_channel()
+            await layer.send(channel, {'type': 'old'})
+            with self.assertRaises(ChannelFull):
+                await layer.send(channel, {'type': 'overflow'})
+            await asyncio.sleep(0.01)
+            # El mensaje caducó: receive lo descarta y sigue esperando
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(channel), timeout=0.2)
+            await layer.close()
+
+        asyncio.run(scenario())
+
+
+class _StuckWriter:
+    """Writer de un proceso que no lee: drain() no vuelve nunca."""
+
+    def __init__(self):
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(json.loads(data[HEADER.size:]))
+
+    async def drain(self):
+        await asyncio.Event().wait()
+
+    def is_closing(self):
+        return False
+
+
+class ChannelHubTests(SimpleTestCase):
+
+    def test_a_process_that_does_not_read_does_not_block_the_others(self):
+        async def scenario():
+            hub = ChannelHub()
+            stuck, healthy = _StuckWriter(), _StuckWriter()
+            hub.clients['aaaaaaaaaaaa'] = _Outbox(stuck)
+            await asyncio.sleep(0)
+            hub.deliver(['specific.aaaaaaaaaaaa!x'], {'type': 'first'}, time.time() + 60)
+            await asyncio.sleep(0)
+            # El primero está atascado en drain(); el hub sigue entregando al resto
+            hub.clients['bbbbbbbbbbbb'] = _Outbox(healthy)
+            hub.deliver(['specific.aaaaaaaaaaaa!x', 'specific.bbbbbbbbbbbb!y'], {'type': 'second'}, time.time() + 60)
+            await asyncio.sleep(0)
+            for outbox in hub.clients.values():
+                outbox.close()
+            return stuck.frames, healthy.frames
+
+        stuck, healthy = asyncio.run(scenario())
+        self.assertEqual([frame['message']['type'] for frame in stuck], ['first'])
+        self.assertEqual([frame['channels'] for frame in healthy], [['specific.bbbbbbbbbbbb!y']])
+
+    def test_process_channel_names_have_a_single_dot_before_the_owner(self):
+        layer = UnixSocketChannelLayer(path='/unused.sock')
+        channel = asyncio.run(layer.new_channel())
+        self.assertRegex(channel, rf'^specific\.{layer.client_id}![A-Za-z]{{12}}$')
+        self.assertEqual(channel_owner(channel), layer.client_id)
+
+
+class MetricsRegistryTests(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter_and_gauge_exposition(self):
+        votes = self.registry.counter('votes_total', "Votos.", ['room'])
+        votes.labels('A"1').inc()
+        votes.labels('A"1').inc(2)
+        sockets = self.registry.gauge('sockets', "Sockets abiertos.")
+        sockets.inc(3)
+        sockets.dec()
+
+        self.assertEqual(self.registry.expose(), (
+            '# HELP votes_total Votos.\n'
+            '# TYPE votes_total counter\n'
+            'votes_total{room="A\\"1"} 3\n'
+            '# HELP sockets Sockets abiertos.\n'
+            '# TYPE sockets gauge\n'
+            'sockets 2\n'
+        ))
+
+    def test_histogram_buckets_are_cumulative(self):
+        latency = self.registry.histogram('latency_seconds', "Latencia.", buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 3):
+            latency.observe(value)
+
+        lines = self.registry.expose().splitlines()
+        self.assertEqual(lines[2:], [
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            'latency_seconds_sum 4.05',
+            'latency_seconds_count 4',
+        ])
+
+    def test_cells_from_every_thread_are_added(self):
+        counter = self.registry.counter('hits_total', "Aciertos.")
+        threads = [threading.Thread(target=counter.inc) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc()
+        self.assertEqual(counter.children[()].value, 5)
+
+    def test_cells_of_finished_threads_are_folded_into_the_total(self):
+        counter = self.registry.counter('hits_total', "Aciertos.")
+        for _ in range(20):
+            thread = threading.Thread(target=counter.inc, args=(2,))
+            thread.start()
+            thread.join()
+        gc.collect()
+        cells = counter.children[()]._cells
+        self.assertEqual(cells.cells, [])
+        self.assertEqual(counter.children[()].value, 40)
+
+    def test_registering_a_name_twice_returns_the_first_metric(self):
+        first = self.registry.counter('hits_total', "Aciertos.")
+        self.assertIs(self.registry.counter('hits_total', "Otra."), first)
+
+    def test_gauge_function_is_evaluated_on_exposition(self):
+        self.registry.gauge_function('queue_depth', "Cola.", lambda: {('total',): 7}, ['stat'])
+        self.assertIn('queue_depth{stat="total"} 7', self.registry.expose())
+
+
+class MetricsMiddlewareTests(SimpleTestCase):
+
+    def count(self, view):
+        child = metrics.REQUEST_LATENCY.labels(view, 'GET')
+        return child._cells.total(-1)
+
+    def test_request_that_raises_is_observed(self):
+        def failing_view(request):
+            raise ValueError('fallo')
+
+        request = RequestFactory().get('/roto/')
+        request.resolver_match = None
+        before = self.count('unmatched')
+        with self.assertRaises(ValueError):
+            MetricsMiddleware(failing_view)(request)
+        self.assertEqual(self.count('unmatched'), before + 1)
+
+
+class MetricsViewTests(SimpleTestCase):
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.5'])
+    def test_only_allowed_ips_can_read_metrics(self):
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.6').status_code, 403)
+
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE http_request_duration_seconds histogram', response.content.decode())
@@ -11,4 +11,7 @@ urlpatterns = [
     path('form/<str:access_code>/', views.public_form_view, name='public-form-page'),
     path('edit-questionnaire/<int:questionnaire_id>/', views.questionnaire_edit_view, name='edit-questionnaire-page'),
     path('users/', views.user_management_view, name='user-management-page'),
+
+    # Métricas del proceso para Prometheus
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,5 +1,8 @@
 # core/views.py
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render, redirect
+from . import metrics
 # IMPORTANTE: Añade estas dos líneas para configurar el logger
 import logging
 logger = logging.getLogger(__name__)
@@ -34,4 +37,10 @@ def questionnaire_edit_view(request, questionnaire_id):
     return render(request, "questionnaire_edit_form.html", {'questionnaire_id': questionnaire_id})
 
 def user_management_view(request):
-    return render(request, "user_management.html")
\ No newline at end of file
+    return render(request, "user_management.html")
+
+def metrics_view(request):
+    # Texto de Prometheus; solo para las IPs de METRICS_ALLOWED_IPS
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', []):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
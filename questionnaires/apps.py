@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class QuestionnairesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'questionnaires'
+
+    def ready(self):
+        # Registra las métricas de la votación en vivo
+        from . import metrics  # noqa: F401
+        # Conecta las señales que invalidan la caché de access_code
+        from . import resolver  # noqa: F401
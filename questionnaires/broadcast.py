@@ -0,0 +1,210 @@
+# questionnaires/broadcast.py
+"""
+Agregador de estadísticas por sala (room) de encuesta.
+
+En lugar de hacer un group_send por cada voto, los votos se acumulan
+por sala y se envía un único mensaje 'survey_stats_update' por tick con
+todas las preguntas que cambiaron. Si la sala estaba inactiva el envío
+es inmediato; si se alcanza MAX_BATCH también.
+"""
+import asyncio
+import itertools
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .rooms import group_name_for
+
+# Salas sin actividad durante este tiempo se eliminan del registro
+IDLE_ROOM_TTL = 60.0
+
+# Identificador de los mensajes enviados por este proceso
+_PROCESS_TOKEN = uuid.uuid4().hex[:12]
+_event_ids = itertools.count(1)
+
+
+def get_tick():
+    return getattr(settings, 'SURVEY_BROADCAST_TICK_MS', 150) / 1000.0
+
+
+def get_max_batch():
+    return getattr(settings, 'SURVEY_BROADCAST_MAX_BATCH', 200)
+
+
+def stats_event(access_code, updates, deltas=None, versions=None):
+    """
+    Mensaje de grupo con los cambios de la sala:
+    - updates: estadísticas completas (absolutas) de las preguntas que cambiaron.
+    - deltas: incrementos por opción (modo de escritura diferida), que se aplican
+      después de 'updates'. Al ser sumas se pueden combinar entre procesos.
+    - versions: stats_version de cada pregunta de 'updates' (si se conoce). Los
+      votos se guardan en paralelo y sus estadísticas pueden llegar desordenadas:
+      quien recibe descarta las de una versión anterior a la que ya aplicó.
+    """
+    event = {
+        'type': 'survey_stats_update',
+        'event_id': f'{_PROCESS_TOKEN}:{next(_event_ids)}',
+        'access_code': access_code,
+        'updates': updates,
+    }
+    if deltas:
+        event['deltas'] = deltas
+    if versions:
+        event['versions'] = versions
+    return event
+
+
+def encode_updates(stats_by_question):
+    return {
+        str(question_id): {str(option_id): count for option_id, count in stats.items()}
+        for question_id, stats in stats_by_question.items()
+    }
+
+
+async def publish_now(access_code, stats_by_question, stats_version=None):
+    """
+    Envía de inmediato (sin agrupar) las estadísticas de varias preguntas,
+    p. ej. tras un envío del formulario por HTTP.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not stats_by_question:
+        return
+    versions = None
+    if stats_version is not None:
+        versions = {str(question_id): stats_version for question_id in stats_by_question}
+    await channel_layer.group_send(
+        group_name_for(access_code),
+        stats_event(access_code, encode_updates(stats_by_question), versions=versions)
+    )
+
+
+def publish_sync(access_code, stats_by_question, stats_version=None):
+    """publish_now() desde código síncrono (vistas HTTP síncronas)."""
+    async_to_sync(publish_now)(access_code, stats_by_question, stats_version)
+
+
+def publish_structure_changed(access_code):
+    """
+    Avisa a los consumers de la sala de que el cuestionario cambió (edición o
+    borrado) para que descarten las preguntas y opciones que tienen en caché.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(group_name_for(access_code), {
+        'type': 'survey_structure_changed',
+        'access_code': access_code,
+    })
+
+
+class RoomAggregator:
+    def __init__(self, channel_layer, access_code, tick, max_batch):
+        self.channel_layer = channel_layer
+        self.access_code = access_code
+        self.group_name = group_name_for(access_code)
+        self.tick = tick
+        self.max_batch = max_batch
+        self.pending = {}  # question_id -> {option_id: votos}
+        self.pending_deltas = {}  # question_id -> {option_id: incremento}
+        self.versions = {}  # question_id -> última stats_version aceptada
+        self.pending_votes = 0
+        self.last_flush = 0.0
+        self.last_activity = time.monotonic()
+        self._timer = None
+
+    async def add(self, question_id, stats, stats_version=None):
+        question_id = str(question_id)
+        if stats_version is not None:
+            if stats_version < self.versions.get(question_id, stats_version):
+                # Otro hilo del pool ya publicó unas estadísticas más nuevas
+                return
+            self.versions[question_id] = stats_version
+        self.pending[question_id] = {str(option_id): count for option_id, count in stats.items()}
+        # Los incrementos anteriores quedan sustituidos por el valor absoluto
+        self.pending_deltas.pop(question_id, None)
+        await self._schedule()
+
+    async def add_deltas(self, question_id, deltas):
+        question_id = str(question_id)
+        pending = self.pending_deltas.setdefault(question_id, {})
+        for option_id, delta in deltas.items():
+            option_id = str(option_id)
+            pending[option_id] = pending.get(option_id, 0) + delta
+        await self._schedule()
+
+    async def _schedule(self):
+        self.pending_votes += 1
+        self.last_activity = now = time.monotonic()
+
+        if self.pending_votes >= self.max_batch:
+            await self.flush()
+        elif self._timer is None:
+            elapsed = now - self.last_flush
+            if elapsed >= self.tick:
+                # Sala inactiva: enviamos de inmediato para no añadir latencia
+                await self.flush()
+            else:
+                self._timer = asyncio.ensure_future(self._flush_later(self.tick - elapsed))
+
+    async def _flush_later(self, delay):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            return
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+        if not self.pending and not self.pending_deltas:
+            return
+        updates, self.pending = self.pending, {}
+        deltas, self.pending_deltas = self.pending_deltas, {}
+        self.pending_votes = 0
+        self.last_flush = time.monotonic()
+        versions = {question_id: self.versions[question_id] for question_id in updates if question_id in self.versions}
+        await self.channel_layer.group_send(
+            self.group_name, stats_event(self.access_code, updates, deltas, versions))
+
+    def is_idle(self, now):
+        return (not self.pending and not self.pending_deltas and self._timer is None
+                and now - self.last_activity > IDLE_ROOM_TTL)
+
+
+class StatsBroadcaster:
+    """Registro de agregadores por sala para este proceso."""
+
+    def __init__(self):
+        self.rooms = {}
+
+    def get_room(self, channel_layer, access_code):
+        room = self.rooms.get(access_code)
+        if room is None or room.channel_layer is not channel_layer:
+            self._prune()
+            room = RoomAggregator(channel_layer, access_code, get_tick(), get_max_batch())
+            self.rooms[access_code] = room
+        return room
+
+    async def publish(self, channel_layer, access_code, question_id, stats, stats_version=None):
+        await self.get_room(channel_layer, access_code).add(question_id, stats, stats_version)
+
+    async def publish_deltas(self, channel_layer, access_code, question_id, deltas):
+        await self.get_room(channel_layer, access_code).add_deltas(question_id, deltas)
+
+    async def flush_all(self):
+        for room in list(self.rooms.values()):
+            await room.flush()
+
+    def _prune(self):
+        now = time.monotonic()
+        for access_code, room in list(self.rooms.items()):
+            if room.is_idle(now):
+                del self.rooms[access_code]
+
+
+broadcaster = StatsBroadcaster()
@@ -0,0 +1,119 @@
+# questionnaires/bulk.py
+"""
+Inserción de cuestionarios completos (cuestionario -> preguntas -> opciones)
+con un INSERT múltiple por nivel, sin importar cuántas filas haya.
+
+Cada nivel necesita los ids del anterior para enlazar sus filas. PostgreSQL,
+SQLite y MariaDB los devuelven en el mismo INSERT; MySQL no, así que se
+vuelven a leer con una consulta:
+
+- los cuestionarios por su access_code, que es único;
+- las preguntas por cuestionario y en orden de id: un mismo INSERT asigna
+  los autoincrementales en el orden de las filas. En cuestionarios nuevos
+  todas sus preguntas son las insertadas; en los que ya tenían preguntas
+  solo se leen las de id mayor que el máximo anterior.
+"""
+from collections import defaultdict, deque
+
+from django.db import connection, transaction
+from django.db.models import Max
+
+from .models import Option, Question, Questionnaire, new_access_code
+from .resolver import resolver
+
+BATCH_SIZE = 1000
+
+
+def _returns_ids():
+    return connection.features.can_return_rows_from_bulk_insert
+
+
+def create_questions(questions):
+    """
+    Inserta preguntas de cuestionarios que ya tenían otras y las devuelve con
+    su id. Sin ids devueltos por la BD, las nuevas son las de id mayor que el
+    máximo que había antes del INSERT.
+    """
+    if _returns_ids():
+        return Question.objects.bulk_create(questions, batch_size=BATCH_SIZE)
+    last_id = Question.objects.filter(
+        questionnaire_id__in={question.questionnaire_id for question in questions}
+    ).aggregate(last_id=Max('id'))['last_id'] or 0
+    Question.objects.bulk_create(questions, batch_size=BATCH_SIZE)
+    _reload_question_ids(questions, after_id=last_id)
+    return questions
+
+
+def create_questionnaires(questionnaires):
+    """
+    Inserta cuestionarios nuevos (sin guardar) con un INSERT por lote y les
+    asigna id y access_code. Los códigos que ya existen se vuelven a sortear.
+    """
+    codes = _unused_access_codes(len(questionnaires))
+    for questionnaire, code in zip(questionnaires, codes):
+        questionnaire.access_code = code
+    Questionnaire.objects.bulk_create(questionnaires, batch_size=BATCH_SIZE)
+
+    def forget_codes():
+        # bulk_create no envía post_save: un código nuevo pudo quedar en la caché negativa
+        for code in codes:
+            resolver.invalidate(code)
+    transaction.on_commit(forget_codes)
+
+    if not _returns_ids():
+        ids = dict(Questionnaire.all_objects.filter(access_code__in=codes).values_list('access_code', 'id'))
+        for questionnaire in questionnaires:
+            questionnaire.pk = ids[questionnaire.access_code]
+            questionnaire._state.adding = False
+    return questionnaires
+
+
+def _unused_access_codes(count):
+    codes = set()
+    while len(codes) < count:
+        candidates = {new_access_code() for _ in range(count - len(codes))} - codes
+        taken = set(Questionnaire.all_objects.filter(access_code__in=candidates).values_list('access_code', flat=True))
+        codes |= candidates - taken
+    return list(codes)
+
+
+def create_structure(items):
+    """
+    Inserta las preguntas y opciones de cuestionarios recién creados.
+    'items' es una lista de (cuestionario con id, datos de sus preguntas), con
+    los datos como los deja QuestionnaireAdminSerializer (text y options).
+    Devuelve (preguntas, opciones) creadas.
+    """
+    questions = []
+    options_data = []
+    for questionnaire, questions_data in items:
+        for question_data in questions_data:
+            questions.append(Question(questionnaire=questionnaire, text=question_data['text']))
+            options_data.append(question_data.get('options', []))
+    if not questions:
+        return 0, 0
+
+    Question.objects.bulk_create(questions, batch_size=BATCH_SIZE)
+    if not _returns_ids():
+        _reload_question_ids(questions)
+
+    options = [
+        Option(question=question, text=option_data['text'])
+        for question, question_options in zip(questions, options_data)
+        for option_data in question_options
+    ]
+    Option.objects.bulk_create(options, batch_size=BATCH_SIZE)
+    return len(questions), len(options)
+
+
+def _reload_question_ids(questions, after_id=0):
+    ids = defaultdict(deque)
+    rows = Question.objects.filter(
+        questionnaire_id__in={question.questionnaire_id for question in questions},
+        id__gt=after_id,
+    ).order_by('questionnaire_id', 'id').values_list('questionnaire_id', 'id')
+    for questionnaire_id, question_id in rows:
+        ids[questionnaire_id].append(question_id)
+    for question in questions:
+        question.pk = ids[question.questionnaire_id].popleft()
+        question._state.adding = False
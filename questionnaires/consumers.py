@@ -1,17 +1,44 @@
 import json
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.db.models import F 
-from .models import Questionnaire, Question, Option, Submission, Answer 
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+from .models import Questionnaire, Question, Option, Submission, Answer
+from . import dashboard, rollups, tallies
+from .broadcast import broadcaster
+from .db_executor import db_sync_to_async
+from .resolver import QuestionnaireClosed, resolver
+from .rooms import rooms, group_name_for
+from . import ingest
+from .outbound import CLOSE_RESYNC, OutboundQueue, get_max_lag
+from .metrics import WS_VOTES
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Versiones del protocolo de estadísticas:
+#   1 (por defecto): 'initial_stats' y 'stats_update' con el mapa completo de cada pregunta.
+#   2 (?protocol=2): 'snapshot' y 'stats_delta' con solo las opciones que cambiaron,
+#     un número de secuencia por sala y 'resync' para recuperar mensajes perdidos.
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+
+# Código de cierre cuando el access_code no existe o el cuestionario se borró
+CLOSE_NOT_FOUND = 4404
+# Código de cierre tras un voto a un cuestionario desactivado o borrado
+CLOSE_CLOSED = 4410
+
 class SurveyConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.access_code = self.scope['url_route']['kwargs']['access_code']
-        self.room_group_name = f'survey_{self.access_code}'
-        
+        self.room_group_name = group_name_for(self.access_code)
+        self.room_state = None
+        self.outbound = None
+        self.sent_seq = None  # última secuencia enviada a este cliente (v2)
+
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.protocol = PROTOCOL_V2 if query.get('protocol') == ['2'] else PROTOCOL_V1
+
         # Guardamos la session_key para usarla después.
         # Es crucial que AuthMiddlewareStack esté en asgi.py para que esto funcione.
         self.session_key = self.scope.get('session', {}).session_key
@@ -20,12 +47,35 @@ class SurveyConsumer(AsyncWebsocketConsumer):
             # Si la sesión no existe, Django la creará la primera vez que se modifique.
             # No es necesario un fallback aquí si el middleware está bien configurado.
 
+        # Un código que no existe no crea sala ni se suscribe a nada (el resolver
+        # guarda también los códigos inexistentes)
+        questionnaire = await resolver.aresolve(self.access_code)
+        if questionnaire is None or questionnaire.is_deleted:
+            await self.accept()
+            await self.close(code=CLOSE_NOT_FOUND)
+            return
+
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
         await self.accept()
-        await self.send_initial_stats()
+        # Estado compartido de la sala en este proceso: solo el primer consumer consulta la BD
+        self.room_state = await rooms.acquire(self.access_code, self.channel_layer, self.get_all_initial_stats)
+        if self.room_state is None:
+            # Se borró entre la comprobación y la carga
+            await self.close(code=CLOSE_NOT_FOUND)
+            return
+        self.outbound = OutboundQueue(self.send_changes, get_max_lag(), on_error=self.outbound_failed)
+        if self.protocol == PROTOCOL_V2:
+            await self.send_resync(_int_or_none(query.get('since', [None])[0]), query.get('epoch', [None])[0])
+        else:
+            await self.send_initial_stats()
+
+        # Preguntas/opciones válidas y submission de la sesión: se leen una vez por
+        # conexión (en un solo paso por el pool de BD) y los votos se validan en memoria
+        self.questionnaire_id = await self.room_questionnaire_id()
+        self.allowed_options, (self.submission_id, self.selections) = await self.load_voter_state()
 
     async def disconnect(self, close_code):
         if hasattr(self, 'room_group_name'): 
@@ -33,102 +83,352 @@ class SurveyConsumer(AsyncWebsocketConsumer):
                 self.room_group_name,
                 self.channel_name
             )
+        if getattr(self, 'outbound', None) is not None:
+            self.outbound.close()
+            self.outbound = None
+        if getattr(self, 'room_state', None) is not None:
+            rooms.release(self.room_state)
+            self.room_state = None
 
     async def receive(self, text_data):
+        if self.room_state is None:
+            # Socket de un código inexistente, pendiente de cerrarse
+            return
         text_data_json = json.loads(text_data)
-        question_id = text_data_json.get('question_id')
-        option_id = text_data_json.get('option_id')
+
+        if text_data_json.get('type') == 'resync':
+            if self.protocol == PROTOCOL_V2:
+                await self.send_resync(_int_or_none(text_data_json.get('since')), text_data_json.get('epoch'))
+            return
+
+        question_id = _int_or_none(text_data_json.get('question_id'))
+        option_id = _int_or_none(text_data_json.get('option_id'))
         access_code = self.access_code 
 
         if question_id and option_id:
+            questionnaire = await resolver.aresolve(self.access_code)
+            if questionnaire is None or not questionnaire.is_open:
+                # Desactivado o borrado (según la caché; al escribir se confirma en la BD)
+                await self.reject_closed(question_id, option_id)
+                return
+            if self.allowed_options is None:
+                # El cuestionario cambió desde la última vez: recargamos la estructura
+                self.questionnaire_id, self.allowed_options = await self.load_structure()
+            if option_id not in self.allowed_options.get(question_id, ()):
+                logger.warning(f"Voto inválido en {self.access_code}: pregunta {question_id}, opción {option_id}")
+                await self.send_vote_rejected(question_id, option_id, 'invalid')
+                return
+            WS_VOTES.inc()
+            if ingest.is_enabled():
+                await self.enqueue_vote(question_id, option_id)
+                return
             # ▼▼▼ CORRECCIÓN DEL NOMBRE DE LA FUNCIÓN ▼▼▼
             # El nombre correcto es el que definimos más abajo.
             await self.broadcast_stats_after_save(question_id, option_id, access_code)
 
     async def survey_stats_update(self, event):
-        question_id = event['question_id']
-        stats = event['stats']
-        await self.send(text_data=json.dumps({
+        # Un mensaje agrupado por tick con todas las preguntas que cambiaron
+        if self.room_state is None or self.outbound is None:
+            return
+        seq, changes = self.room_state.apply(
+            event['event_id'], event['updates'], event.get('deltas'), event.get('versions'))
+        if not changes:
+            # Nada nuevo (p. ej. la corrección tras un lote coincidió con el estado optimista)
+            return
+        # No esperamos al cliente: la cola de salida envía el último valor de cada pregunta
+        if not self.outbound.mark(changes):
+            await self.disconnect_lagging()
+
+    async def send_changes(self, question_ids):
+        """Envía las preguntas pendientes con el estado actual de la sala (lo llama la cola de salida)."""
+        room = self.room_state
+        if room is None:
+            return
+        if self.protocol == PROTOCOL_V2:
+            changes = room.changes_since(self.sent_seq, room.epoch) if self.sent_seq is not None else None
+            if changes is None:
+                # El buffer de la sala ya no tiene lo que falta: snapshot completo
+                self.sent_seq = room.seq
+                await self.send(text_data=room.snapshot_json())
+                return
+            if not changes:
+                return
+            # 'since' indica desde qué secuencia se acumulan los cambios (puede saltar varias)
+            since, self.sent_seq = self.sent_seq, room.seq
+            await self.send(text_data=json.dumps({
+                'type': 'stats_delta',
+                'epoch': room.epoch,
+                'seq': room.seq,
+                'since': since,
+                'changes': changes,
+            }))
+            return
+
+        # Los clientes v1 esperan el mapa completo de cada pregunta
+        updates = {question_id: dict((room.stats or {}).get(question_id, {})) for question_id in question_ids}
+        message = {
             'type': 'stats_update',
-            'question_id': question_id,
-            'stats': stats
-        }))
+            'updates': updates,
+        }
+        if len(updates) == 1:
+            # Compatibilidad con clientes que solo entienden question_id/stats
+            (question_id, stats), = updates.items()
+            message['question_id'] = int(question_id)
+            message['stats'] = stats
+        await self.send(text_data=json.dumps(message))
 
-    @database_sync_to_async
-    def get_all_initial_stats(self, access_code):
-        stats_data = {}
-        try:
-            questionnaire = Questionnaire.objects.get(access_code=access_code)
-            for question in questionnaire.questions.all():
-                options_stats = {}
-                for option in question.options.all():
-                    count = Answer.objects.filter(selected_option=option).count()
-                    options_stats[option.id] = count
-                stats_data[question.id] = options_stats
-            return stats_data
-        except Questionnaire.DoesNotExist:
-            return {}
+    async def disconnect_lagging(self):
+        # El cliente no da abasto: se le desconecta y al reconectar pide 'resync'
+        logger.warning(f"WebSocket de {self.access_code} desconectado por ir retrasado ({self.outbound.depth} preguntas pendientes)")
+        self.outbound.close(lagging=True)
+        self.outbound = None
+        await self.close(code=CLOSE_RESYNC, reason='resync')
+
+    async def outbound_failed(self):
+        # La cola de salida ya está cerrada y registró el error
+        self.outbound = None
+        await self.close(code=1011)
+
+    async def survey_structure_changed(self, event):
+        # Un admin editó o borró el cuestionario: la estructura se recarga en el próximo voto
+        self.allowed_options = None
+
+    async def get_all_initial_stats(self, access_code):
+        # El resolver responde desde memoria; solo los conteos pasan por el pool de BD
+        questionnaire = await resolver.aresolve(access_code)
+        if questionnaire is None or questionnaire.is_deleted:
+            return None
+        # Una sola lectura sobre la tabla de conteos en lugar de un COUNT por opción
+        return await db_sync_to_async(tallies.questionnaire_stats)(questionnaire.id)
 
     async def send_initial_stats(self):
-        initial_stats = await self.get_all_initial_stats(self.access_code)
+        # El JSON del snapshot se codifica una sola vez por cambio y se comparte entre conexiones
+        initial_stats = self.room_state.initial_stats_json()
         if initial_stats:
+            await self.send(text_data=initial_stats)
+
+    async def send_resync(self, since, epoch):
+        """
+        Protocolo v2: envía los deltas desde 'since' si siguen en el buffer de la
+        sala; si no (o si no se indicó 'since'), envía un snapshot completo.
+        """
+        room = self.room_state
+        changes = room.changes_since(since, epoch) if since is not None else None
+        self.sent_seq = room.seq
+        if changes is not None:
             await self.send(text_data=json.dumps({
-                'type': 'initial_stats',
-                'stats': initial_stats
+                'type': 'stats_delta',
+                'epoch': room.epoch,
+                'seq': room.seq,
+                'changes': changes,
             }))
+        else:
+            await self.send(text_data=room.snapshot_json())
+
+    async def room_questionnaire_id(self):
+        """Id del cuestionario de la sala, o None si no existe o está borrado (sin consultas si está en caché)."""
+        questionnaire = await resolver.aresolve(self.access_code)
+        return questionnaire.id if questionnaire is not None and not questionnaire.is_deleted else None
 
-    @database_sync_to_async
+    async def load_structure(self):
+        """Devuelve (questionnaire_id, {question_id: {option_id, ...}}) del cuestionario de la sala."""
+        questionnaire_id = await self.room_questionnaire_id()
+        if questionnaire_id is None:
+            return None, {}
+        return questionnaire_id, await db_sync_to_async(self.read_allowed_options)(questionnaire_id)
+
+    @db_sync_to_async
+    def load_voter_state(self):
+        """Estructura y votos de la sesión juntos: ({question_id: {option_id, ...}}, (submission_id, selections))."""
+        if self.questionnaire_id is None:
+            return {}, (None, {})
+        return self.read_allowed_options(self.questionnaire_id), self.read_session_votes()
+
+    @staticmethod
+    def read_allowed_options(questionnaire_id):
+        allowed_options = {}
+        rows = Option.objects.filter(question__questionnaire_id=questionnaire_id).values_list('question_id', 'id')
+        for question_id, option_id in rows:
+            allowed_options.setdefault(question_id, set()).add(option_id)
+        return allowed_options
+
+    def read_session_votes(self):
+        """Devuelve (submission_id, {question_id: option_id}) de esta sesión, si ya votó."""
+        if not self.session_key:
+            return None, {}
+        submission_id = Submission.objects.filter(
+            questionnaire_id=self.questionnaire_id,
+            session_key=self.session_key,
+        ).values_list('id', flat=True).first()
+        if submission_id is None:
+            return None, {}
+        selections = dict(
+            Answer.objects.filter(submission_id=submission_id).values_list('question_id', 'selected_option_id')
+        )
+        return submission_id, selections
+
+    async def reject_closed(self, question_id, option_id):
+        # El cliente no debe reconectar: el cuestionario ya no acepta votos
+        await self.send_vote_rejected(question_id, option_id, 'closed')
+        await self.close(code=CLOSE_CLOSED)
+
+    async def send_vote_rejected(self, question_id, option_id, reason):
+        await self.send(text_data=json.dumps({
+            'type': 'vote_rejected',
+            'question_id': question_id,
+            'option_id': option_id,
+            'reason': reason,
+        }))
+
+    def ensure_session_key(self):
+        if not self.session_key:
+            # Esto es un fallback, pero el middleware debería prevenirlo
+            self.scope['session'].save()
+            self.session_key = self.scope['session'].session_key
+
+    @db_sync_to_async
     def save_answer_and_get_stats(self, question_id, option_id, access_code):
+        # La pregunta y la opción ya se validaron contra la estructura en caché.
+        # Sesión, voto, conteos y estadísticas van en un único paso por el pool de BD.
         try:
-            question = Question.objects.get(id=question_id)
-            option = Option.objects.get(id=option_id, question=question)
-            questionnaire = question.questionnaire
-
-            # Asegurarse de que la sesión exista antes de usarla
-            if not self.session_key:
-                # Esto es un fallback, pero el middleware debería prevenirlo
-                self.scope['session'].save()
-                self.session_key = self.scope['session'].session_key
-
-            # Usamos get_or_create para manejar la creación de la Submission de forma segura
-            submission, created = Submission.objects.get_or_create(
-                questionnaire=questionnaire,
-                session_key=self.session_key
-            )
+            self.ensure_session_key()
 
-            # Lógica para permitir cambiar de opción:
-            # Borra cualquier respuesta anterior para ESTA pregunta y ESTA submission.
-            Answer.objects.filter(submission=submission, question=question).delete()
-            
-            # Guardar la nueva respuesta
-            Answer.objects.create(
-                submission=submission,
-                question=question,
-                selected_option=option
-            )
+            with transaction.atomic():
+                # Otro worker pudo cerrar el cuestionario sin que la caché de este lo sepa
+                questionnaire = resolver.resolve(self.access_code)
+                if questionnaire is None or not resolver.confirm_open(questionnaire):
+                    raise QuestionnaireClosed(self.access_code)
 
-            # Obtener y devolver las estadísticas actualizadas para esta pregunta
-            options_stats = {}
-            for opt in question.options.all():
-                count = Answer.objects.filter(selected_option=opt).count()
-                options_stats[opt.id] = count
-            
-            return question_id, options_stats
-        
+                # Bloqueamos la submission: los votos de la misma sesión se serializan
+                # y la opción anterior que devuelve el upsert es fiable
+                locked = self.submission_id is not None and Submission.objects.select_for_update()\
+                    .filter(id=self.submission_id).values_list('id', flat=True).first()
+                if not locked:
+                    submission, created = Submission.objects.select_for_update().get_or_create(
+                        questionnaire_id=self.questionnaire_id,
+                        session_key=self.session_key
+                    )
+                    self.submission_id = submission.id
+                    if created:
+                        rollups.record_submission(self.questionnaire_id)
+                        transaction.on_commit(dashboard.notify_changed)
+
+                # Una sola escritura (INSERT o UPDATE) para crear o cambiar el voto
+                old_option_id = Answer.objects.upsert(self.submission_id, question_id, option_id)
+
+                # Ajustar los conteos en la misma transacción: +1 / -1, sin recontar
+                tallies.record_change(old_option_id, option_id)
+
+            # Estadísticas de la pregunta junto con su stats_version: los hilos del
+            # pool terminan en cualquier orden y la sala descarta las atrasadas
+            stats, stats_version = tallies.questions_stats_with_version([question_id])
+
+            return question_id, stats.get(question_id, {}), stats_version
+
+        except QuestionnaireClosed:
+            raise
         except Exception as e:
             logger.error(f"Error en save_answer_and_get_stats: {e}", exc_info=True)
-            return None, None
+            return None, None, None
 
     # He renombrado la función para que sea más clara
     async def broadcast_stats_after_save(self, question_id, option_id, access_code):
-        updated_question_id, updated_stats = await self.save_answer_and_get_stats(question_id, option_id, access_code)
+        try:
+            updated_question_id, updated_stats, stats_version = await self.save_answer_and_get_stats(
+                question_id, option_id, access_code)
+        except QuestionnaireClosed:
+            await self.reject_closed(question_id, option_id)
+            return
         
         if updated_question_id is not None:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'survey_stats_update',
-                    'question_id': updated_question_id,
-                    'stats': updated_stats
-                }
+            # El agregador de la sala decide cuándo enviar (un mensaje por tick)
+            await broadcaster.publish(
+                self.channel_layer,
+                self.access_code,
+                updated_question_id,
+                updated_stats,
+                stats_version
             )
+
+    # --- Escritura diferida (SURVEY_VOTE_INGESTION = 'write_behind') ---
+
+    async def enqueue_vote(self, question_id, option_id):
+        """
+        Deja el voto (ya validado) en la cola del escritor y difunde de
+        inmediato el incremento.
+        """
+        if not self.session_key:
+            await db_sync_to_async(self.ensure_session_key)()
+
+        previous = self.selections.get(question_id)
+        if previous == option_id:
+            return
+
+        vote = ingest.PendingVote(
+            self.access_code, self.questionnaire_id, self.session_key, question_id, option_id, previous,
+        )
+        if not ingest.vote_writer.submit(vote):
+            # Cola llena: avisamos al cliente para que pueda reintentar
+            await self.send_vote_rejected(question_id, option_id, 'overloaded')
+            return
+
+        self.selections[question_id] = option_id
+        deltas = {option_id: 1}
+        if previous is not None:
+            deltas[previous] = -1
+        await broadcaster.publish_deltas(self.channel_layer, self.access_code, question_id, deltas)
+
+
+# Código de cierre del panel cuando el token no es válido (el cliente vuelve al login)
+CLOSE_UNAUTHORIZED = 4401
+
+
+class DashboardConsumer(AsyncWebsocketConsumer):
+    """
+    Panel general en vivo: el snapshot de DashboardStatsView al conectar y uno
+    nuevo (agrupado, ver questionnaires/dashboard.py) cuando hay cambios.
+    El navegador no puede mandar cabeceras en un WebSocket, así que el token
+    de la API llega en la URL: /ws/dashboard/?token=<token>.
+    """
+
+    async def connect(self):
+        self.subscribed = False
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        user = await self.authenticate(query.get('token', [None])[0])
+        await self.accept()
+        if user is None:
+            await self.close(code=CLOSE_UNAUTHORIZED)
+            return
+
+        await self.channel_layer.group_add(dashboard.GROUP_NAME, self.channel_name)
+        self.subscribed = True
+        await self.send(text_data=await dashboard.hub.subscribe(self))
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'subscribed', False):
+            self.subscribed = False
+            await self.channel_layer.group_discard(dashboard.GROUP_NAME, self.channel_name)
+            dashboard.hub.unsubscribe(self)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # El panel solo escucha
+        pass
+
+    async def dashboard_changed(self, event):
+        dashboard.hub.changed()
+
+    @db_sync_to_async
+    def authenticate(self, key):
+        if not key:
+            return None
+        token = Token.objects.select_related('user').filter(key=key).first()
+        if token is None or not token.user.is_active:
+            return None
+        return token.user
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
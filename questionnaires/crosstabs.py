@@ -0,0 +1,185 @@
+# questionnaires/crosstabs.py
+"""
+Tablas de contingencia pregunta × pregunta ("de quienes eligieron A en la
+pregunta 1, ¿qué eligieron en la 3?").
+
+Las respuestas de un cuestionario se cargan una vez en una matriz de enteros
+(submissions × preguntas, con el índice de la opción elegida en cada celda y
+-1 sin respuesta). Cada tabla sale de dos columnas de la matriz con un solo
+np.bincount sobre el par (fila, columna) codificado como un entero, sin
+recorrer respuestas en Python.
+
+- La matriz se guarda por proceso (SURVEY_CROSSTAB_CACHE_SIZE cuestionarios)
+  junto con la stats_version con que se cargó: un voto o un cambio de
+  estructura sube la versión y la siguiente petición la recarga.
+- Si el cuestionario tiene un snapshot al día (ver snapshots), las
+  respuestas salen de sus columnas mapeadas en vez de la BD.
+- El JSON de cada tabla se guarda en la caché de 'stats' por versión, con el
+  mismo ETag (ver stats_cache).
+
+numpy es opcional para el resto del proyecto: sin él, la acción responde 503.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import snapshots, stats_cache
+from .models import Answer, Option, Question
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy no está instalado
+    np = None
+
+# Respuestas leídas por consulta al cargar la matriz (páginas por id)
+CHUNK_SIZE = 50000
+
+
+class CrosstabError(ValueError):
+    """La pregunta pedida no es del cuestionario."""
+
+
+def is_available():
+    return np is not None
+
+
+def get_cache_size():
+    return getattr(settings, 'SURVEY_CROSSTAB_CACHE_SIZE', 16)
+
+
+class AnswerMatrix:
+    """Respuestas de un cuestionario como matriz submissions × preguntas."""
+
+    def __init__(self, questions, cells):
+        # [(question_id, text, [(option_id, text), ...])] en orden de id
+        self.questions = questions
+        self.columns = {question[0]: index for index, question in enumerate(questions)}
+        self.cells = cells
+
+    @classmethod
+    def load(cls, questionnaire_id, snapshot=None, chunk_size=CHUNK_SIZE):
+        questions = [
+            (question_id, text, [])
+            for question_id, text in Question.objects.filter(questionnaire_id=questionnaire_id)
+            .order_by('id').values_list('id', 'text')
+        ]
+        columns = {question[0]: index for index, question in enumerate(questions)}
+        rows = Option.objects.filter(question__questionnaire_id=questionnaire_id)\
+            .order_by('id').values_list('id', 'question_id', 'text')
+        option_ids, option_columns, option_positions = [], [], []
+        for option_id, question_id, text in rows:
+            options = questions[columns[question_id]][2]
+            option_ids.append(option_id)
+            option_columns.append(columns[question_id])
+            option_positions.append(len(options))
+            options.append((option_id, text))
+        option_ids = np.array(option_ids, dtype=np.int64)
+
+        if snapshot is not None:
+            submission_ids, selected = snapshot.submission, snapshot.option
+        else:
+            submission_ids, selected = cls._read_answers(questionnaire_id, chunk_size)
+
+        # Opción -> (columna de su pregunta, posición dentro de la pregunta)
+        lookup = np.searchsorted(option_ids, selected)
+        known = lookup < len(option_ids)
+        known[known] = option_ids[lookup[known]] == selected[known]
+        lookup = lookup[known]
+        submissions, rows = np.unique(submission_ids[known], return_inverse=True)
+
+        cells = np.full((len(submissions), len(questions)), -1, dtype=np.int16)
+        cells[rows, np.array(option_columns, dtype=np.int64)[lookup]] = \
+            np.array(option_positions, dtype=np.int16)[lookup]
+        return cls(questions, cells)
+
+    @staticmethod
+    def _read_answers(questionnaire_id, chunk_size):
+        """(submission_ids, selected_option_ids) por páginas de id: en MySQL iterator() lo cargaría todo."""
+        pages = []
+        last_id = 0
+        while True:
+            page = list(
+                Answer.objects.filter(submission__questionnaire_id=questionnaire_id, id__gt=last_id)
+                .order_by('id').values_list('id', 'submission_id', 'selected_option_id')[:chunk_size]
+            )
+            if not page:
+                break
+            last_id = page[-1][0]
+            pages.append(np.array(page, dtype=np.int64)[:, 1:])
+        answers = np.concatenate(pages) if pages else np.empty((0, 2), dtype=np.int64)
+        return answers[:, 0], answers[:, 1]
+
+    def crosstab(self, row_question_id, col_question_id):
+        """Conteos [opción de la fila][opción de la columna] de quienes respondieron ambas."""
+        row_options = len(self.questions[self.columns[row_question_id]][2])
+        col_options = len(self.questions[self.columns[col_question_id]][2])
+        rows = self.cells[:, self.columns[row_question_id]]
+        cols = self.cells[:, self.columns[col_question_id]]
+        answered = (rows >= 0) & (cols >= 0)
+        codes = rows[answered].astype(np.int64) * col_options + cols[answered]
+        return np.bincount(codes, minlength=row_options * col_options).reshape(row_options, col_options)
+
+    def describe(self, question_id):
+        question_id, text, options = self.questions[self.columns[question_id]]
+        return {
+            'question_id': question_id,
+            'question_text': text,
+            'options': [{'option_id': option_id, 'option_text': option_text} for option_id, option_text in options],
+        }
+
+
+_matrices = OrderedDict()  # questionnaire_id -> (stats_version, AnswerMatrix)
+_lock = threading.Lock()
+
+
+def get_matrix(questionnaire):
+    """Matriz de la versión actual del cuestionario; la carga si no está o es de otra versión."""
+    with _lock:
+        entry = _matrices.get(questionnaire.id)
+        if entry is not None and entry[0] == questionnaire.stats_version:
+            _matrices.move_to_end(questionnaire.id)
+            return entry[1]
+    matrix = AnswerMatrix.load(questionnaire.id, snapshots.current(questionnaire))
+    with _lock:
+        _matrices[questionnaire.id] = (questionnaire.stats_version, matrix)
+        _matrices.move_to_end(questionnaire.id)
+        while len(_matrices) > get_cache_size():
+            _matrices.popitem(last=False)
+    return matrix
+
+
+def render(matrix, row_question_id, col_question_id=None):
+    """
+    Tabla de 'row' contra 'col', o contra todas las demás preguntas si no se
+    indica 'col'. Lanza CrosstabError si alguna no es del cuestionario.
+    """
+    for question_id in (row_question_id, col_question_id):
+        if question_id is not None and question_id not in matrix.columns:
+            raise CrosstabError(f"La pregunta {question_id} no es de este cuestionario.")
+    if col_question_id is not None:
+        others = [col_question_id]
+    else:
+        others = [question[0] for question in matrix.questions if question[0] != row_question_id]
+
+    crosstabs = []
+    for question_id in others:
+        counts = matrix.crosstab(row_question_id, question_id)
+        crosstabs.append(dict(
+            matrix.describe(question_id),
+            counts=counts.tolist(),
+            total=int(counts.sum()),
+        ))
+    return {'question': matrix.describe(row_question_id), 'crosstabs': crosstabs}
+
+
+def get_body(questionnaire, row_question_id, col_question_id=None):
+    cache = stats_cache.get_cache()
+    key = f'questionnaire_crosstab:{questionnaire.id}:{questionnaire.stats_version}:{row_question_id}:{col_question_id}'
+    body = cache.get(key)
+    if body is None:
+        data = render(get_matrix(questionnaire), row_question_id, col_question_id)
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+        cache.set(key, body, stats_cache.get_ttl())
+    return body
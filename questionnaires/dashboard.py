@@ -0,0 +1,171 @@
+# questionnaires/dashboard.py
+"""
+Datos del panel general y su envío en vivo (DashboardConsumer).
+
+snapshot() calcula lo mismo que devuelve DashboardStatsView. Los paneles
+abiertos no lo piden cada pocos segundos: se conectan a /ws/dashboard/ y
+reciben el snapshot al conectar y uno nuevo cuando cambian las respuestas o
+los cuestionarios.
+
+- notify_changed() se llama tras el commit de cada cambio. Avisa al grupo
+  'dashboard' como mucho una vez cada DASHBOARD_PUSH_DEBOUNCE_MS / 2 por
+  proceso: el recálculo de cada proceso espera el intervalo completo, así que
+  un aviso omitido siempre queda cubierto por el recálculo ya programado.
+- Cada proceso tiene un DashboardHub: los avisos que llegan durante el
+  intervalo se juntan en un solo recálculo y el mismo JSON se envía a todos
+  los paneles conectados a ese proceso. La carga en la BD no crece con el
+  número de pestañas abiertas.
+"""
+import asyncio
+import json
+import logging
+import time
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Sum
+
+from users.models import User
+from . import rollups
+from .models import Questionnaire, SubmissionRollup
+
+logger = logging.getLogger(__name__)
+
+GROUP_NAME = 'dashboard'
+
+_last_notify = 0.0
+
+
+def get_debounce():
+    return getattr(settings, 'DASHBOARD_PUSH_DEBOUNCE_MS', 2000) / 1000.0
+
+
+def snapshot():
+    """Estadísticas generales del panel (KPIs, tendencia de 30 días y top 5)."""
+    # 1. Total de Cuestionarios Creados (solo activos, no borrados)
+    total_questionnaires = Questionnaire.objects.filter(is_deleted=False).count()
+
+    # 2. Total de Respuestas Recibidas: suma de los conteos diarios, sin recorrer Submission
+    total_submissions = rollups.total()
+
+    # 3. Total de Usuarios Registrados (en tu sistema, asumiendo todos los roles)
+    total_users = User.objects.count() # Contar todos los usuarios en el sistema
+
+    # 4. Tendencia de Respuestas Recibidas (últimos 30 días), una fila por día
+    trend = rollups.daily_trend(30)
+    trend_labels = [day.strftime('%d/%b') for day, _ in trend] # Formato "01/Jul"
+    trend_data = [count for _, count in trend]
+
+    # 5. Los 5 cuestionarios activos con más respuestas, también desde los conteos diarios
+    questionnaire_responses = SubmissionRollup.objects.filter(
+        questionnaire__is_deleted=False, # Solo cuestionarios no borrados
+        questionnaire__is_active=True # Opcional: solo cuestionarios activos
+    ).values('questionnaire_id', 'questionnaire__title').annotate(
+        total_responses=Sum('count')
+    ).order_by('-total_responses')[:5] # Los 5 con más respuestas
+
+    type_labels = [row['questionnaire__title'] for row in questionnaire_responses]
+    type_data = [row['total_responses'] for row in questionnaire_responses]
+
+    return {
+        'total_questionnaires': total_questionnaires,
+        'total_submissions': total_submissions,
+        'total_users': total_users,
+        'submissions_trend': {
+            'labels': trend_labels,
+            'data': trend_data,
+        },
+        'questionnaire_type_distribution': {
+            'labels': type_labels,
+            'data': type_data,
+        },
+    }
+
+
+def _should_notify():
+    global _last_notify
+    now = time.monotonic()
+    if now - _last_notify < get_debounce() / 2:
+        return False
+    _last_notify = now
+    return True
+
+
+def notify_changed():
+    """
+    Avisa a los paneles conectados de que algo cambió. Llamar desde código
+    síncrono, normalmente con transaction.on_commit(dashboard.notify_changed).
+    """
+    if _should_notify():
+        async_to_sync(_send_changed)()
+
+
+async def anotify_changed():
+    """notify_changed() desde código async (vistas async, consumers)."""
+    if _should_notify():
+        await _send_changed()
+
+
+async def _send_changed():
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        await channel_layer.group_send(GROUP_NAME, {'type': 'dashboard_changed'})
+    except Exception:
+        # El panel se actualizará con el próximo aviso; el cambio ya está guardado
+        logger.exception("No se pudo avisar a los paneles")
+
+
+class DashboardHub:
+    """Paneles conectados a este proceso y el último snapshot enviado."""
+
+    def __init__(self):
+        self.consumers = set()
+        self.message = None  # JSON ya codificado del último snapshot
+        self._refresh = None
+
+    async def subscribe(self, consumer):
+        """Registra el consumer y devuelve el snapshot actual para enviarlo al conectar."""
+        self.consumers.add(consumer)
+        if self.message is None:
+            self.message = await self._build()
+        return self.message
+
+    def unsubscribe(self, consumer):
+        self.consumers.discard(consumer)
+        if not self.consumers:
+            # Sin paneles nadie sigue los avisos: el snapshot guardado quedaría viejo
+            self.message = None
+            if self._refresh is not None:
+                self._refresh.cancel()
+                self._refresh = None
+
+    def changed(self):
+        if self.consumers and self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._run_refresh())
+
+    async def _run_refresh(self):
+        try:
+            await asyncio.sleep(get_debounce())
+        finally:
+            # Antes de calcular: un aviso que llegue durante el cálculo programa otro
+            if self._refresh is asyncio.current_task():
+                self._refresh = None
+        message = await self._build()
+        if not self.consumers:
+            return
+        self.message = message
+        await asyncio.gather(
+            *(consumer.send(text_data=message) for consumer in list(self.consumers)),
+            return_exceptions=True,
+        )
+
+    async def _build(self):
+        data = await database_sync_to_async(snapshot)()
+        return json.dumps({'type': 'dashboard_stats', 'data': data})
+
+
+hub = DashboardHub()
@@ -0,0 +1,54 @@
+# questionnaires/db_executor.py
+"""
+Hilos propios para el trabajo de BD de los sockets de votación.
+
+database_sync_to_async (y el ORM async de Django, que por dentro hace lo
+mismo) manda todas las consultas al único hilo "thread sensitive" del
+proceso: con muchas salas, cada conexión y cada voto espera a las consultas
+de las demás. Aquí se usa en su lugar un pool acotado de
+SURVEY_DB_EXECUTOR_WORKERS hilos, cada uno con su propia conexión a la BD,
+así que las salas consultan en paralelo hasta ese límite (que también es el
+máximo de conexiones que abre el pool).
+
+Con SURVEY_DB_EXECUTOR_WORKERS = 0 se vuelve al hilo compartido. Es lo que
+necesitan los tests con TestCase: la transacción del test solo la ve la
+conexión de ese hilo.
+"""
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import DatabaseSyncToAsync, database_sync_to_async
+from django.conf import settings
+
+
+def get_workers():
+    return getattr(settings, 'SURVEY_DB_EXECUTOR_WORKERS', 8)
+
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    """Pool del proceso; se crea en el primer uso con el tamaño configurado."""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=get_workers(), thread_name_prefix='survey-db')
+    return _executor
+
+
+def db_sync_to_async(func):
+    """
+    Como database_sync_to_async (cierra las conexiones caducadas antes y
+    después), pero en el pool. Sirve también como decorador de métodos; el
+    ajuste se lee en cada llamada.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if get_workers() <= 0:
+            return await database_sync_to_async(func)(*args, **kwargs)
+        return await DatabaseSyncToAsync(func, thread_sensitive=False, executor=get_executor())(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,173 @@
+# questionnaires/export.py
+"""
+Exportación de las respuestas de un cuestionario en CSV o NDJSON, por
+streaming: una fila por submission y una columna por pregunta con el texto de
+la opción elegida.
+
+Las submissions se leen por páginas de SURVEY_EXPORT_CHUNK_SIZE ordenadas por
+id (id > último leído) y sus respuestas con una consulta por página. Así la
+memoria depende del tamaño de página y no del número de respuestas en
+cualquier backend: con MySQL, QuerySet.iterator() no evita que el driver
+cargue el resultado entero. La cabecera sale antes de la primera consulta.
+
+Si el cuestionario tiene un snapshot al día (ver snapshots), las páginas
+salen de sus columnas mapeadas en memoria en vez de la BD.
+
+Ninguna página deja un cursor abierto, así que con ASGI cada página puede
+leerse en un paso distinto por el pool de BD (ver db_executor) sin ocupar el
+event loop.
+
+- CSV: submission_id, created_at y las preguntas (por texto, en orden de id).
+  Empieza con BOM para que Excel lo abra como UTF-8.
+- NDJSON: {"submission_id", "created_at", "answers": {"<question_id>": texto}}.
+"""
+import csv
+import io
+import json
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+from . import snapshots
+from .db_executor import db_sync_to_async
+from .models import Answer, Option, Question, Submission
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def get_chunk_size():
+    return getattr(settings, 'SURVEY_EXPORT_CHUNK_SIZE', 2000)
+
+
+class _ExportRenderer(BaseRenderer):
+    """
+    Solo para que DRF acepte ?format=csv|ndjson en la acción: la exportación
+    es un StreamingHttpResponse y no pasa por aquí. Los errores (404, 403)
+    salen en JSON.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class CSVRenderer(_ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class NDJSONRenderer(_ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+def iter_pages(questionnaire_id, chunk_size=None):
+    """Listas de (submission_id, created_at, {question_id: option_id}) en orden de id."""
+    chunk_size = chunk_size or get_chunk_size()
+    last_id = 0
+    while True:
+        page = list(
+            Submission.objects.filter(questionnaire_id=questionnaire_id, id__gt=last_id)
+            .order_by('id').values_list('id', 'created_at')[:chunk_size]
+        )
+        if not page:
+            return
+        answers = defaultdict(dict)
+        rows = Answer.objects.filter(submission_id__in=[submission_id for submission_id, _ in page])\
+            .values_list('submission_id', 'question_id', 'selected_option_id')
+        for submission_id, question_id, option_id in rows:
+            answers[submission_id][question_id] = option_id
+        yield [(submission_id, created_at, answers.get(submission_id, {})) for submission_id, created_at in page]
+        last_id = page[-1][0]
+
+
+class Exporter:
+    """Codifica las páginas de un cuestionario; las preguntas y opciones se leen al crearlo."""
+
+    def __init__(self, questionnaire, format='csv'):
+        self.questionnaire = questionnaire
+        self.format = format
+        self.questions = list(
+            Question.objects.filter(questionnaire=questionnaire).order_by('id').values_list('id', 'text')
+        )
+        self.options = dict(
+            Option.objects.filter(question__questionnaire=questionnaire).values_list('id', 'text')
+        )
+        self.snapshot = snapshots.current(questionnaire)
+
+    @property
+    def content_type(self):
+        return FORMATS[self.format]
+
+    def filename(self, compressed=False):
+        return f"cuestionario-{self.questionnaire.id}-respuestas.{self.format}" + ('.gz' if compressed else '')
+
+    def chunks(self, chunk_size=None):
+        """Bytes de la exportación: la cabecera y luego un trozo por página."""
+        if self.format == 'csv':
+            yield self._csv([['submission_id', 'created_at'] + [text for _, text in self.questions]], bom=True)
+        if self.snapshot is not None:
+            pages = self.snapshot.iter_pages(chunk_size or get_chunk_size())
+        else:
+            pages = iter_pages(self.questionnaire.id, chunk_size)
+        for page in pages:
+            yield self._csv_page(page) if self.format == 'csv' else self._ndjson_page(page)
+
+    def _csv_page(self, page):
+        options = self.options
+        return self._csv(
+            [submission_id, created_at.isoformat()]
+            + [options.get(selected.get(question_id), '') for question_id, _ in self.questions]
+            for submission_id, created_at, selected in page
+        )
+
+    @staticmethod
+    def _csv(rows, bom=False):
+        buffer = io.StringIO()
+        if bom:
+            buffer.write('\ufeff')
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode('utf-8')
+
+    def _ndjson_page(self, page):
+        options = self.options
+        lines = []
+        for submission_id, created_at, selected in page:
+            lines.append(json.dumps({
+                'submission_id': submission_id,
+                'created_at': created_at.isoformat(),
+                'answers': {
+                    str(question_id): options.get(selected[question_id])
+                    for question_id, _ in self.questions if question_id in selected
+                },
+            }, ensure_ascii=False, separators=(',', ':')))
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    """Comprime al vuelo; cada trozo sale completo (flush) para no retener datos."""
+    compressor = zlib.compressobj(wbits=31)  # 31: formato gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def aiter_chunks(chunks):
+    """
+    Recorre 'chunks' (generador síncrono que consulta la BD) desde el event
+    loop, un trozo por paso por el pool de BD. StreamingHttpResponse con un
+    iterador síncrono bajo ASGI lo convertiría antes en una lista entera.
+    """
+    step = db_sync_to_async(next)
+    while True:
+        chunk = await step(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
@@ -0,0 +1,152 @@
+# questionnaires/importer.py
+"""
+Importación masiva de cuestionarios desde JSON o NDJSON.
+
+Cada registro tiene la misma forma que el cuerpo de POST /api/questionnaires/:
+
+    {"title": "...", "questions": [{"text": "...", "options": [{"text": "..."}]}]}
+
+El archivo puede ser un array JSON con esos objetos o un objeto por línea
+(NDJSON). Se lee por trozos y se decodifica registro a registro, así que la
+memoria no depende del tamaño del archivo sino del registro más grande y del
+lote (SURVEY_IMPORT_BATCH_SIZE).
+
+Cada lote se valida con QuestionnaireAdminSerializer y se inserta en su
+propia transacción con un INSERT por nivel (ver bulk). Los registros
+inválidos se saltan y se informan; si la importación se corta a medias, los
+lotes anteriores ya quedaron guardados.
+"""
+import codecs
+import json
+
+from django.conf import settings
+from django.db import transaction
+
+from . import bulk
+from .models import Questionnaire
+
+CHUNK_SIZE = 64 * 1024
+MAX_REPORTED_ERRORS = 50
+
+
+class ImportFormatError(ValueError):
+    """El archivo no es JSON/NDJSON válido; la importación no puede seguir."""
+
+
+def get_batch_size():
+    return getattr(settings, 'SURVEY_IMPORT_BATCH_SIZE', 200)
+
+
+def get_max_record_size():
+    return getattr(settings, 'SURVEY_IMPORT_MAX_RECORD_BYTES', 16 * 1024 * 1024)
+
+
+def iter_records(stream, chunk_size=CHUNK_SIZE, max_record_size=None):
+    """
+    Recorre los objetos de un array JSON o de un NDJSON leído de 'stream'
+    (cualquier objeto con read(n) que devuelva bytes en UTF-8).
+    """
+    max_record_size = max_record_size or get_max_record_size()
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer = ''
+    pos = 0
+    eof = False
+    in_array = None  # None hasta ver el primer carácter: '[' es un array, otro es NDJSON
+    closed = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + text_decoder.decode(chunk or b'', final=not chunk)
+        pos = 0
+        if len(buffer) > max_record_size:
+            raise ImportFormatError(f"Un registro supera el tamaño máximo ({max_record_size} bytes).")
+
+    while True:
+        while pos < len(buffer) and (buffer[pos].isspace() or (in_array and buffer[pos] == ',')):
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                break
+            fill()
+            continue
+        if closed:
+            raise ImportFormatError("Hay contenido después del cierre del array.")
+        if in_array is None:
+            in_array = buffer[pos] == '['
+            if in_array:
+                pos += 1
+            continue
+        if in_array and buffer[pos] == ']':
+            closed = True
+            pos += 1
+            continue
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as exc:
+            if eof:
+                raise ImportFormatError(f"JSON inválido: {exc.msg}.") from exc
+            # El registro sigue en el próximo trozo
+            fill()
+            continue
+        if end == len(buffer) and not eof and not isinstance(record, (dict, list)):
+            # Un número o literal al final del trozo puede estar cortado
+            fill()
+            continue
+        pos = end
+        yield record
+
+    if in_array and not closed:
+        raise ImportFormatError("El array JSON no está cerrado.")
+
+
+def import_questionnaires(stream, owner, batch_size=None):
+    """
+    Importa los cuestionarios de 'stream' a nombre de 'owner' (inactivos,
+    igual que al crearlos desde la API). Devuelve un resumen con lo creado y
+    los primeros MAX_REPORTED_ERRORS registros rechazados.
+    """
+    # Import local: serializers importa bulk y este módulo se usa desde las vistas
+    from .serializers import QuestionnaireAdminSerializer
+
+    batch_size = batch_size or get_batch_size()
+    summary = {'questionnaires': 0, 'questions': 0, 'options': 0, 'rejected': 0, 'errors': []}
+    batch = []
+
+    def flush():
+        questionnaires, questions, options = _create_batch(batch, owner)
+        summary['questionnaires'] += questionnaires
+        summary['questions'] += questions
+        summary['options'] += options
+        batch.clear()
+
+    for index, record in enumerate(iter_records(stream)):
+        if not isinstance(record, dict):
+            errors = {'non_field_errors': ["Cada registro debe ser un objeto JSON."]}
+        else:
+            serializer = QuestionnaireAdminSerializer(data=record)
+            errors = None if serializer.is_valid() else serializer.errors
+        if errors:
+            summary['rejected'] += 1
+            if len(summary['errors']) < MAX_REPORTED_ERRORS:
+                summary['errors'].append({'record': index, 'errors': errors})
+            continue
+        batch.append(serializer.validated_data)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return summary
+
+
+def _create_batch(batch, owner):
+    questionnaires = [Questionnaire(title=data['title'], created_by=owner) for data in batch]
+    with transaction.atomic():
+        bulk.create_questionnaires(questionnaires)
+        questions, options = bulk.create_structure(
+            [(questionnaire, data['questions']) for questionnaire, data in zip(questionnaires, batch)]
+        )
+    return len(questionnaires), questions, options
@@ -0,0 +1,270 @@
+# questionnaires/ingest.py
+"""
+Ingesta diferida (write-behind) de votos del WebSocket.
+
+Con SURVEY_VOTE_INGESTION = 'write_behind' el consumer no escribe en la BD en
+cada voto: lo deja en una cola acotada del proceso y difunde el cambio de
+inmediato como incremento ('deltas') sobre el estado en memoria de la sala.
+Un escritor en segundo plano vacía la cola por lotes: una transacción por
+lote, inserciones masivas y solo el último voto de cada (submission, pregunta).
+Tras cada lote se publican los conteos reales de las preguntas afectadas para
+corregir cualquier desviación del estado optimista. A esos conteos se suman
+los incrementos de los votos aceptados que aún no se han escrito (los que
+siguen en la cola): el valor absoluto sustituye a los incrementos pendientes
+de la sala y, sin ellos, esos votos desaparecerían hasta el siguiente lote.
+
+Pensado para eventos de mucha carga en los que el coste es el viaje a la BD por
+voto. Si la cola se llena el voto se rechaza y se contabiliza en 'dropped'.
+"""
+import asyncio
+import logging
+from collections import Counter, defaultdict, namedtuple
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from . import dashboard, rollups, tallies
+from .broadcast import broadcaster
+from .models import Answer, Option, Questionnaire, Submission
+from .resolver import resolver
+
+logger = logging.getLogger(__name__)
+
+# previous_option_id: la opción que la sesión tenía en esa pregunta según el consumer (None si no votó)
+PendingVote = namedtuple(
+    'PendingVote',
+    'access_code questionnaire_id session_key question_id option_id previous_option_id',
+    defaults=(None,),
+)
+
+
+def is_enabled():
+    return getattr(settings, 'SURVEY_VOTE_INGESTION', 'sync') == 'write_behind'
+
+
+class VoteWriter:
+    def __init__(self, maxsize, batch_size, flush_interval):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = None
+        self.task = None
+        self._leftover = []
+        self.unwritten = defaultdict(Counter)  # question_id -> {option_id: incremento} aún en la cola
+        self.accepted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.queue = asyncio.Queue(maxsize=self.maxsize)
+            self.task = loop.create_task(self._run())
+
+    def submit(self, vote):
+        """Encola un voto. Devuelve False si la cola está llena (el voto se descarta)."""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(vote)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Cola de votos llena: se descarta un voto de %s (descartados: %s)",
+                           vote.access_code, self.dropped)
+            return False
+        self.accepted += 1
+        self._track(vote, 1)
+        return True
+
+    def _track(self, vote, sign):
+        """Suma (sign=1, al aceptar) o resta (sign=-1, al escribir) el incremento optimista del voto."""
+        pending = self.unwritten[vote.question_id]
+        pending[vote.option_id] += sign
+        if vote.previous_option_id is not None:
+            pending[vote.previous_option_id] -= sign
+        for option_id in [option_id for option_id, delta in pending.items() if not delta]:
+            del pending[option_id]
+        if not pending:
+            del self.unwritten[vote.question_id]
+
+    def optimistic(self, question_id, stats):
+        """Conteos de la BD más los incrementos de los votos de la pregunta que aún no se escribieron."""
+        pending = self.unwritten.get(question_id)
+        if not pending:
+            return stats
+        return {option_id: max(count + pending.get(option_id, 0), 0) for option_id, count in stats.items()}
+
+    async def _run(self):
+        batch = []
+        try:
+            while True:
+                batch = [await self.queue.get()]
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                touched = await self._store(batch)
+                batch = []
+                await self._publish(touched)
+        except asyncio.CancelledError:
+            # Reescribir un lote es idempotente (mismas respuestas, delta 0), así
+            # que lo guardamos para flush() aunque ya se hubiera escrito
+            self._leftover = batch
+            raise
+
+    def _drain(self):
+        batch, self._leftover = self._leftover, []
+        while self.queue is not None and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def flush(self):
+        """Escribe ya todo lo pendiente (p. ej. al apagar el proceso)."""
+        batch = self._drain()
+        for start in range(0, len(batch), self.batch_size):
+            await self._publish(await self._store(batch[start:start + self.batch_size]))
+
+    async def stop(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        self.task = None
+        if self.dropped or self.failed:
+            logger.error("Escritura diferida detenida: %s votos descartados por cola llena, %s fallidos al escribir",
+                         self.dropped, self.failed)
+
+    async def _store(self, batch):
+        """Escribe un lote y deja de contar sus votos como pendientes. Devuelve los conteos (o {} si falla)."""
+        try:
+            touched = await write_votes(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Error escribiendo un lote de %s votos", len(batch))
+            touched = {}
+        else:
+            self.written += len(batch)
+        for vote in batch:
+            self._track(vote, -1)
+        return touched
+
+    async def _publish(self, touched):
+        # Conteos reales tras el lote (más lo que sigue en la cola): corrigen el estado optimista de las salas
+        channel_layer = get_channel_layer()
+        for access_code, stats_by_question in touched.items():
+            for question_id, stats in stats_by_question.items():
+                await broadcaster.publish(channel_layer, access_code, question_id, self.optimistic(question_id, stats))
+
+
+@database_sync_to_async
+def write_votes(batch):
+    """
+    Escribe un lote de votos en una transacción. Devuelve
+    {access_code: {question_id: {option_id: votos}}} con los conteos actualizados.
+    """
+    # Solo cuenta el último voto de cada sesión para cada pregunta
+    latest = {}
+    for vote in batch:
+        latest[(vote.questionnaire_id, vote.session_key, vote.question_id)] = vote
+    # Las salas reciben los conteos reales de todas las preguntas del lote, también de los votos descartados
+    question_codes = {vote.question_id: vote.access_code for vote in latest.values()}
+
+    with transaction.atomic():
+        # 0. Los cuestionarios que otro worker cerró mientras los votos esperaban en la cola
+        questionnaire_ids = {vote.questionnaire_id for vote in latest.values()}
+        open_ids = set(
+            Questionnaire.all_objects.filter(id__in=questionnaire_ids, is_active=True, is_deleted=False)
+            .values_list('id', flat=True)
+        )
+        votes = [vote for vote in latest.values() if vote.questionnaire_id in open_ids]
+        if len(votes) < len(latest):
+            closed = {vote.access_code for vote in latest.values() if vote.questionnaire_id not in open_ids}
+            logger.info("Descartados %s votos de cuestionarios cerrados: %s", len(latest) - len(votes), sorted(closed))
+            for access_code in closed:
+                resolver.invalidate(access_code)
+
+        # 1. Submissions: se leen las existentes y se crean solo las que falten.
+        # Se bloquean (en orden de id) para no intercalarse con otros votos de las mismas sesiones
+        keys = {(vote.questionnaire_id, vote.session_key) for vote in votes}
+        submissions = Submission.objects.select_for_update().filter(
+            questionnaire_id__in={q_id for q_id, _ in keys},
+            session_key__in={key for _, key in keys},
+        ).order_by('id')
+        submission_ids = {
+            (q_id, key): s_id for s_id, q_id, key in submissions.values_list('id', 'questionnaire_id', 'session_key')
+        }
+        missing = [key for key in keys if key not in submission_ids]
+        if missing:
+            Submission.objects.bulk_create(
+                [Submission(questionnaire_id=q_id, session_key=key) for q_id, key in missing],
+                ignore_conflicts=True,
+            )
+            submission_ids = {
+                (q_id, key): s_id for s_id, q_id, key in submissions.values_list('id', 'questionnaire_id', 'session_key')
+            }
+            # Respuestas nuevas del día por cuestionario
+            rollups.record_submissions(Counter(q_id for q_id, _ in missing))
+            transaction.on_commit(dashboard.notify_changed)
+
+        # 2. Opción anterior de esas submissions para esas preguntas
+        pairs = {(submission_ids[(v.questionnaire_id, v.session_key)], v.question_id): v for v in votes}
+        previous = Answer.objects.filter(
+            submission_id__in={s_id for s_id, _ in pairs},
+            question_id__in={q_id for _, q_id in pairs},
+        ).values_list('id', 'submission_id', 'question_id', 'selected_option_id')
+
+        deltas = {}
+        changed, existing = [], set()
+        for answer_id, submission_id, question_id, option_id in previous:
+            vote = pairs.get((submission_id, question_id))
+            if vote is None:
+                continue
+            existing.add((submission_id, question_id))
+            deltas[option_id] = deltas.get(option_id, 0) - 1
+            if option_id != vote.option_id:
+                changed.append(Answer(id=answer_id, selected_option_id=vote.option_id))
+
+        # 3. Un UPDATE para las respuestas que cambian y un INSERT para las nuevas. Las
+        # submissions están bloqueadas, así que el INSERT no choca. No se usa
+        # INSERT ... ON CONFLICT: MySQL no admite indicar la restricción en bulk_create
+        if changed:
+            Answer.objects.bulk_update(changed, ['selected_option'])
+        Answer.objects.bulk_create([
+            Answer(submission_id=submission_id, question_id=question_id, selected_option_id=vote.option_id)
+            for (submission_id, question_id), vote in pairs.items()
+            if (submission_id, question_id) not in existing
+        ])
+        for vote in votes:
+            deltas[vote.option_id] = deltas.get(vote.option_id, 0) + 1
+        tallies.apply_deltas(deltas, edited_options={answer.selected_option_id for answer in changed})
+
+    touched = {}
+    rows = Option.objects.filter(question_id__in=question_codes).values_list('question_id', 'id', 'tally__count')
+    for question_id, option_id, count in rows:
+        stats = touched.setdefault(question_codes[question_id], {}).setdefault(question_id, {})
+        stats[option_id] = count or 0
+    return touched
+
+
+vote_writer = VoteWriter(
+    maxsize=getattr(settings, 'SURVEY_VOTE_QUEUE_SIZE', 10000),
+    batch_size=getattr(settings, 'SURVEY_VOTE_BATCH_SIZE', 500),
+    flush_interval=getattr(settings, 'SURVEY_VOTE_FLUSH_MS', 200) / 1000.0,
+)
+
+
+async def shutdown():
+    """Hook de apagado: escribe los votos pendientes y envía los últimos mensajes."""
+    await vote_writer.stop()
+    await broadcaster.flush_all()
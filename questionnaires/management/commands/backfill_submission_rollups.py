@@ -0,0 +1,18 @@
+# questionnaires/management/commands/backfill_submission_rollups.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from questionnaires import rollups
+
+
+class Command(BaseCommand):
+    help = "Reconstruye los conteos diarios de respuestas (SubmissionRollup) a partir de las Submission."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questionnaire', type=int, action='append', dest='questionnaires',
+                            help="ID de cuestionario a procesar (se puede repetir). Por defecto, todos.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            written = rollups.rebuild(options['questionnaires'])
+        self.stdout.write(self.style.SUCCESS(f"Conteos diarios reconstruidos ({written} filas)."))
@@ -0,0 +1,35 @@
+# questionnaires/management/commands/build_answer_snapshots.py
+from django.core.management.base import BaseCommand, CommandError
+
+from questionnaires import snapshots
+from questionnaires.models import Questionnaire
+
+
+class Command(BaseCommand):
+    help = ("Crea o pone al día los snapshots columnares de respuestas (SURVEY_SNAPSHOT_DIR) "
+            "que usan la exportación y las tablas cruzadas.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questionnaire', type=int, action='append', dest='questionnaires',
+                            help="ID de cuestionario a procesar (se puede repetir). Por defecto, los cerrados.")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Rehace los snapshots desde cero en lugar de añadir las submissions nuevas.")
+
+    def handle(self, *args, **options):
+        if not snapshots.is_available():
+            raise CommandError("Los snapshots necesitan numpy.")
+        if options['questionnaires']:
+            ids = options['questionnaires']
+        else:
+            # Las encuestas cerradas ya no cambian: su snapshot sigue al día
+            ids = Questionnaire.objects.filter(is_active=False).order_by('id').values_list('id', flat=True)
+
+        for questionnaire_id in ids:
+            try:
+                rows, mode = snapshots.build(questionnaire_id, rebuild=options['rebuild'])
+            except Questionnaire.DoesNotExist:
+                raise CommandError(f"No existe el cuestionario {questionnaire_id}.")
+            except snapshots.SnapshotError as exc:
+                raise CommandError(f"Cuestionario {questionnaire_id}: {exc}")
+            self.stdout.write(f"Cuestionario {questionnaire_id}: {rows} respuestas ({mode}).")
+        self.stdout.write(self.style.SUCCESS("Snapshots al día."))
@@ -0,0 +1,41 @@
+# questionnaires/management/commands/import_questionnaires.py
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from questionnaires import importer
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Importa cuestionarios desde un archivo JSON (array) o NDJSON, leyéndolo por trozos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Archivo a importar ('-' para leer de la entrada estándar).")
+        parser.add_argument('--owner', required=True, help="Email del usuario dueño de los cuestionarios.")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Cuestionarios por transacción. Por defecto, SURVEY_IMPORT_BATCH_SIZE.")
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(email=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError(f"No existe el usuario {options['owner']}.")
+
+        try:
+            if options['path'] == '-':
+                summary = importer.import_questionnaires(sys.stdin.buffer, owner, options['batch_size'])
+            else:
+                with open(options['path'], 'rb') as stream:
+                    summary = importer.import_questionnaires(stream, owner, options['batch_size'])
+        except OSError as exc:
+            raise CommandError(str(exc))
+        except importer.ImportFormatError as exc:
+            raise CommandError(str(exc))
+
+        for error in summary['errors']:
+            self.stdout.write(f"Registro {error['record']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Importados {summary['questionnaires']} cuestionarios ({summary['questions']} preguntas, "
+            f"{summary['options']} opciones); {summary['rejected']} registros rechazados."
+        ))
@@ -0,0 +1,30 @@
+# questionnaires/management/commands/rebuild_tallies.py
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from questionnaires import tallies
+
+
+class Command(BaseCommand):
+    help = "Reconstruye (o verifica con --check) los conteos de votos por opción a partir de las respuestas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questionnaire', type=int, action='append', dest='questionnaires',
+                            help="ID de cuestionario a procesar (se puede repetir). Por defecto, todos.")
+        parser.add_argument('--check', action='store_true',
+                            help="Solo verifica; no modifica nada y falla si hay diferencias.")
+
+    def handle(self, *args, **options):
+        check_only = options['check']
+        with transaction.atomic():
+            mismatches = tallies.rebuild(options['questionnaires'], fix=not check_only)
+
+        for option_id, stored, actual in mismatches:
+            self.stdout.write(f"Opción {option_id}: guardado={stored} real={actual}")
+
+        if check_only and mismatches:
+            raise CommandError(f"{len(mismatches)} conteos no coinciden con las respuestas.")
+        if check_only:
+            self.stdout.write(self.style.SUCCESS("Todos los conteos coinciden."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Conteos reconstruidos ({len(mismatches)} corregidos)."))
@@ -0,0 +1,170 @@
+# questionnaires/management/commands/survey_http_bench.py
+"""
+Compara las vistas públicas síncronas (DRF) con las async bajo ASGI.
+
+Crea un cuestionario de prueba y, para cada modo, lanza N clientes
+concurrentes contra el handler ASGI de Django (con todos los middlewares, en
+este mismo proceso). Cada cliente tiene su propia sesión y hace el recorrido
+de un evaluado: carga el formulario, comprueba si ya respondió, envía sus
+respuestas y vuelve a cargar el formulario --reloads veces.
+
+Por modo se mide peticiones/s, latencia p50/p95/p99 por endpoint y los
+códigos de respuesta. Las vistas síncronas esperan su turno en el hilo de
+Django; las async solo pasan a un hilo para las consultas. El resultado se
+escribe como JSON para poder comparar ejecuciones.
+"""
+import asyncio
+import json
+import sys
+import time
+import types
+import uuid
+from collections import Counter, defaultdict
+
+from channels.db import database_sync_to_async
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, override_settings
+from django.urls import path
+
+from questionnaires import bulk, views
+from questionnaires.models import Option, Questionnaire
+from questionnaires.management.commands.survey_loadtest import _round, peak_rss_mb, percentile
+from users.models import User
+
+MODES = {
+    'sync': (views.PublicQuestionnaireView, views.CheckSubmissionView, views.SubmissionView),
+    'async': (views.AsyncPublicQuestionnaireView, views.AsyncCheckSubmissionView, views.AsyncSubmissionView),
+}
+
+
+def urlconf_for(mode):
+    """Módulo de URLs con solo las rutas públicas del modo indicado."""
+    form_view, check_view, submission_view = MODES[mode]
+    module = types.ModuleType(f'survey_http_bench_urls_{mode}')
+    module.urlpatterns = [
+        path('form/<str:access_code>/', form_view.as_view(), name='public-questionnaire'),
+        path('form/<str:access_code>/submit/', submission_view.as_view(), name='public-submission'),
+        path('check/', check_view.as_view(), name='public-check-submission'),
+    ]
+    sys.modules[module.__name__] = module
+    return module.__name__
+
+
+class Command(BaseCommand):
+    help = "Compara peticiones/s y latencia p99 de las vistas públicas síncronas y async con N clientes concurrentes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000, help="Clientes concurrentes (una sesión cada uno).")
+        parser.add_argument('--reloads', type=int, default=2, help="Recargas del formulario tras enviar.")
+        parser.add_argument('--questions', type=int, default=10, help="Preguntas del cuestionario de prueba.")
+        parser.add_argument('--options', type=int, default=4, help="Opciones por pregunta.")
+        parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both', help="Vistas a medir.")
+        parser.add_argument('--output', help="Fichero donde escribir el resultado JSON (por defecto, la salida estándar).")
+        parser.add_argument('--keep', action='store_true', help="No borrar el cuestionario ni las sesiones de prueba.")
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1:
+            raise CommandError("Se necesita al menos un cliente.")
+
+        questionnaire, answers = self.seed(options['questions'], options['options'])
+        modes = ['sync', 'async'] if options['mode'] == 'both' else [options['mode']]
+        session_keys = []
+        try:
+            result = asyncio.run(self.run_modes(modes, questionnaire.access_code, answers, options, session_keys))
+        finally:
+            if not options['keep']:
+                Questionnaire.all_objects.filter(id=questionnaire.id).delete()
+                Session.objects.filter(session_key__in=session_keys).delete()
+
+        if 'sync' in result and 'async' in result:
+            result['speedup'] = round(result['async']['requests_per_second'] / result['sync']['requests_per_second'], 2)
+        result['config'] = {key: options[key] for key in ('clients', 'reloads', 'questions', 'options')}
+        result['peak_rss_mb'] = peak_rss_mb()
+        output = json.dumps(result, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(
+                ', '.join(f"{mode}: {result[mode]['requests_per_second']} req/s, "
+                          f"p99 {result[mode]['latency_ms']['all']['p99']} ms" for mode in modes)
+                + f" -> {options['output']}"
+            ))
+        else:
+            self.stdout.write(output)
+
+    def seed(self, questions, options):
+        user, _ = User.objects.get_or_create(
+            email='loadtest@side.local',
+            defaults={'username': 'loadtest', 'is_active': False},
+        )
+        questionnaire = Questionnaire.objects.create(
+            title=f"Prueba HTTP {uuid.uuid4().hex[:6]}", created_by=user, is_active=True,
+        )
+        bulk.create_structure([(questionnaire, [
+            {'text': f"Pregunta {q_index + 1}", 'options': [{'text': f"Opción {o_index + 1}"} for o_index in range(options)]}
+            for q_index in range(questions)
+        ])])
+        first_options = {}
+        for question_id, option_id in Option.objects.filter(question__questionnaire=questionnaire)\
+                .order_by('id').values_list('question_id', 'id'):
+            first_options.setdefault(question_id, option_id)
+        answers = [{'question_id': q_id, 'option_id': o_id} for q_id, o_id in first_options.items()]
+        return questionnaire, answers
+
+    async def run_modes(self, modes, access_code, answers, options, session_keys):
+        # Un solo event loop para todos los modos: el channel layer queda ligado al primero
+        result = {}
+        for mode in modes:
+            with override_settings(ROOT_URLCONF=urlconf_for(mode), ALLOWED_HOSTS=['testserver']):
+                result[mode] = await self.run(access_code, answers, options, session_keys)
+        await database_sync_to_async(connections.close_all)()
+        return result
+
+    async def run(self, access_code, answers, options, session_keys):
+        form_url = f'/form/{access_code}/'
+        submit_url = f'/form/{access_code}/submit/'
+        check_url = '/check/'
+        latencies = defaultdict(list)
+        statuses = Counter()
+
+        async def timed(endpoint, request):
+            started = time.perf_counter()
+            response = await request
+            latencies[endpoint].append((time.perf_counter() - started) * 1000.0)
+            statuses[f'{endpoint}:{response.status_code}'] += 1
+            return response
+
+        async def evaluated(client):
+            await timed('form', client.get(form_url))
+            await timed('check', client.post(check_url, {'access_code': access_code}, content_type='application/json'))
+            await timed('submit', client.post(submit_url, {'answers': answers}, content_type='application/json'))
+            for _ in range(options['reloads']):
+                await timed('form', client.get(form_url))
+
+        # Calentamiento: resolver y caché del formulario ya llenos, como en producción
+        await AsyncClient().get(form_url)
+
+        clients = [AsyncClient() for _ in range(options['clients'])]
+        started = time.perf_counter()
+        await asyncio.gather(*(evaluated(client) for client in clients))
+        elapsed = time.perf_counter() - started
+
+        session_keys.extend(client.cookies['sessionid'].value for client in clients if 'sessionid' in client.cookies)
+
+        every = [value for values in latencies.values() for value in values]
+        return {
+            'requests': len(every),
+            'duration_s': round(elapsed, 3),
+            'requests_per_second': round(len(every) / elapsed, 1) if elapsed else None,
+            'latency_ms': {
+                endpoint: {
+                    'p50': _round(percentile(values, 0.50)),
+                    'p95': _round(percentile(values, 0.95)),
+                    'p99': _round(percentile(values, 0.99)),
+                }
+                for endpoint, values in dict(latencies, all=every).items()
+            },
+            'statuses': dict(sorted(statuses.items())),
+        }
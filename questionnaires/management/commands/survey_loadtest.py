@@ -0,0 +1,260 @@
+# questionnaires/management/commands/survey_loadtest.py
+"""
+Prueba de carga del flujo de votación en vivo.
+
+Crea un cuestionario de prueba, conecta N votantes y M observadores a
+SurveyConsumer con el WebsocketCommunicator de channels (en este mismo proceso,
+con el channel layer configurado) y mide:
+
+- votos por segundo,
+- latencia voto -> difusión (p50/p95/p99): desde que un votante envía su voto
+  hasta que su propio socket recibe una actualización de esa pregunta,
+- consultas a la BD por voto,
+- pico de memoria (RSS) del proceso.
+
+Cada votante espera su actualización antes de enviar el siguiente voto (bucle
+cerrado), así que los votos/s reflejan lo que aguanta el servidor. El
+resultado se escribe como JSON para poder comparar ejecuciones.
+"""
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from questionnaires import ingest
+from questionnaires.models import Option, Question, Questionnaire
+from questionnaires.routing import websocket_urlpatterns
+from users.models import User
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class QueryCounter:
+    """Cuenta las consultas de todas las conexiones (los consumers usan hilos del executor)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        for connection in connections.all():
+            self.install(connection)
+        connection_created.connect(self.install)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.install)
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # En Linux ru_maxrss está en KB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def touched_questions(message):
+    if message.get('type') == 'stats_update':
+        return set(message.get('updates', {}))
+    if message.get('type') == 'stats_delta':
+        return set(message.get('changes', {}))
+    return set()
+
+
+class Command(BaseCommand):
+    help = "Simula votantes y observadores por WebSocket y mide el rendimiento de la votación en vivo."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, default=50, help="Votantes concurrentes.")
+        parser.add_argument('--watchers', type=int, default=200, help="Observadores pasivos (solo reciben).")
+        parser.add_argument('--votes', type=int, default=20, help="Votos que envía cada votante.")
+        parser.add_argument('--questions', type=int, default=5, help="Preguntas del cuestionario de prueba.")
+        parser.add_argument('--options', type=int, default=4, help="Opciones por pregunta.")
+        parser.add_argument('--protocol', type=int, choices=[1, 2], default=1, help="Versión del protocolo de estadísticas.")
+        parser.add_argument('--timeout', type=float, default=5.0, help="Segundos máximos de espera por difusión.")
+        parser.add_argument('--seed', type=int, default=None, help="Semilla para elegir los votos.")
+        parser.add_argument('--output', help="Fichero donde escribir el resultado JSON (por defecto, la salida estándar).")
+        parser.add_argument('--keep', action='store_true', help="No borrar el cuestionario ni las sesiones de prueba.")
+
+    def handle(self, *args, **options):
+        if options['voters'] < 1 or options['votes'] < 1:
+            raise CommandError("Se necesita al menos un votante y un voto.")
+
+        questionnaire, structure = self.seed(options['questions'], options['options'])
+        sessions = [self.create_session() for _ in range(options['voters'])]
+        try:
+            # El contador se instala antes de abrir los sockets: las conexiones a la BD
+            # que usan los consumers se crean (o heredan) desde este momento
+            with QueryCounter() as queries:
+                result = asyncio.run(self.run(questionnaire.access_code, structure, sessions, options, queries))
+        finally:
+            if not options['keep']:
+                Questionnaire.all_objects.filter(id=questionnaire.id).delete()
+                for session in sessions:
+                    session.delete()
+
+        result['config'] = {
+            key: options[key]
+            for key in ('voters', 'watchers', 'votes', 'questions', 'options', 'protocol', 'timeout', 'seed')
+        }
+        result['config']['ingestion'] = 'write_behind' if ingest.is_enabled() else 'sync'
+        output = json.dumps(result, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(
+                f"{result['votes_per_second']} votos/s, p95 {result['latency_ms']['p95']} ms -> {options['output']}"
+            ))
+        else:
+            self.stdout.write(output)
+
+    def seed(self, questions, options):
+        user, _ = User.objects.get_or_create(
+            email='loadtest@side.local',
+            defaults={'username': 'loadtest', 'is_active': False},
+        )
+        questionnaire = Questionnaire.objects.create(
+            title=f"Prueba de carga {uuid.uuid4().hex[:6]}", created_by=user, is_active=True,
+        )
+        structure = {}
+        for q_index in range(questions):
+            question = Question.objects.create(questionnaire=questionnaire, text=f"Pregunta {q_index + 1}")
+            option_ids = [
+                Option.objects.create(question=question, text=f"Opción {o_index + 1}").id
+                for o_index in range(options)
+            ]
+            structure[question.id] = option_ids
+        return questionnaire, structure
+
+    def create_session(self):
+        session = SessionStore()
+        session.create()
+        return session
+
+    async def run(self, access_code, structure, sessions, options, queries):
+        application = URLRouter(websocket_urlpatterns)
+        path = f'/ws/survey/{access_code}/' + ('?protocol=2' if options['protocol'] == 2 else '')
+        rng = random.Random(options['seed'])
+        timeout = options['timeout']
+
+        async def connect(session=None):
+            communicator = WebsocketCommunicator(application, path)
+            communicator.scope['session'] = session if session is not None else SessionStore()
+            connected, _ = await communicator.connect(timeout=timeout)
+            if not connected:
+                raise CommandError("El consumer rechazó la conexión.")
+            await communicator.receive_from(timeout=timeout)  # snapshot / initial_stats
+            return communicator
+
+        watchers = [await connect() for _ in range(options['watchers'])]
+        voters = [await connect(session) for session in sessions]
+
+        latencies = []
+        counters = {'timeouts': 0, 'rejected': 0, 'watcher_messages': 0}
+
+        async def receive(communicator, timeout):
+            # Si receive_from agota su propio timeout cancela el consumer; con
+            # wait_for solo se cancela la espera y el socket sigue vivo
+            return await asyncio.wait_for(communicator.receive_from(timeout=3600), timeout)
+
+        async def watch(communicator):
+            while True:
+                await communicator.receive_from(timeout=3600)
+                counters['watcher_messages'] += 1
+
+        async def vote(communicator):
+            questions = list(structure)
+            selections = {}
+            for _ in range(options['votes']):
+                question_id = rng.choice(questions)
+                # Repetir la opción ya elegida no cambia nada y no genera difusión
+                previous = selections.get(question_id)
+                choices = [o for o in structure[question_id] if o != previous] or structure[question_id]
+                option_id = selections[question_id] = rng.choice(choices)
+                started = time.perf_counter()
+                await communicator.send_to(text_data=json.dumps({'question_id': question_id, 'option_id': option_id}))
+                deadline = started + timeout
+                while True:
+                    remaining = deadline - time.perf_counter()
+                    try:
+                        message = json.loads(await receive(communicator, max(remaining, 0.001)))
+                    except asyncio.TimeoutError:
+                        counters['timeouts'] += 1
+                        break
+                    if message.get('type') == 'vote_rejected':
+                        counters['rejected'] += 1
+                        break
+                    if str(question_id) in touched_questions(message):
+                        latencies.append((time.perf_counter() - started) * 1000.0)
+                        break
+
+        watch_tasks = [asyncio.ensure_future(watch(communicator)) for communicator in watchers]
+        queries_before = queries.count
+        started = time.perf_counter()
+        await asyncio.gather(*(vote(communicator) for communicator in voters))
+        elapsed = time.perf_counter() - started
+        if ingest.is_enabled():
+            # Las escrituras diferidas también cuentan como consultas del voto
+            await ingest.vote_writer.stop()
+        vote_queries = queries.count - queries_before
+
+        for task in watch_tasks:
+            task.cancel()
+        await asyncio.gather(*watch_tasks, return_exceptions=True)
+        for communicator in voters + watchers:
+            await communicator.disconnect()
+        await database_sync_to_async(connections.close_all)()
+
+        total_votes = len(voters) * options['votes']
+        return {
+            'votes': total_votes,
+            'duration_s': round(elapsed, 3),
+            'votes_per_second': round(total_votes / elapsed, 1) if elapsed else None,
+            'latency_ms': {
+                'p50': _round(percentile(latencies, 0.50)),
+                'p95': _round(percentile(latencies, 0.95)),
+                'p99': _round(percentile(latencies, 0.99)),
+                'max': _round(max(latencies) if latencies else None),
+            },
+            'broadcasts_measured': len(latencies),
+            'timeouts': counters['timeouts'],
+            'rejected': counters['rejected'],
+            'watcher_messages': counters['watcher_messages'],
+            'db_queries': vote_queries,
+            'db_queries_per_vote': round(vote_queries / total_votes, 2),
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
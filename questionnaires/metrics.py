@@ -0,0 +1,62 @@
+# questionnaires/metrics.py
+"""Métricas de la votación en vivo (se exportan en /metrics, ver core/metrics.py)."""
+from core.metrics import SIZE_BUCKETS, registry
+
+VOTES = registry.counter(
+    'survey_votes_total', "Votos recibidos (rate() da votos/s).", ['channel'])
+WS_VOTES = VOTES.labels('websocket')
+HTTP_VOTES = VOTES.labels('http')
+
+SUBMISSIONS = registry.counter(
+    'survey_submissions_total', "Envíos del formulario público por resultado.", ['result'])
+
+ACCESS_CODE_LOOKUPS = registry.counter(
+    'survey_access_code_lookups_total', "Búsquedas de access_code en la caché del resolver.", ['result'])
+
+BROADCAST_FANOUT = registry.histogram(
+    'survey_broadcast_fanout', "Sockets de este proceso que reciben cada actualización de sala.",
+    buckets=SIZE_BUCKETS)
+
+
+# Las funciones importan los módulos al exportar: este módulo lo importan
+# rooms, ingest y los consumers, así evitamos importaciones circulares.
+
+def _connections_per_room():
+    from .rooms import rooms
+    return {(code,): room.subscribers for code, room in list(rooms.rooms.items()) if room.subscribers}
+
+
+def _outbound(key):
+    def read():
+        from . import outbound
+        return outbound.metrics()[key]
+    return read
+
+
+def _vote_writer(attribute):
+    def read():
+        from .ingest import vote_writer
+        if attribute == 'depth':
+            return vote_writer.queue.qsize() if vote_writer.queue is not None else 0
+        return getattr(vote_writer, attribute)
+    return read
+
+
+registry.gauge_function(
+    'survey_ws_connections', "Sockets de encuesta conectados por sala.", _connections_per_room, ['room'])
+registry.gauge_function(
+    'survey_outbound_queued', "Preguntas pendientes de enviar en las colas de salida.", _outbound('queued'))
+registry.gauge_function(
+    'survey_outbound_max_queued', "Cola de salida más larga.", _outbound('max_queued'))
+registry.counter_function(
+    'survey_outbound_coalesced_total', "Frames sustituidos por uno más reciente antes de enviarse.",
+    _outbound('coalesced'))
+registry.counter_function(
+    'survey_outbound_lagging_disconnects_total', "Sockets desconectados por ir retrasados.",
+    _outbound('lagging_disconnects'))
+registry.gauge_function(
+    'survey_vote_queue_depth', "Votos en la cola de escritura diferida.",
+    _vote_writer('depth'))
+registry.counter_function(
+    'survey_vote_queue_dropped_total', "Votos descartados por cola de escritura llena.",
+    _vote_writer('dropped'))
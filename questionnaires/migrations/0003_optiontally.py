@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_tallies(apps, schema_editor):
+    # Calcula los conteos iniciales a partir de las Answer existentes
+    Option = apps.get_model('questionnaires', 'Option')
+    OptionTally = apps.get_model('questionnaires', 'OptionTally')
+    options = Option.objects.annotate(votes=Count('answer')).values_list('id', 'question_id', 'question__questionnaire_id', 'votes')
+    OptionTally.objects.bulk_create(
+        [
+            OptionTally(option_id=option_id, question_id=question_id, questionnaire_id=questionnaire_id, count=votes)
+            for option_id, question_id, questionnaire_id, votes in options.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaires', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OptionTally',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('option', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='tally', to='questionnaires.option')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tallies', to='questionnaires.question')),
+                ('questionnaire', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tallies', to='questionnaires.questionnaire')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['questionnaire', 'question'], name='questionnai_questio_99f3a1_idx')],
+            },
+        ),
+        migrations.RunPython(populate_tallies, migrations.RunPython.noop),
+    ]
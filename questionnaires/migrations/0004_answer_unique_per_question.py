@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:47
+
+from collections import Counter
+
+from django.db import migrations
+from django.db.models import Count, F, Max
+
+
+def dedupe_answers(apps, schema_editor):
+    # Deja solo la respuesta más reciente (id mayor) de cada (submission, pregunta)
+    # y descuenta de OptionTally los votos que se eliminan
+    Answer = apps.get_model('questionnaires', 'Answer')
+    OptionTally = apps.get_model('questionnaires', 'OptionTally')
+    duplicated = Answer.objects.values('submission_id', 'question_id')\
+        .annotate(total=Count('id'), keep=Max('id')).filter(total__gt=1)
+
+    for group in duplicated.iterator():
+        stale = Answer.objects.filter(
+            submission_id=group['submission_id'],
+            question_id=group['question_id'],
+        ).exclude(id=group['keep'])
+        removed = Counter(stale.values_list('selected_option_id', flat=True))
+        stale.delete()
+        for option_id, votes in removed.items():
+            OptionTally.objects.filter(option_id=option_id).update(count=F('count') - votes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaires', '0003_optiontally'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_answers, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='answer',
+            unique_together={('submission', 'question')},
+        ),
+    ]
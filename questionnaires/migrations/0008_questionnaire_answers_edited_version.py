@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaires', '0007_submissionrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionnaire',
+            name='answers_edited_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
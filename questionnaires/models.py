@@ -3,6 +3,9 @@ from django.db import models
 from users.models import User
 import uuid
 
+def new_access_code():
+    return str(uuid.uuid4())[:6].upper()
+
 # Manager para el borrado lógico
 class SoftDeleteManager(models.Manager):
     def get_queryset(self):
@@ -17,14 +20,36 @@ class Questionnaire(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Versión de las estadísticas: sube con cada voto escrito (tallies.bump_stats_version).
+    # Solo se modifica con UPDATE ... F() + 1, nunca desde save().
+    stats_version = models.PositiveBigIntegerField(default=0)
+    stats_updated_at = models.DateTimeField(null=True, blank=True)
+    # stats_version de la última vez que se cambió un voto ya guardado (no solo se añadió).
+    # Los snapshots la usan para saber si pueden añadir filas o tienen que rehacerse.
+    answers_edited_version = models.PositiveBigIntegerField(default=0)
+
     # Borrado Lógico
     is_deleted = models.BooleanField(default=False)
     objects = SoftDeleteManager() # Manager por defecto
     all_objects = models.Manager() # Manager para acceder a todos, incluyendo borrados
 
+    class Meta:
+        indexes = [
+            # Lista del admin: sus cuestionarios ordenados por (updated_at, id) para el cursor
+            models.Index(fields=['created_by', 'updated_at', 'id']),
+        ]
+
+    STATS_FIELDS = ('stats_version', 'stats_updated_at', 'answers_edited_version')
+
     def save(self, *args, **kwargs):
         if not self.access_code:
-            self.access_code = str(uuid.uuid4())[:6].upper()
+            self.access_code = new_access_code()
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # Una instancia cargada antes de un voto no debe devolver la versión a un valor viejo
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.STATS_FIELDS
+            ]
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -53,7 +78,70 @@ class Submission(models.Model):
     class Meta:
         unique_together = ('questionnaire', 'session_key') # Un usuario (sesión) solo puede responder una vez
 
+class AnswerManager(models.Manager):
+    def upsert(self, submission_id, question_id, option_id):
+        """
+        Guarda la opción elegida por la submission para la pregunta con una sola
+        escritura (UPDATE si ya había respuesta, INSERT si no) y devuelve la
+        opción anterior (None si no había respuesta).
+
+        Debe llamarse dentro de una transacción con la submission bloqueada
+        (select_for_update): así la lectura de la opción anterior y la escritura
+        no se intercalan con otro voto de la misma sesión y el INSERT no puede
+        chocar. No usa INSERT ... ON CONFLICT: MySQL no admite indicar la
+        restricción (unique_fields) en bulk_create.
+        """
+        rows = self.filter(submission_id=submission_id, question_id=question_id)
+        old_option_id = rows.values_list('selected_option_id', flat=True).first()
+        if old_option_id is None:
+            self.create(submission_id=submission_id, question_id=question_id, selected_option_id=option_id)
+        elif old_option_id != option_id:
+            rows.update(selected_option_id=option_id)
+        return old_option_id
+
 class Answer(models.Model):
     submission = models.ForeignKey(Submission, related_name='answers', on_delete=models.CASCADE)
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
-    selected_option = models.ForeignKey(Option, on_delete=models.CASCADE)
\ No newline at end of file
+    selected_option = models.ForeignKey(Option, on_delete=models.CASCADE)
+
+    objects = AnswerManager()
+
+    class Meta:
+        unique_together = ('submission', 'question') # Una sola respuesta por pregunta en cada submission
+
+# Respuestas (submissions) recibidas por cuestionario y día.
+# Se suma en la misma transacción que crea cada Submission (questionnaires/rollups.py)
+# y se reconstruye con 'manage.py backfill_submission_rollups'. El dueño se copia
+# aquí para agregar por usuario sin unir con Questionnaire.
+class SubmissionRollup(models.Model):
+    questionnaire = models.ForeignKey(Questionnaire, related_name='daily_submissions', on_delete=models.CASCADE)
+    owner = models.ForeignKey(User, related_name='daily_submissions', on_delete=models.CASCADE)
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('questionnaire', 'day')
+        indexes = [
+            models.Index(fields=['day']),
+            models.Index(fields=['owner', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.questionnaire_id} {self.day}: {self.count}"
+
+# Conteo desnormalizado de votos por opción.
+# Se mantiene dentro de la misma transacción que crea/borra las Answer,
+# así las estadísticas en vivo salen de una sola lectura indexada.
+class OptionTally(models.Model):
+    questionnaire = models.ForeignKey(Questionnaire, related_name='tallies', on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, related_name='tallies', on_delete=models.CASCADE)
+    option = models.OneToOneField(Option, related_name='tally', on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['questionnaire', 'question']),
+        ]
+
+    def __str__(self):
+        return f"{self.option_id}: {self.count}"
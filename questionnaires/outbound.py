@@ -0,0 +1,116 @@
+# questionnaires/outbound.py
+"""
+Cola de salida acotada de cada socket de encuesta.
+
+El handler de la sala no espera a que el cliente reciba nada: solo marca qué
+preguntas cambiaron. Una tarea por socket envía los cambios construyendo el
+mensaje con el estado actual de la sala en el momento del envío, así que la
+cola guarda como mucho una entrada por pregunta (la última gana) y un cliente
+lento nunca acumula frames viejos.
+
+Si un cliente tiene cambios pendientes durante más de SURVEY_OUTBOUND_MAX_LAG_MS
+se le desconecta con el código CLOSE_RESYNC: al reconectar pide 'resync' y
+recibe solo lo que le falta.
+
+Si un envío falla, la cola se cierra y avisa a 'on_error' (el consumer
+cierra el socket): la tarea no muere en silencio dejando al cliente sin
+actualizaciones.
+"""
+import asyncio
+import logging
+import time
+import weakref
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Código de cierre: "vas retrasado, reconecta y sincroniza"
+CLOSE_RESYNC = 4008
+
+_queues = weakref.WeakSet()
+_totals = {'coalesced': 0, 'lagging_disconnects': 0}
+
+
+def get_max_lag():
+    return getattr(settings, 'SURVEY_OUTBOUND_MAX_LAG_MS', 5000) / 1000.0
+
+
+class OutboundQueue:
+    def __init__(self, send_changes, max_lag, on_error=None):
+        self.send_changes = send_changes  # corrutina(question_ids) que envía el mensaje
+        self.on_error = on_error  # corrutina sin argumentos si falla un envío
+        self.max_lag = max_lag
+        self.pending = set()
+        self.oldest = None  # cuándo entró el cambio pendiente más antiguo
+        self.coalesced = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        _queues.add(self)
+
+    @property
+    def depth(self):
+        return len(self.pending)
+
+    def mark(self, question_ids):
+        """
+        Anota las preguntas con cambios. Devuelve False si el cliente lleva
+        demasiado tiempo sin vaciar la cola y hay que desconectarlo.
+        """
+        now = time.monotonic()
+        if self.oldest is not None and now - self.oldest > self.max_lag:
+            return False
+        for question_id in question_ids:
+            if question_id in self.pending:
+                # El frame anterior de esta pregunta ya no se enviará
+                self.coalesced += 1
+                _totals['coalesced'] += 1
+            else:
+                self.pending.add(question_id)
+        if self.oldest is None:
+            self.oldest = now
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return True
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self.pending:
+                continue
+            question_ids, self.pending = self.pending, set()
+            # Los cambios que lleguen mientras se envía cuentan su antigüedad desde que llegan
+            self.oldest = None
+            try:
+                await self.send_changes(question_ids)
+            except Exception:
+                logger.exception("Error enviando cambios por el socket; se cierra la cola de salida")
+                self._task = None  # es esta misma tarea: close() no debe cancelarla
+                self.close()
+                if self.on_error is not None:
+                    await self.on_error()
+                return
+
+    def close(self, lagging=False):
+        if lagging:
+            _totals['lagging_disconnects'] += 1
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.pending = set()
+        self.oldest = None
+        _queues.discard(self)
+
+
+def metrics():
+    """Estado de las colas de salida de este proceso."""
+    depths = [queue.depth for queue in list(_queues)]
+    return {
+        'sockets': len(depths),
+        'queued': sum(depths),
+        'max_queued': max(depths, default=0),
+        'coalesced': _totals['coalesced'],
+        'lagging_disconnects': _totals['lagging_disconnects'],
+    }
@@ -0,0 +1,15 @@
+# questionnaires/pagination.py
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class QuestionnaireCursorPagination(CursorPagination):
+    """
+    Paginación por cursor de la lista de cuestionarios del admin: los más
+    recientes primero. El cursor guarda la posición (updated_at, id), así que
+    pedir la página 50 cuesta lo mismo que la primera, sin OFFSET.
+    """
+    ordering = ('-updated_at', '-id')
+    page_size = getattr(settings, 'QUESTIONNAIRE_LIST_PAGE_SIZE', 24)
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -0,0 +1,122 @@
+# questionnaires/public_cache.py
+"""
+Caché del formulario público (GET /api/questionnaires/public/forms/<code>/).
+
+El JSON del cuestionario (preguntas -> opciones) se serializa una vez por
+edición y se guarda ya codificado en la caché de Django junto con su ETag, así
+que una página que cargan miles de evaluados no toca la BD mientras no cambie.
+
+Las entradas se guardan por access_code y versión. La versión es el
+updated_at del cuestionario tal como lo da el resolver, que lo lee de la BD:
+editar, activar o desactivar y borrar guardan el cuestionario y cambian la
+clave. No hace falta invalidar nada, así que vale en todos los workers
+aunque cada uno tenga su propia caché; un worker ve el cambio cuando su
+resolver lo ve. Lo que escriba una petición que aún serializaba la versión
+anterior queda bajo la clave vieja y no puede pisar a la nueva.
+"""
+import hashlib
+import json
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Questionnaire
+from .serializers import QuestionnairePublicSerializer
+
+INACTIVE_DETAIL = "Esta encuesta ha sido desactivada por el administrador."
+
+
+def get_cache():
+    return caches[getattr(settings, 'SURVEY_PUBLIC_CACHE', 'default')]
+
+
+def get_ttl():
+    return getattr(settings, 'SURVEY_PUBLIC_CACHE_TTL', 3600)
+
+
+def _payload_key(ref):
+    version = int(ref.updated_at.timestamp() * 1000000)
+    return f'public_form:{ref.access_code}:{version}'
+
+
+def _render(access_code):
+    """
+    Devuelve (status, etag, body) del formulario, o None si el código no existe.
+    Dos consultas: el cuestionario y sus preguntas con todas sus opciones.
+    """
+    questionnaire = (
+        Questionnaire.objects
+        .prefetch_related('questions__options')
+        .filter(access_code=access_code)
+        .first()
+    )
+    if questionnaire is None:
+        return None
+    if not questionnaire.is_active:
+        body = json.dumps({'detail': INACTIVE_DETAIL}).encode()
+        return status.HTTP_403_FORBIDDEN, None, body
+    # Sin request en el contexto: el logo sale como ruta relativa y el JSON
+    # es el mismo para todos los hosts
+    data = QuestionnairePublicSerializer(questionnaire).data
+    body = json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+    etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+    return status.HTTP_200_OK, etag, body
+
+
+def get_payload(ref):
+    """(status, etag, body) del QuestionnaireRef desde la caché, serializando solo si falta."""
+    cache = get_cache()
+    key = _payload_key(ref)
+    payload = cache.get(key)
+    if payload is None:
+        payload = _store(cache, key, ref.access_code)
+    return payload
+
+
+async def aget_payload(ref):
+    """get_payload() para vistas async."""
+    cache = get_cache()
+    key = _payload_key(ref)
+    if isinstance(cache, LocMemCache):
+        # La caché local no hace E/S: se lee sin salir del event loop
+        payload = cache.get(key)
+    else:
+        payload = await cache.aget(key)
+    if payload is None:
+        # Serializar sí consulta la BD: en un hilo
+        payload = await database_sync_to_async(_store)(cache, key, ref.access_code)
+    return payload
+
+
+def _store(cache, key, access_code):
+    payload = _render(access_code)
+    if payload is not None:
+        cache.set(key, payload, get_ttl())
+    return payload
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match or etag is None:
+        return False
+    # If-None-Match usa comparación débil: W/"x" coincide con "x"
+    candidates = [value.strip().removeprefix('W/') for value in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+def response_for(request, payload):
+    """Respuesta HTTP del formulario, o 304 si el cliente ya tiene esta versión."""
+    status_code, etag, body = payload
+    if status_code == status.HTTP_200_OK and etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, status=status_code, content_type='application/json')
+    if etag is not None:
+        response['ETag'] = etag
+        # Se puede guardar pero hay que revalidar: un 304 cuesta una consulta a la caché
+        response['Cache-Control'] = 'no-cache'
+    return response
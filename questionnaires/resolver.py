@@ -0,0 +1,170 @@
+# questionnaires/resolver.py
+"""
+Resolución por proceso de access_code -> (id, is_active, is_deleted, updated_at).
+
+Todas las entradas públicas (formulario, envío, comprobación y sockets de
+votación) empiezan por la misma búsqueda. El resolver la guarda en un LRU en
+memoria, así que un flujo de voto normal no consulta la BD para saber de qué
+cuestionario se trata.
+
+- Los códigos que no existen también se guardan (caché negativa), en un LRU
+  aparte y más corto: probar códigos al azar no llega a la BD más de una vez
+  por código y tampoco expulsa a los cuestionarios reales.
+- Las señales post_save/post_delete de Questionnaire invalidan el código al
+  crear, activar/desactivar o borrar (también tras el commit). Los cambios
+  con QuerySet.update() o bulk_create no envían señales: quien los haga debe
+  llamar a invalidate().
+- Cada proceso tiene su propia caché y las señales solo llegan al proceso que
+  hizo el cambio: en los demás workers una entrada dura como mucho
+  SURVEY_ACCESS_CODE_CACHE_TTL segundos. Para leer basta; las escrituras
+  (envíos y votos) confirman con confirm_open() en la BD que el cuestionario
+  sigue abierto, así que otro worker no acepta respuestas de uno desactivado
+  o borrado aunque su caché aún no lo sepa.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .metrics import ACCESS_CODE_LOOKUPS
+from .models import Questionnaire
+
+
+class QuestionnaireClosed(Exception):
+    """El cuestionario ya no acepta respuestas (comprobado en la BD al escribir)."""
+
+
+class QuestionnaireRef(namedtuple('QuestionnaireRef', ['id', 'access_code', 'is_active', 'is_deleted', 'updated_at'])):
+    __slots__ = ()
+
+    @property
+    def is_open(self):
+        """Acepta respuestas: activo y no borrado."""
+        return self.is_active and not self.is_deleted
+
+
+def get_cache_size():
+    return getattr(settings, 'SURVEY_ACCESS_CODE_CACHE_SIZE', 10000)
+
+
+def get_cache_ttl():
+    return getattr(settings, 'SURVEY_ACCESS_CODE_CACHE_TTL', 60)
+
+
+def get_negative_cache_size():
+    return getattr(settings, 'SURVEY_ACCESS_CODE_NEGATIVE_CACHE_SIZE', 10000)
+
+
+def get_negative_cache_ttl():
+    return getattr(settings, 'SURVEY_ACCESS_CODE_NEGATIVE_CACHE_TTL', 30)
+
+
+class _LRU:
+    """OrderedDict con tamaño máximo y caducidad. Lo usan hilos y el event loop: lock corto."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # clave -> (caduca_en, valor)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class AccessCodeResolver:
+
+    def __init__(self):
+        self.found = _LRU(get_cache_size(), get_cache_ttl())
+        self.missing = _LRU(get_negative_cache_size(), get_negative_cache_ttl())
+
+    def resolve(self, access_code):
+        """QuestionnaireRef del código (incluidos los borrados) o None si no existe."""
+        cached, ref = self.cached(access_code)
+        if cached:
+            return ref
+        return self._load(access_code)
+
+    async def aresolve(self, access_code):
+        """Igual que resolve() desde código async: solo sale del event loop si falta."""
+        cached, ref = self.cached(access_code)
+        if cached:
+            return ref
+        return await database_sync_to_async(self._load)(access_code)
+
+    def cached(self, access_code):
+        """(True, ref) si el código está en caché (ref es None si no existe); (False, None) si no."""
+        found, ref = self.found.get(access_code)
+        if not found:
+            found, ref = self.missing.get(access_code)
+        ACCESS_CODE_LOOKUPS.labels('hit' if found else 'miss').inc()
+        return found, ref
+
+    def _load(self, access_code):
+        row = Questionnaire.all_objects.filter(access_code=access_code)\
+            .values_list('id', 'access_code', 'is_active', 'is_deleted', 'updated_at').first()
+        if row is None:
+            self.missing.set(access_code, None)
+            return None
+        ref = QuestionnaireRef(*row)
+        self.found.set(access_code, ref)
+        return ref
+
+    def confirm_open(self, ref):
+        """
+        Comprueba en la BD (una consulta por id) que el cuestionario sigue
+        abierto. Si no, la entrada de este proceso se descarta para que las
+        lecturas siguientes vean el estado nuevo.
+        """
+        is_open = Questionnaire.all_objects.filter(id=ref.id, is_active=True, is_deleted=False).exists()
+        if not is_open:
+            self.invalidate(ref.access_code)
+        return is_open
+
+    def invalidate(self, access_code):
+        self.found.discard(access_code)
+        self.missing.discard(access_code)
+
+    def clear(self):
+        self.found.clear()
+        self.missing.clear()
+
+
+resolver = AccessCodeResolver()
+
+
+@receiver(post_save, sender=Questionnaire, dispatch_uid='resolver_questionnaire_saved')
+@receiver(post_delete, sender=Questionnaire, dispatch_uid='resolver_questionnaire_deleted')
+def _invalidate_questionnaire(sender, instance, **kwargs):
+    access_code = instance.access_code
+    resolver.invalidate(access_code)
+    # Una lectura entre el save y el commit pudo guardar el estado anterior
+    transaction.on_commit(lambda: resolver.invalidate(access_code))
@@ -0,0 +1,98 @@
+# questionnaires/rollups.py
+"""
+Conteo diario de respuestas (SubmissionRollup) por cuestionario y dueño.
+
+record_submissions() debe llamarse dentro de la misma transacción que crea
+las Submission. El panel (DashboardStatsView) lee totales y tendencias de
+aquí: su coste depende de los días que muestra, no de cuántas respuestas hay.
+"""
+from datetime import timedelta
+
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Questionnaire, Submission, SubmissionRollup
+
+
+def record_submissions(counts, day=None):
+    """
+    Suma {questionnaire_id: nuevas_submissions} al día indicado (hoy por defecto).
+    Lo normal es un solo UPDATE; la primera respuesta del día crea la fila.
+    """
+    counts = {questionnaire_id: count for questionnaire_id, count in counts.items() if count}
+    if not counts:
+        return
+    day = day or timezone.localdate()
+
+    missing = set(counts)
+    for questionnaire_id, count in counts.items():
+        if SubmissionRollup.objects.filter(questionnaire_id=questionnaire_id, day=day).update(count=F('count') + count):
+            missing.discard(questionnaire_id)
+    if not missing:
+        return
+
+    owners = Questionnaire.all_objects.filter(id__in=missing).values_list('id', 'created_by_id')
+    SubmissionRollup.objects.bulk_create(
+        [SubmissionRollup(questionnaire_id=q_id, owner_id=owner_id, day=day) for q_id, owner_id in owners],
+        ignore_conflicts=True,
+    )
+    for questionnaire_id in missing:
+        SubmissionRollup.objects.filter(questionnaire_id=questionnaire_id, day=day)\
+            .update(count=F('count') + counts[questionnaire_id])
+
+
+def record_submission(questionnaire_id):
+    record_submissions({questionnaire_id: 1})
+
+
+def rebuild(questionnaire_ids=None):
+    """
+    Recalcula los conteos diarios desde las Submission (días en TIME_ZONE).
+    Devuelve el número de filas escritas.
+    """
+    submissions = Submission.objects.all()
+    rollups = SubmissionRollup.objects.all()
+    if questionnaire_ids:
+        submissions = submissions.filter(questionnaire_id__in=questionnaire_ids)
+        rollups = rollups.filter(questionnaire_id__in=questionnaire_ids)
+
+    rows = submissions.annotate(day=TruncDate('created_at')).values(
+        'questionnaire_id', 'questionnaire__created_by_id', 'day'
+    ).annotate(total=Count('id')).order_by()
+
+    rollups.delete()
+    created = SubmissionRollup.objects.bulk_create(
+        [
+            SubmissionRollup(
+                questionnaire_id=row['questionnaire_id'], owner_id=row['questionnaire__created_by_id'],
+                day=row['day'], count=row['total'],
+            )
+            for row in rows.iterator()
+        ],
+        batch_size=1000,
+    )
+    return len(created)
+
+
+def total(rollups=None):
+    """Total de respuestas de las filas indicadas (todas por defecto)."""
+    rollups = SubmissionRollup.objects.all() if rollups is None else rollups
+    return rollups.aggregate(total=Sum('count'))['total'] or 0
+
+
+def daily_trend(days, rollups=None):
+    """
+    Lista [(fecha, respuestas)] de los últimos 'days' días más hoy, con ceros
+    en los días sin respuestas. Una consulta con a lo sumo una fila por día.
+    """
+    rollups = SubmissionRollup.objects.all() if rollups is None else rollups
+    today = timezone.localdate()
+    start = today - timedelta(days=days)
+    by_day = dict(
+        rollups.filter(day__gte=start, day__lte=today)
+        .values('day').annotate(total=Sum('count')).order_by()
+        .values_list('day', 'total')
+    )
+    dates = [start + timedelta(days=offset) for offset in range(days + 1)]
+    return [(date, by_day.get(date, 0)) for date in dates]
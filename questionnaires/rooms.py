@@ -0,0 +1,296 @@
+# questionnaires/rooms.py
+"""
+Caché por proceso del estado de cada sala (room) de encuesta.
+
+Por cada access_code se guarda el snapshot actual de estadísticas, su JSON ya
+codificado, un número de secuencia monótono y un buffer circular con los
+últimos deltas (protocolo v2 con 'resync').
+
+- La carga desde la BD es single-flight: si 500 clientes se conectan a la vez
+  solo uno consulta la BD y el resto espera el mismo resultado.
+- Los votos actualizan el snapshot en el sitio: el proceso escucha los grupos
+  de las salas en caché con un canal propio, así el estado sigue al día aunque
+  no quede ningún socket conectado.
+- Las salas sin suscriptores se expulsan por TTL y por LRU.
+- Si el loader devuelve None (el código no existe) la sala no se guarda: los
+  códigos al azar no ocupan el LRU ni expulsan salas reales.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from .metrics import BROADCAST_FANOUT
+
+logger = logging.getLogger(__name__)
+
+
+def get_buffer_size():
+    return getattr(settings, 'SURVEY_RESYNC_BUFFER', 256)
+
+
+def get_cache_size():
+    return getattr(settings, 'SURVEY_ROOM_CACHE_SIZE', 1000)
+
+
+def get_cache_ttl():
+    return getattr(settings, 'SURVEY_ROOM_CACHE_TTL', 300)
+
+
+def group_name_for(access_code):
+    return f'survey_{access_code}'
+
+
+class RoomState:
+    def __init__(self, access_code, buffer_size):
+        self.access_code = access_code
+        # Identifica esta instancia: las secuencias de otra instancia (otro
+        # proceso o una sala recreada) no son comparables.
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.stats = None  # {question_id: {option_id: votos}} con claves str
+        self.history = deque(maxlen=buffer_size)  # (seq, changes)
+        self._applied = OrderedDict()  # event_id -> seq, para no aplicar dos veces
+        self.versions = {}  # question_id -> última stats_version aplicada
+        self._buffer_size = buffer_size
+        self._loading = None
+        self._updates_while_loading = []
+        self._encoded = {}
+        self.subscribers = 0
+        self.last_used = time.monotonic()
+
+    async def ensure_loaded(self, loader):
+        """Carga el snapshot con 'loader' una sola vez aunque haya muchas llamadas concurrentes."""
+        if self.stats is not None:
+            return
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._load(loader))
+        await asyncio.shield(self._loading)
+
+    async def _load(self, loader):
+        try:
+            self.load(await loader(self.access_code))
+        finally:
+            self._loading = None
+
+    def load(self, stats):
+        """Inicializa el snapshot a partir de la BD (solo si aún no existe; None si no hay cuestionario)."""
+        if self.stats is not None or stats is None:
+            return
+        self.stats = {
+            str(question_id): {str(option_id): count for option_id, count in options.items()}
+            for question_id, options in stats.items()
+        }
+        # Los votos que llegaron mientras leíamos la BD son más recientes que la lectura
+        for updates in self._updates_while_loading:
+            for question_id, options in updates.items():
+                self.stats.setdefault(question_id, {}).update(options)
+        self._updates_while_loading = []
+        self._encoded = {}
+
+    def apply(self, event_id, updates, deltas=None, versions=None):
+        """
+        Aplica un mensaje agrupado de la sala. Devuelve (seq, changes) con solo
+        las opciones que cambiaron. Varios consumers del mismo proceso reciben el
+        mismo evento: solo el primero lo aplica, el resto obtiene el mismo delta.
+        Si nada cambió la secuencia no avanza y changes es {}.
+
+        'deltas' (incrementos del modo de escritura diferida) se suman después
+        de 'updates'; se ignoran si el snapshot aún no se ha cargado.
+        'versions' da la stats_version de las preguntas de 'updates': las de una
+        versión anterior a la ya aplicada llegaron tarde y se descartan.
+        """
+        if event_id in self._applied:
+            seq = self._applied[event_id]
+            return self.seq if seq is None else seq, self.changes_for(seq)
+
+        if versions:
+            updates = self._drop_stale(updates, versions)
+
+        if self.stats is None:
+            self._updates_while_loading.append(updates)
+
+        changes = {}
+        for question_id, options in updates.items():
+            current = self.stats.setdefault(question_id, {}) if self.stats is not None else {}
+            changed = {
+                option_id: count
+                for option_id, count in options.items()
+                if current.get(option_id) != count
+            }
+            if changed:
+                current.update(changed)
+                changes[question_id] = changed
+
+        if deltas and self.stats is not None:
+            for question_id, options in deltas.items():
+                current = self.stats.setdefault(question_id, {})
+                for option_id, delta in options.items():
+                    if delta:
+                        current[option_id] = max(current.get(option_id, 0) + delta, 0)
+                        changes.setdefault(question_id, {})[option_id] = current[option_id]
+
+        if changes:
+            self.seq += 1
+            self.history.append((self.seq, changes))
+            self._encoded = {}
+            BROADCAST_FANOUT.observe(self.subscribers)
+        self._applied[event_id] = self.seq if changes else None
+        while len(self._applied) > self._buffer_size:
+            self._applied.popitem(last=False)
+        return self.seq, changes
+
+    def _drop_stale(self, updates, versions):
+        fresh = {}
+        for question_id, options in updates.items():
+            version = versions.get(question_id)
+            if version is not None:
+                if version < self.versions.get(question_id, version):
+                    continue
+                self.versions[question_id] = version
+            fresh[question_id] = options
+        return fresh
+
+    def changes_for(self, seq):
+        if seq is None:
+            return {}
+        for entry_seq, changes in self.history:
+            if entry_seq == seq:
+                return changes
+        return {}
+
+    def changes_since(self, since, epoch):
+        """
+        Devuelve los cambios acumulados desde 'since' o None si el buffer ya no
+        los contiene (el cliente debe recibir un snapshot completo).
+        """
+        if epoch != self.epoch or since < 0 or since > self.seq:
+            return None
+        if since == self.seq:
+            return {}
+        if not self.history or self.history[0][0] > since + 1:
+            return None
+        merged = {}
+        for entry_seq, changes in self.history:
+            if entry_seq > since:
+                for question_id, options in changes.items():
+                    merged.setdefault(question_id, {}).update(options)
+        return merged
+
+    def initial_stats_json(self):
+        """Mensaje 'initial_stats' (protocolo v1) ya codificado; None si no hay preguntas."""
+        if 'initial_stats' not in self._encoded:
+            self._encoded['initial_stats'] = json.dumps({
+                'type': 'initial_stats',
+                'stats': self.stats,
+            }) if self.stats else None
+        return self._encoded['initial_stats']
+
+    def snapshot_json(self):
+        """Mensaje 'snapshot' (protocolo v2) ya codificado."""
+        if 'snapshot' not in self._encoded:
+            self._encoded['snapshot'] = json.dumps({
+                'type': 'snapshot',
+                'epoch': self.epoch,
+                'seq': self.seq,
+                'stats': self.stats,
+            })
+        return self._encoded['snapshot']
+
+
+class RoomRegistry:
+    """
+    Registro LRU de salas para este proceso. Las salas con suscriptores nunca se
+    expulsan; las inactivas se eliminan al superar el TTL o el tamaño máximo.
+    """
+
+    def __init__(self):
+        self.rooms = OrderedDict()
+        self._channel_layer = None
+        self._listener_channel = None
+        self._listener = None
+
+    async def acquire(self, access_code, channel_layer, loader):
+        room = self.rooms.get(access_code)
+        created = room is None
+        if created:
+            room = self.rooms[access_code] = RoomState(access_code, get_buffer_size())
+        self.rooms.move_to_end(access_code)
+        room.subscribers += 1
+        room.last_used = time.monotonic()
+        if created:
+            await self.evict()
+            await self._listen(channel_layer, access_code)
+        await room.ensure_loaded(loader)
+        if room.stats is None:
+            # El cuestionario no existe: se deshace el registro y el llamante cierra el socket
+            self.release(room)
+            await self.discard(room)
+            return None
+        return room
+
+    def release(self, room):
+        room.subscribers -= 1
+        room.last_used = time.monotonic()
+
+    async def discard(self, room):
+        """Quita una sala sin suscriptores del registro (si sigue siendo la registrada)."""
+        if room.subscribers == 0 and self.rooms.get(room.access_code) is room:
+            del self.rooms[room.access_code]
+            await self._unlisten(room.access_code)
+
+    def get(self, access_code):
+        return self.rooms.get(access_code)
+
+    async def evict(self):
+        now = time.monotonic()
+        ttl = get_cache_ttl()
+        excess = len(self.rooms) - get_cache_size()
+        for access_code, room in list(self.rooms.items()):
+            if room.subscribers > 0:
+                continue
+            if excess > 0 or now - room.last_used > ttl:
+                del self.rooms[access_code]
+                excess -= 1
+                await self._unlisten(access_code)
+
+    async def _listen(self, channel_layer, access_code):
+        # Un canal por proceso, suscrito a los grupos de todas las salas en caché
+        if (self._listener is None or self._listener.done()
+                or self._listener.get_loop() is not asyncio.get_running_loop()
+                or self._channel_layer is not channel_layer):
+            self._channel_layer = channel_layer
+            self._listener_channel = await channel_layer.new_channel(prefix='survey_rooms.')
+            self._listener = asyncio.ensure_future(self._listen_loop())
+            for code in self.rooms:
+                await channel_layer.group_add(group_name_for(code), self._listener_channel)
+        else:
+            await channel_layer.group_add(group_name_for(access_code), self._listener_channel)
+
+    async def _unlisten(self, access_code):
+        if self._listener_channel is not None:
+            await self._channel_layer.group_discard(group_name_for(access_code), self._listener_channel)
+
+    async def _listen_loop(self):
+        channel_layer, channel = self._channel_layer, self._listener_channel
+        while True:
+            try:
+                message = await channel_layer.receive(channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error recibiendo mensajes de salas en caché")
+                await asyncio.sleep(1)
+                continue
+            if message.get('type') != 'survey_stats_update':
+                continue
+            room = self.rooms.get(message.get('access_code'))
+            if room is not None:
+                room.apply(message['event_id'], message['updates'], message.get('deltas'))
+
+
+rooms = RoomRegistry()
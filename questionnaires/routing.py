@@ -7,4 +7,6 @@ from . import consumers
 websocket_urlpatterns = [
     # Esta expresión regular captura el 'access_code' de la URL y lo pasa al consumer
     re_path(r'ws/survey/(?P<access_code>\w+)/$', consumers.SurveyConsumer.as_asgi()),
+    # Panel general del administrador (token de la API en ?token=)
+    re_path(r'ws/dashboard/$', consumers.DashboardConsumer.as_asgi()),
 ]
@@ -1,21 +1,27 @@
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
+from . import bulk, tallies
 from .models import Questionnaire, Question, Option, Submission # Asegúrate que Submission esté importado si lo usas en to_representation
 
 # --- Serializers para el Admin ---
 
 class OptionAdminSerializer(serializers.ModelSerializer):
+    # Al editar, el id indica qué opción existente es (null o ausente = nueva)
+    id = serializers.IntegerField(required=False, allow_null=True)
+
     class Meta:
         model = Option
         fields = ['id', 'text']
-        read_only_fields = ['id']
 
 class QuestionAdminSerializer(serializers.ModelSerializer):
+    # Al editar, el id indica qué pregunta existente es (null o ausente = nueva)
+    id = serializers.IntegerField(required=False, allow_null=True)
     options = OptionAdminSerializer(many=True)
 
     class Meta:
         model = Question
         fields = ['id', 'text', 'options']
-        read_only_fields = ['id']
 
     # ▼▼▼ VALIDACIÓN AÑADIDA #1 ▼▼▼
     def validate_options(self, value):
@@ -35,6 +41,11 @@ class QuestionnaireAdminSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'logo', 'is_active', 'access_code', 'created_by', 'questions']
         read_only_fields = ['id', 'access_code', 'created_by', 'is_active', 'logo']
 
+    def to_representation(self, instance):
+        # Preguntas y opciones en dos consultas, no una por pregunta
+        prefetch_related_objects([instance], 'questions__options')
+        return super().to_representation(instance)
+
     # ▼▼▼ VALIDACIÓN AÑADIDA #2 ▼▼▼
     def validate_questions(self, value):
         """
@@ -45,79 +56,112 @@ class QuestionnaireAdminSerializer(serializers.ModelSerializer):
         return value
 
     def create(self, validated_data):
+        """
+        Un INSERT por nivel: el cuestionario, todas sus preguntas y todas sus
+        opciones, enlazadas con los ids que devuelve cada INSERT (ver bulk).
+        """
         questions_data = validated_data.pop('questions')
-        questionnaire = Questionnaire.objects.create(**validated_data)
-        for question_data in questions_data:
-            options_data = question_data.pop('options')
-            question = Question.objects.create(questionnaire=questionnaire, **question_data)
-            for option_data in options_data:
-                Option.objects.create(question=question, **option_data)
+        with transaction.atomic():
+            questionnaire = Questionnaire.objects.create(**validated_data)
+            bulk.create_structure([(questionnaire, questions_data)])
         return questionnaire
 
     def update(self, instance, validated_data):
-        instance.title = validated_data.get('title', instance.title)
-        instance.save()
-        questions_data = validated_data.get('questions', [])
-        existing_questions = {q.id: q for q in instance.questions.all()}
-        incoming_question_ids = {q.get('id') for q in questions_data if q.get('id')}
-        
-        # Eliminar preguntas que ya no están
-        for q_id, question in existing_questions.items():
-            if q_id not in incoming_question_ids:
-                question.delete() # O marcar como borrado lógico si tu modelo lo soporta
+        """
+        Aplica los cambios de estructura como un diff con un número fijo de
+        sentencias, sea cual sea el tamaño del cuestionario: un DELETE por nivel
+        para lo que se quitó, un bulk_update por nivel para los textos que
+        cambiaron y un bulk_create por nivel para lo nuevo. Lo que no cambió no
+        se toca, así que sus respuestas y conteos se conservan.
+        """
+        with transaction.atomic():
+            instance.title = validated_data.get('title', instance.title)
+            instance.save()
+            if 'questions' in validated_data:
+                self._apply_questions_diff(instance, validated_data['questions'])
+
+            # Las estadísticas cambian de forma (preguntas/opciones): nueva versión
+            tallies.bump_stats_version(Questionnaire.all_objects.filter(id=instance.id))
+        return instance
 
-        for question_data in questions_data:
-            question_id = question_data.get('id', None)
-            if question_id:
-                # Actualizar pregunta existente
-                question = existing_questions[question_id]
-                question.text = question_data.get('text', question.text)
-                question.save()
-            else:
-                # Crear nueva pregunta
-                question = Question.objects.create(questionnaire=instance, text=question_data['text'])
-            
-            options_data = question_data.get('options', [])
-            existing_options = {opt.id: opt for opt in question.options.all()}
-            incoming_option_ids = {opt.get('id') for opt in options_data if opt.get('id')}
+    def _apply_questions_diff(self, instance, questions_data):
+        existing_questions = {question.id: question for question in instance.questions.all()}
+        existing_options = {}  # question_id -> {option_id: option}
+        for option in Option.objects.filter(question__questionnaire=instance):
+            existing_options.setdefault(option.question_id, {})[option.id] = option
 
-            # Eliminar opciones que ya no están
-            for opt_id, option in existing_options.items():
-                if opt_id not in incoming_option_ids:
-                    option.delete() # O marcar como borrado lógico
+        kept_question_ids = set()
+        kept_option_ids = set()
+        changed_questions = []
+        changed_options = []
+        new_questions = []  # (Question sin guardar, datos de sus opciones)
+        new_options = []
 
+        for question_data in questions_data:
+            question_id = question_data.get('id')
+            options_data = question_data.get('options', [])
+            if not question_id:
+                new_questions.append((Question(questionnaire=instance, text=question_data['text']), options_data))
+                continue
+            question = existing_questions.get(question_id)
+            if question is None or question_id in kept_question_ids:
+                raise serializers.ValidationError(
+                    {'questions': f"La pregunta {question_id} no pertenece a este cuestionario."})
+            kept_question_ids.add(question_id)
+            if question_data.get('text', question.text) != question.text:
+                question.text = question_data['text']
+                changed_questions.append(question)
+
+            options = existing_options.get(question_id, {})
             for option_data in options_data:
-                option_id = option_data.get('id', None)
-                if option_id:
-                    # Actualizar opción existente
-                    option = existing_options[option_id]
-                    option.text = option_data.get('text', option.text)
-                    option.save()
-                else:
-                    # Crear nueva opción
-                    Option.objects.create(question=question, text=option_data['text'])
-        return instance
+                option_id = option_data.get('id')
+                if not option_id:
+                    new_options.append(Option(question=question, text=option_data['text']))
+                    continue
+                option = options.get(option_id)
+                if option is None or option_id in kept_option_ids:
+                    raise serializers.ValidationError(
+                        {'questions': f"La opción {option_id} no pertenece a la pregunta {question_id}."})
+                kept_option_ids.add(option_id)
+                if option_data.get('text', option.text) != option.text:
+                    option.text = option_data['text']
+                    changed_options.append(option)
+
+        # 1. Borrados: un DELETE por nivel (las opciones de las preguntas borradas caen en cascada)
+        removed_question_ids = set(existing_questions) - kept_question_ids
+        if removed_question_ids:
+            Question.objects.filter(id__in=removed_question_ids).delete()
+        removed_option_ids = {
+            option_id
+            for question_id in kept_question_ids
+            for option_id in existing_options.get(question_id, {})
+            if option_id not in kept_option_ids
+        }
+        if removed_option_ids:
+            Option.objects.filter(id__in=removed_option_ids).delete()
+
+        # 2. Textos cambiados: un UPDATE por nivel
+        if changed_questions:
+            Question.objects.bulk_update(changed_questions, ['text'])
+        if changed_options:
+            Option.objects.bulk_update(changed_options, ['text'])
+
+        # 3. Filas nuevas: un INSERT por nivel
+        if new_questions:
+            questions = bulk.create_questions([question for question, _ in new_questions])
+            for question, (_, options_data) in zip(questions, new_questions):
+                new_options.extend(Option(question=question, text=option_data['text']) for option_data in options_data)
+        if new_options:
+            Option.objects.bulk_create(new_options)
 
 
 class QuestionnaireListSerializer(serializers.ModelSerializer):
-    # Añadimos un campo total_submissions para que aparezca en la respuesta
-    total_submissions = serializers.IntegerField(read_only=True) 
+    # Viene anotado desde QuestionnaireViewSet.filter_list (Count en la misma consulta)
+    total_submissions = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Questionnaire
         fields = ['id', 'title', 'is_active', 'access_code', 'total_submissions']
-        
-    def to_representation(self, instance):
-        """
-        Sobreescribe to_representation para añadir el conteo de submissions.
-        """
-        representation = super().to_representation(instance)
-        # Calcula el conteo de submissions relacionados a este cuestionario
-        # Asume que tu modelo Questionnaire tiene una relación inversa a Submission
-        # Si tienes un related_name='submissions' en tu FK en Submission, usa instance.submissions.count()
-        # Si no, usa el nombre por defecto: instance.submission_set.count()
-        representation['total_submissions'] = instance.submission_set.count() 
-        return representation
 
 
 # --- Serializers para el Usuario Público (Evaluado) ---
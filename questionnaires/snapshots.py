@@ -0,0 +1,258 @@
+# questionnaires/snapshots.py
+"""
+Snapshots columnares de las respuestas de un cuestionario, en disco y
+mapeados en memoria al leerlos.
+
+Cada cuestionario tiene un directorio en SURVEY_SNAPSHOT_DIR
+(MEDIA_ROOT/snapshots por defecto) con una columna por archivo, una fila por
+Answer ordenadas por submission y pregunta:
+
+    submission.int32, question.int32, option.int32  ids
+    created_at.int64                                 microsegundos UTC de la submission
+    meta.json                                        filas, última submission y stats_version
+
+Las analíticas (exportación y tablas cruzadas) leen de aquí con np.memmap en
+lugar de crear un objeto Python por respuesta. 'stats' no lo necesita: ya
+lee los conteos agregados de OptionTally.
+
+- build() solo añade las submissions con id mayor que la última guardada. Si
+  desde el snapshot anterior se cambió algún voto ya guardado
+  (Questionnaire.answers_edited_version), lo rehace entero: mover un voto
+  puede dejar iguales los totales. Después compara los conteos por opción con
+  OptionTally: si no cuadran (se borró una opción...), también lo rehace.
+- current() solo devuelve el snapshot si su stats_version es la del
+  cuestionario: cualquier voto o cambio de estructura lo deja sin usar hasta
+  el próximo build(). Está pensado para encuestas cerradas y grandes.
+- Las columnas se escriben antes que meta.json y se leen solo las filas que
+  indica meta.json: un build interrumpido no deja filas a medias visibles.
+
+Necesita numpy; sin él, current() devuelve None y todo sale de la BD.
+"""
+import datetime
+import json
+import os
+import shutil
+
+from django.conf import settings
+
+from .models import Answer, OptionTally, Questionnaire, Submission
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy no está instalado
+    np = None
+
+FORMAT_VERSION = 1
+COLUMNS = {
+    'submission': 'int32',
+    'question': 'int32',
+    'option': 'int32',
+    'created_at': 'int64',
+}
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class SnapshotError(Exception):
+    """No se puede crear el snapshot (numpy no está instalado o los ids no caben en int32)."""
+
+
+def is_available():
+    return np is not None
+
+
+def get_snapshot_dir():
+    return getattr(settings, 'SURVEY_SNAPSHOT_DIR', os.path.join(settings.MEDIA_ROOT, 'snapshots'))
+
+
+def get_chunk_size():
+    return getattr(settings, 'SURVEY_SNAPSHOT_CHUNK_SIZE', 5000)
+
+
+def path_for(questionnaire_id):
+    return os.path.join(get_snapshot_dir(), str(questionnaire_id))
+
+
+def _column_path(directory, name):
+    return os.path.join(directory, f'{name}.{COLUMNS[name]}')
+
+
+def _read_meta(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('format') == FORMAT_VERSION else None
+
+
+def _write_meta(directory, meta):
+    temporary = os.path.join(directory, 'meta.json.tmp')
+    with open(temporary, 'w') as fh:
+        json.dump(meta, fh)
+    os.replace(temporary, os.path.join(directory, 'meta.json'))
+
+
+class Snapshot:
+    """Columnas de un snapshot ya escrito, mapeadas en memoria (solo lectura)."""
+
+    def __init__(self, directory, meta):
+        self.meta = meta
+        self.rows = meta['rows']
+        for name, dtype in COLUMNS.items():
+            if self.rows:
+                column = np.memmap(_column_path(directory, name), dtype=dtype, mode='r', shape=(self.rows,))
+            else:
+                column = np.empty(0, dtype=dtype)
+            setattr(self, name, column)
+
+    @property
+    def stats_version(self):
+        return self.meta['stats_version']
+
+    def iter_pages(self, chunk_size):
+        """Como export.iter_pages: listas de (submission_id, created_at, {question_id: option_id})."""
+        if not self.rows:
+            return
+        # Primera fila de cada submission (las filas están ordenadas por submission)
+        starts = np.flatnonzero(np.r_[True, self.submission[1:] != self.submission[:-1]])
+        bounds = np.r_[starts, self.rows]
+        for first in range(0, len(starts), chunk_size):
+            last = min(first + chunk_size, len(starts))
+            begin, end = bounds[first], bounds[last]
+            submissions = self.submission[begin:end].tolist()
+            questions = self.question[begin:end].tolist()
+            options = self.option[begin:end].tolist()
+            created = self.created_at[begin:end].tolist()
+            page = []
+            for index in range(last - first):
+                row_begin, row_end = bounds[first + index] - begin, bounds[first + index + 1] - begin
+                page.append((
+                    submissions[row_begin],
+                    EPOCH + datetime.timedelta(microseconds=created[row_begin]),
+                    dict(zip(questions[row_begin:row_end], options[row_begin:row_end])),
+                ))
+            yield page
+
+
+def open_snapshot(questionnaire_id):
+    """El snapshot escrito del cuestionario, sea de la versión que sea, o None."""
+    if np is None:
+        return None
+    directory = path_for(questionnaire_id)
+    meta = _read_meta(directory)
+    return Snapshot(directory, meta) if meta is not None else None
+
+
+def current(questionnaire):
+    """El snapshot del cuestionario si refleja su stats_version actual; si no, None."""
+    snapshot = open_snapshot(questionnaire.id)
+    if snapshot is None or snapshot.stats_version != questionnaire.stats_version:
+        return None
+    return snapshot
+
+
+def build(questionnaire_id, rebuild=False, chunk_size=None):
+    """
+    Crea o pone al día el snapshot del cuestionario. Devuelve (filas, modo),
+    con modo 'appended' o 'rebuilt'.
+    """
+    if np is None:
+        raise SnapshotError("Los snapshots necesitan numpy.")
+    chunk_size = chunk_size or get_chunk_size()
+    # La versión se lee antes que las respuestas: si llega un voto mientras tanto,
+    # el snapshot queda viejo y no se usa
+    stats_version, edited_version = Questionnaire.all_objects.filter(id=questionnaire_id)\
+        .values_list('stats_version', 'answers_edited_version').get()
+    directory = path_for(questionnaire_id)
+    meta = None if rebuild else _read_meta(directory)
+    if meta is not None and edited_version > meta['stats_version']:
+        # Un voto que ya estaba en el snapshot pudo cambiar de opción
+        meta = None
+
+    if meta is not None:
+        rows, last_id = _append(directory, questionnaire_id, meta['rows'], meta['last_submission_id'], chunk_size)
+        if _matches_tallies(directory, questionnaire_id, rows):
+            _write_meta(directory, dict(meta, rows=rows, last_submission_id=last_id, stats_version=stats_version))
+            return rows, 'appended'
+
+    # Snapshot nuevo en un directorio aparte; se cambia por el anterior al terminar
+    temporary = directory + '.tmp'
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    rows, last_id = _append(temporary, questionnaire_id, 0, 0, chunk_size)
+    _write_meta(temporary, {
+        'format': FORMAT_VERSION,
+        'questionnaire_id': questionnaire_id,
+        'rows': rows,
+        'last_submission_id': last_id,
+        'stats_version': stats_version,
+    })
+    previous = directory + '.old'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, previous)
+    os.replace(temporary, directory)
+    shutil.rmtree(previous, ignore_errors=True)
+    return rows, 'rebuilt'
+
+
+def _append(directory, questionnaire_id, rows, last_id, chunk_size):
+    """Añade las respuestas de las submissions con id > last_id. Devuelve (filas, última submission)."""
+    files = {}
+    try:
+        for name, dtype in COLUMNS.items():
+            fh = open(_column_path(directory, name), 'ab')
+            # Lo que quedó de un build interrumpido no cuenta
+            fh.truncate(rows * np.dtype(dtype).itemsize)
+            files[name] = fh
+
+        while True:
+            page = list(
+                Submission.objects.filter(questionnaire_id=questionnaire_id, id__gt=last_id)
+                .order_by('id').values_list('id', 'created_at')[:chunk_size]
+            )
+            if not page:
+                break
+            last_id = page[-1][0]
+            created = {
+                submission_id: (created_at - EPOCH) // datetime.timedelta(microseconds=1)
+                for submission_id, created_at in page
+            }
+            answers = list(
+                Answer.objects.filter(submission_id__in=created)
+                .order_by('submission_id', 'question_id')
+                .values_list('submission_id', 'question_id', 'selected_option_id')
+            )
+            if not answers:
+                continue
+            ids = np.array(answers, dtype=np.int64)
+            if ids.max() > np.iinfo(np.int32).max:
+                raise SnapshotError("Hay ids que no caben en int32.")
+            columns = {
+                'submission': ids[:, 0],
+                'question': ids[:, 1],
+                'option': ids[:, 2],
+                'created_at': np.array([created[row[0]] for row in answers], dtype=np.int64),
+            }
+            for name, dtype in COLUMNS.items():
+                files[name].write(columns[name].astype(dtype).tobytes())
+            rows += len(answers)
+    finally:
+        for fh in files.values():
+            fh.close()
+    return rows, last_id
+
+
+def _matches_tallies(directory, questionnaire_id, rows):
+    """Los votos por opción del snapshot coinciden con OptionTally."""
+    expected = dict(
+        OptionTally.objects.filter(questionnaire_id=questionnaire_id).exclude(count=0)
+        .values_list('option_id', 'count')
+    )
+    if rows:
+        options = np.memmap(_column_path(directory, 'option'), dtype=COLUMNS['option'], mode='r', shape=(rows,))
+        ids, counts = np.unique(options, return_counts=True)
+        found = dict(zip(ids.tolist(), counts.tolist()))
+    else:
+        found = {}
+    return found == expected
@@ -0,0 +1,97 @@
+# questionnaires/stats_cache.py
+"""
+Respuesta de la acción 'stats' versionada con Questionnaire.stats_version.
+
+La versión sube con cada voto escrito y con cada cambio de estructura, así
+que el ETag ("<id>-<versión>") y Last-Modified (stats_updated_at) se sacan de
+la fila del cuestionario sin agregar nada. Un panel que sondea sin cambios
+recibe un 304; si hay cambios, el cuerpo se construye una vez por versión y
+se guarda ya codificado en la caché de Django.
+"""
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe
+
+from .models import OptionTally, Question
+from .public_cache import etag_matches
+
+
+def get_cache():
+    return caches[getattr(settings, 'SURVEY_STATS_CACHE', 'default')]
+
+
+def get_ttl():
+    return getattr(settings, 'SURVEY_STATS_CACHE_TTL', 600)
+
+
+def etag_for(questionnaire):
+    return f'"{questionnaire.id}-{questionnaire.stats_version}"'
+
+
+def _render(questionnaire):
+    """{question_id: {'question_text', 'options': [...]}} incluyendo opciones con 0 votos."""
+    # 1. Leemos los conteos ya agregados de la tabla OptionTally
+    votes_map = dict(
+        OptionTally.objects.filter(questionnaire=questionnaire).values_list('option_id', 'count')
+    )
+
+    # 2. Obtenemos todas las preguntas y opciones para construir la respuesta
+    questions = Question.objects.filter(questionnaire=questionnaire).prefetch_related('options')
+
+    stats_data = {}
+    for question in questions:
+        stats_data[question.id] = {
+            'question_text': question.text,
+            'options': [
+                {
+                    'option_id': option.id,
+                    'option_text': option.text,
+                    # Usamos el mapa, si no hay votos para una opción, será 0
+                    'votes': votes_map.get(option.id, 0)
+                }
+                for option in question.options.all()
+            ]
+        }
+    return json.dumps(stats_data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def get_body(questionnaire):
+    cache = get_cache()
+    key = f'questionnaire_stats:{questionnaire.id}:{questionnaire.stats_version}'
+    body = cache.get(key)
+    if body is None:
+        body = _render(questionnaire)
+        cache.set(key, body, get_ttl())
+    return body
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        # Si el cliente manda ETag, If-Modified-Since se ignora (RFC 9110)
+        return etag_matches(if_none_match, etag)
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return since is not None and last_modified is not None and int(last_modified.timestamp()) <= since
+
+
+def response_for(request, questionnaire, body=get_body):
+    """
+    200 con el cuerpo en caché, o 304 si el cliente ya tiene esta versión.
+    'body' construye el cuerpo a partir del cuestionario (por defecto, el de
+    'stats'); sirve para otras vistas que dependen de la misma versión.
+    """
+    etag = etag_for(questionnaire)
+    last_modified = questionnaire.stats_updated_at or questionnaire.created_at
+    if _not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body(questionnaire), content_type='application/json')
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # El navegador guarda la respuesta pero revalida en cada sondeo
+    response['Cache-Control'] = 'private, no-cache'
+    return response
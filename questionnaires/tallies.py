@@ -0,0 +1,165 @@
+# questionnaires/tallies.py
+"""
+Mantenimiento del conteo desnormalizado de votos (OptionTally).
+
+Todas las funciones que escriben deben llamarse dentro de la misma
+transacción que crea o borra las Answer correspondientes.
+
+Cada escritura sube también Questionnaire.stats_version: es la versión que
+usan el ETag y la caché de la acción 'stats'.
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Option, OptionTally, Questionnaire
+
+
+def apply_deltas(deltas, edited_options=()):
+    """
+    Aplica un diccionario {option_id: delta} a la tabla de conteos.
+    Crea las filas que falten (opciones nuevas) antes de sumar.
+    'edited_options' son opciones de votos ya guardados que cambiaron: sus
+    cuestionarios marcan también answers_edited_version.
+    """
+    deltas = {option_id: delta for option_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    existing = set(OptionTally.objects.filter(option_id__in=deltas).values_list('option_id', flat=True))
+    missing = [option_id for option_id in deltas if option_id not in existing]
+    if missing:
+        rows = Option.objects.filter(id__in=missing).values_list('id', 'question_id', 'question__questionnaire_id')
+        OptionTally.objects.bulk_create(
+            [
+                OptionTally(option_id=option_id, question_id=question_id, questionnaire_id=questionnaire_id)
+                for option_id, question_id, questionnaire_id in rows
+            ],
+            ignore_conflicts=True,
+        )
+
+    # Agrupamos por delta para emitir un UPDATE por cada valor distinto (normalmente +1 y -1)
+    by_delta = defaultdict(list)
+    for option_id, delta in deltas.items():
+        by_delta[delta].append(option_id)
+    for delta, option_ids in by_delta.items():
+        OptionTally.objects.filter(option_id__in=option_ids).update(count=F('count') + delta)
+
+    # Al final, para bloquear siempre en el mismo orden: conteos y luego cuestionario
+    questionnaires = Questionnaire.all_objects.filter(
+        id__in=OptionTally.objects.filter(option_id__in=deltas).values('questionnaire_id')
+    )
+    if edited_options:
+        edited_ids = OptionTally.objects.filter(option_id__in=edited_options).values('questionnaire_id')
+        bump_stats_version(questionnaires.filter(id__in=edited_ids), answers_edited=True)
+        questionnaires = questionnaires.exclude(id__in=edited_ids)
+    bump_stats_version(questionnaires)
+
+
+def bump_stats_version(questionnaires, answers_edited=False):
+    """
+    Sube la versión de estadísticas de los cuestionarios del queryset con un
+    solo UPDATE. Llamar también cuando cambia la estructura (preguntas u
+    opciones), porque cambia el cuerpo de las estadísticas.
+    """
+    values = {}
+    if answers_edited:
+        # Antes que stats_version: MySQL evalúa las asignaciones en orden y el resto
+        # de BD con los valores anteriores; en ambos casos queda la versión nueva
+        values['answers_edited_version'] = F('stats_version') + 1
+    questionnaires.update(**values, stats_version=F('stats_version') + 1, stats_updated_at=timezone.now())
+
+
+def record_answers(option_ids):
+    """Suma un voto por cada opción de la lista (puede repetir opciones)."""
+    apply_deltas(Counter(option_ids))
+
+
+def record_change(old_option_id, new_option_id):
+    """Mueve un voto de una opción a otra (old_option_id puede ser None)."""
+    if old_option_id == new_option_id:
+        return
+    deltas = {new_option_id: 1}
+    if old_option_id is None:
+        apply_deltas(deltas)
+        return
+    deltas[old_option_id] = -1
+    apply_deltas(deltas, edited_options=[new_option_id])
+
+
+def question_stats(question_id):
+    """Devuelve {option_id: votos} para una pregunta, con una sola consulta."""
+    rows = Option.objects.filter(question_id=question_id).values_list('id', 'tally__count')
+    return {option_id: count or 0 for option_id, count in rows}
+
+
+def questions_stats_with_version(question_ids):
+    """
+    Como questions_stats(), pero devuelve (estadísticas, stats_version). La
+    versión se lee en la misma consulta, así los conteos son exactamente los
+    de esa versión (None si las preguntas no tienen opciones).
+    """
+    rows = Option.objects.filter(question_id__in=question_ids).order_by('question_id', 'id')\
+        .values_list('question_id', 'id', 'tally__count', 'question__questionnaire__stats_version')
+    stats = {}
+    stats_version = None
+    for question_id, option_id, count, stats_version in rows:
+        stats.setdefault(question_id, {})[option_id] = count or 0
+    return stats, stats_version
+
+
+def questionnaire_stats(questionnaire_id):
+    """Devuelve {question_id: {option_id: votos}} para todo el cuestionario, con una sola consulta."""
+    return _stats_by_question(Option.objects.filter(question__questionnaire_id=questionnaire_id))
+
+
+def questions_stats(question_ids):
+    """Devuelve {question_id: {option_id: votos}} para varias preguntas, con una sola consulta."""
+    return _stats_by_question(Option.objects.filter(question_id__in=question_ids))
+
+
+def _stats_by_question(options):
+    rows = options.order_by('question_id', 'id').values_list('question_id', 'id', 'tally__count')
+    stats = {}
+    for question_id, option_id, count in rows:
+        stats.setdefault(question_id, {})[option_id] = count or 0
+    return stats
+
+
+def rebuild(questionnaire_ids=None, fix=True):
+    """
+    Recalcula los conteos desde las Answer. Devuelve la lista de
+    discrepancias encontradas como (option_id, conteo_guardado, conteo_real).
+    Si fix=True las corrige.
+    """
+    options = Option.objects.all()
+    if questionnaire_ids:
+        options = options.filter(question__questionnaire_id__in=questionnaire_ids)
+    options = options.annotate(votes=Count('answer')).values_list(
+        'id', 'question_id', 'question__questionnaire_id', 'votes', 'tally__count'
+    )
+
+    mismatches = []
+    changed = set()  # cuestionarios con conteos corregidos
+    to_create = []
+    for option_id, question_id, questionnaire_id, votes, stored in options.iterator():
+        if stored is None:
+            to_create.append(OptionTally(
+                option_id=option_id, question_id=question_id,
+                questionnaire_id=questionnaire_id, count=votes,
+            ))
+            if votes:
+                mismatches.append((option_id, None, votes))
+                changed.add(questionnaire_id)
+        elif stored != votes:
+            mismatches.append((option_id, stored, votes))
+            changed.add(questionnaire_id)
+            if fix:
+                OptionTally.objects.filter(option_id=option_id).update(count=votes)
+
+    if fix and to_create:
+        OptionTally.objects.bulk_create(to_create, batch_size=1000, ignore_conflicts=True)
+    if fix and changed:
+        bump_stats_version(Questionnaire.all_objects.filter(id__in=changed))
+    return mismatches
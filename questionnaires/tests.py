@@ -1,3 +1,1355 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import tempfile
+import threading
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import (
+    AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from users.models import User
+from .broadcast import RoomAggregator
+from . import broadcast, crosstabs, dashboard, export, importer, ingest, public_cache, rollups, snapshots, tallies, views
+from .outbound import CLOSE_RESYNC, OutboundQueue
+from .db_executor import db_sync_to_async
+from .resolver import resolver
+from .rooms import RoomRegistry, RoomState, rooms
+from .routing import websocket_urlpatterns
+from .models import Questionnaire, Question, Option, Submission, Answer, OptionTally, SubmissionRollup
+
+
+class SyncToAsyncTestCase(TestCase):
+    """
+    TestCase para código que pasa por database_sync_to_async (vistas async,
+    consumers, escritura diferida). Ese wrapper llama a close_old_connections
+    antes y después de cada paso y, dentro de la transacción del test, cierra
+    la conexión del test: con MySQL o SQLite en archivo las consultas
+    siguientes fallan. Aquí se desactiva durante la clase.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.enterClassContext(mock.patch('channels.db.close_old_connections'))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class SubmissionViewTests(SyncToAsyncTestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.client = APIClient()
+
+    def make_questionnaire(self, questions, options=3):
+        questionnaire = Questionnaire.objects.create(title='Encuesta', created_by=self.owner, is_active=True)
+        structure = []
+        for q_index in range(questions):
+            question = Question.objects.create(questionnaire=questionnaire, text=f'Pregunta {q_index}')
+            option_ids = [
+                Option.objects.create(question=question, text=f'Opción {o_index}').id
+                for o_index in range(options)
+            ]
+            structure.append((question.id, option_ids))
+        return questionnaire, structure
+
+    def submit(self, questionnaire, answers):
+        # Sesión nueva en cada envío: cada uno cuenta como un evaluado distinto
+        self.client = APIClient()
+        return self.client.post(
+            reverse('public-submission', args=[questionnaire.access_code]),
+            {'answers': [{'question_id': q_id, 'option_id': o_id} for q_id, o_id in answers]},
+            format='json',
+        )
+
+    def test_saves_answers_and_tallies(self):
+        questionnaire, structure = self.make_questionnaire(questions=2)
+        answers = [(q_id, option_ids[1]) for q_id, option_ids in structure]
+
+        response = self.submit(questionnaire, answers)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            set(Answer.objects.values_list('question_id', 'selected_option_id')),
+            set(answers),
+        )
+        self.assertEqual(
+            dict(OptionTally.objects.filter(count__gt=0).values_list('option_id', 'count')),
+            {o_id: 1 for _, o_id in answers},
+        )
+
+    def test_query_count_does_not_depend_on_form_length(self):
+        short, short_structure = self.make_questionnaire(questions=3)
+        long, long_structure = self.make_questionnaire(questions=60)
+        short_answers = [(q_id, option_ids[1]) for q_id, option_ids in short_structure]
+        long_answers = [(q_id, option_ids[1]) for q_id, option_ids in long_structure]
+        # Primer envío: crea las filas de conteo (como tras el primer voto de cada opción)
+        self.submit(short, short_answers)
+        self.submit(long, long_answers)
+
+        # Sesión, mapa de opciones, comprobación de que sigue abierto, submission, un
+        # INSERT de respuestas, conteos, versión de estadísticas, respuestas del día y
+        # estadísticas para la sala (el cuestionario sale del resolver): lo mismo con
+        # 3 que con 60 preguntas
+        with self.assertNumQueries(21):
+            response = self.submit(short, short_answers)
+        self.assertEqual(response.status_code, 201)
+
+        with self.assertNumQueries(21):
+            response = self.submit(long, long_answers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Answer.objects.filter(submission__questionnaire=long).count(), 120)
+
+    def test_locks_rollups_before_tallies_like_socket_votes(self):
+        questionnaire, structure = self.make_questionnaire(questions=1)
+        self.submit(questionnaire, [(structure[0][0], structure[0][1][0])])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.submit(questionnaire, [(structure[0][0], structure[0][1][1])])
+
+        updates = [query['sql'].split()[1].strip('"') for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(
+            [table for table in updates if table != 'django_session'],
+            ['questionnaires_submissionrollup', 'questionnaires_optiontally', 'questionnaires_questionnaire'],
+        )
+
+    def test_questionnaire_closed_by_another_worker_rejects_submissions(self):
+        questionnaire, structure = self.make_questionnaire(questions=1)
+        self.assertTrue(resolver.resolve(questionnaire.access_code).is_open)
+        # Sin señal en este proceso: su caché sigue diciendo que está abierto
+        Questionnaire.objects.filter(id=questionnaire.id).update(is_active=False)
+
+        response = self.submit(questionnaire, [(structure[0][0], structure[0][1][0])])
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Submission.objects.exists())
+        self.assertFalse(resolver.resolve(questionnaire.access_code).is_open)
+
+    def test_stats_answers_not_modified_until_next_vote(self):
+        questionnaire, structure = self.make_questionnaire(questions=2)
+        admin = APIClient()
+        admin.force_authenticate(self.owner)
+        url = reverse('questionnaire-admin-stats', args=[questionnaire.id])
+        first = admin.get(url)
+        self.assertEqual(first.status_code, 200)
+
+        self.assertEqual(admin.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        self.submit(questionnaire, [(q_id, option_ids[0]) for q_id, option_ids in structure])
+        response = admin.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        q_id, option_ids = structure[0]
+        self.assertEqual(response.json()[str(q_id)]['options'][0]['votes'], 1)
+
+    def test_dashboard_reads_daily_rollups(self):
+        questionnaire, structure = self.make_questionnaire(questions=1)
+        answers = [(q_id, option_ids[0]) for q_id, option_ids in structure]
+        self.submit(questionnaire, answers)
+        self.submit(questionnaire, answers)
+        admin = APIClient()
+        admin.force_authenticate(self.owner)
+
+        data = admin.get(reverse('dashboard-stats')).json()
+
+        self.assertEqual(data['total_submissions'], 2)
+        self.assertEqual(data['submissions_trend']['data'][-1], 2)
+        self.assertEqual(data['questionnaire_type_distribution']['data'], [2])
+        # La reconstrucción desde las Submission da lo mismo que el conteo incremental
+        before = list(SubmissionRollup.objects.values_list('questionnaire_id', 'owner_id', 'day', 'count'))
+        rollups.rebuild()
+        self.assertEqual(list(SubmissionRollup.objects.values_list('questionnaire_id', 'owner_id', 'day', 'count')), before)
+
+    def test_rejects_question_answered_twice(self):
+        questionnaire, structure = self.make_questionnaire(questions=2)
+        (q_id, option_ids), _ = structure
+
+        response = self.submit(questionnaire, [(q_id, option_ids[0]), (q_id, option_ids[1])])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Submission.objects.exists())
+        self.assertFalse(Answer.objects.exists())
+
+    def test_rejects_option_from_another_questionnaire(self):
+        questionnaire, structure = self.make_questionnaire(questions=1)
+        _, other_structure = self.make_questionnaire(questions=1)
+        q_id, _ = structure[0]
+        _, foreign_option_ids = other_structure[0]
+
+        response = self.submit(questionnaire, [(q_id, foreign_option_ids[0])])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Submission.objects.exists())
+        self.assertEqual(OptionTally.objects.filter(count__gt=0).count(), 0)
+
+    async def test_same_session_is_rejected_and_reported_by_check(self):
+        # En un event loop real, como bajo ASGI
+        questionnaire, structure = await sync_to_async(self.make_questionnaire)(questions=2)
+        payload = {'answers': [{'question_id': q_id, 'option_id': option_ids[0]} for q_id, option_ids in structure]}
+        url = reverse('public-submission', args=[questionnaire.access_code])
+        client = AsyncClient()
+
+        first = await client.post(url, payload, content_type='application/json')
+        second = await client.post(url, payload, content_type='application/json')
+        check = await client.post(
+            reverse('public-check-submission'), {'access_code': questionnaire.access_code},
+            content_type='application/json')
+
+        self.assertEqual((first.status_code, second.status_code), (201, 400))
+        self.assertEqual(second.json(), {'error': "Ya has respondido a este cuestionario."})
+        self.assertEqual(check.json(), {'has_submitted': True})
+        self.assertEqual(await Submission.objects.acount(), 1)
+
+    def test_async_and_sync_views_answer_errors_alike(self):
+        questionnaire, _ = self.make_questionnaire(questions=1)
+        factory = RequestFactory()
+        cases = [
+            ('NOPE00', '{"answers": []}'),
+            (questionnaire.access_code, '{"answers": '),
+            (questionnaire.access_code, '{"answers": [{"question_id": "x"}]}'),
+        ]
+        for access_code, body in cases:
+            responses = []
+            for view in (views.SubmissionView.as_view(), views.AsyncSubmissionView.as_view()):
+                request = factory.post('/', body, content_type='application/json')
+                SessionMiddleware(lambda request: None).process_request(request)
+                response = async_to_sync(view)(request, access_code=access_code) \
+                    if asyncio.iscoroutinefunction(view) else view(request, access_code=access_code)
+                if hasattr(response, 'render'):
+                    response.render()
+                responses.append((response.status_code, json.loads(response.content)))
+            self.assertEqual(responses[0], responses[1], body)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class PublicQuestionnaireViewTests(SyncToAsyncTestCase):
+
+    def setUp(self):
+        public_cache.get_cache().clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.questionnaire = Questionnaire.objects.create(title='Encuesta', created_by=self.owner, is_active=True)
+        for q_index in range(3):
+            question = Question.objects.create(questionnaire=self.questionnaire, text=f'Pregunta {q_index}')
+            for o_index in range(3):
+                Option.objects.create(question=question, text=f'Opción {o_index}')
+        self.url = reverse('public-questionnaire', args=[self.questionnaire.access_code])
+        self.client = APIClient()
+
+    def test_serves_cached_payload_without_queries(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(len(first.json()['questions']), 3)
+
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_not_modified_with_matching_etag(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_update_and_toggle_invalidate_payload(self):
+        etag = self.client.get(self.url)['ETag']
+        admin = APIClient()
+        admin.force_authenticate(self.owner)
+        detail = admin.get(reverse('questionnaire-admin-detail', args=[self.questionnaire.id])).json()
+        detail['title'] = 'Encuesta editada'
+
+        with self.captureOnCommitCallbacks(execute=True):
+            admin.put(reverse('questionnaire-admin-detail', args=[self.questionnaire.id]), detail, format='json')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Encuesta editada')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            admin.post(reverse('questionnaire-admin-toggle-active', args=[self.questionnaire.id]))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_version_comes_from_the_database_row(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        # Otro worker desactivó la encuesta: aquí no llegó ninguna señal ni invalidación
+        Questionnaire.objects.filter(id=self.questionnaire.id).update(is_active=False, updated_at=timezone.now())
+        self.assertEqual(self.client.get(self.url).status_code, 200)  # el resolver aún no lo sabe
+
+        resolver.clear()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class AccessCodeResolverTests(TestCase):
+
+    def setUp(self):
+        resolver.clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.questionnaire = Questionnaire.objects.create(title='Encuesta', created_by=self.owner, is_active=True)
+
+    def test_caches_found_and_missing_codes(self):
+        self.assertTrue(resolver.resolve(self.questionnaire.access_code).is_open)
+        self.assertIsNone(resolver.resolve('NOPE00'))
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.resolve(self.questionnaire.access_code).id, self.questionnaire.id)
+            self.assertIsNone(resolver.resolve('NOPE00'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().post(
+                reverse('public-check-submission'), {'access_code': 'NOPE00'}, format='json')
+        self.assertFalse(response.json()['has_submitted'])
+        # Solo las consultas de la sesión: ni el cuestionario ni sus respuestas
+        self.assertFalse([query for query in queries if 'questionnaires_' in query['sql']])
+
+    def test_signals_invalidate_on_toggle_delete_and_create(self):
+        code = self.questionnaire.access_code
+        resolver.resolve(code)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.questionnaire.is_active = False
+            self.questionnaire.save()
+        self.assertFalse(resolver.resolve(code).is_open)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.questionnaire.delete()
+        self.assertIsNone(resolver.resolve(code))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            created = Questionnaire.objects.create(title='Otra', created_by=self.owner, access_code=code)
+        self.assertEqual(resolver.resolve(code).id, created.id)
+
+
+class DBExecutorTests(SimpleTestCase):
+
+    @override_settings(SURVEY_DB_EXECUTOR_WORKERS=2)
+    def test_hops_from_different_rooms_run_in_parallel(self):
+        # Con el hilo compartido la segunda espera a la primera y la barrera caduca
+        barrier = threading.Barrier(2, timeout=5)
+
+        def query():
+            barrier.wait()
+            return threading.current_thread().name
+
+        async def two_rooms():
+            return await asyncio.gather(db_sync_to_async(query)(), db_sync_to_async(query)())
+
+        names = async_to_sync(two_rooms)()
+        self.assertEqual(len(set(names)), 2)
+        self.assertTrue(all(name.startswith('survey-db') for name in names))
+
+    @override_settings(SURVEY_DB_EXECUTOR_WORKERS=0)
+    def test_zero_workers_uses_the_shared_thread(self):
+        name = async_to_sync(db_sync_to_async(lambda: threading.current_thread().name))()
+        self.assertFalse(name.startswith('survey-db'))
+
+
+class QuestionnaireListTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        for index in range(5):
+            questionnaire = Questionnaire.objects.create(
+                title=f'Encuesta {index}', created_by=self.owner, is_active=index % 2 == 0,
+            )
+            for session in range(index):
+                Submission.objects.create(questionnaire=questionnaire, session_key=f's{index}-{session}')
+
+    def test_counts_submissions_in_one_query(self):
+        url = reverse('questionnaire-admin-list')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'page_size': 2})
+        self.assertEqual([q['title'] for q in response.json()['results']], ['Encuesta 4', 'Encuesta 3'])
+        self.assertEqual([q['total_submissions'] for q in response.json()['results']], [4, 3])
+
+        titles = []
+        next_url = url + '?page_size=2'
+        while next_url:
+            # 'next' ya lleva el cursor y page_size
+            page = self.client.get(next_url).json()
+            titles.extend(q['title'] for q in page['results'])
+            next_url = page['next']
+        self.assertEqual(titles, [f'Encuesta {index}' for index in range(4, -1, -1)])
+
+    def test_filters_by_active_and_title(self):
+        response = self.client.get(reverse('questionnaire-admin-list'), {'active': 'true', 'title': 'encuesta 2'})
+
+        self.assertEqual([q['title'] for q in response.json()['results']], ['Encuesta 2'])
+
+
+class QuestionnaireUpdateTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def make_questionnaire(self, questions, options=5):
+        questionnaire = Questionnaire.objects.create(title='Encuesta', created_by=self.owner)
+        for q_index in range(questions):
+            question = Question.objects.create(questionnaire=questionnaire, text=f'Pregunta {q_index}')
+            Option.objects.bulk_create(
+                [Option(question=question, text=f'Opción {o_index}') for o_index in range(options)]
+            )
+        return questionnaire
+
+    def edited_payload(self, questionnaire):
+        """Cambia textos, quita y añade preguntas y opciones (5 de cada)."""
+        url = reverse('questionnaire-admin-detail', args=[questionnaire.id])
+        payload = self.client.get(url).json()
+        questions = payload['questions']
+        for question in questions[:5]:
+            question['text'] += ' (editada)'
+            question['options'][0]['text'] += ' (editada)'
+            question['options'].pop()
+            question['options'].append({'id': None, 'text': 'Opción nueva'})
+        del questions[-5:]
+        questions.extend(
+            {'id': None, 'text': f'Pregunta nueva {index}', 'options': [{'text': 'Sí'}, {'text': 'No'}]}
+            for index in range(5)
+        )
+        return url, payload
+
+    def test_query_budget_does_not_depend_on_size(self):
+        # Lectura, diff, un DELETE/UPDATE/INSERT por nivel y la respuesta: igual con 10 que con 100 preguntas
+        for size in (10, 100):
+            questionnaire = self.make_questionnaire(questions=size)
+            url, payload = self.edited_payload(questionnaire)
+            with self.assertNumQueries(26):
+                response = self.client.put(url, payload, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(questionnaire.questions.count(), size)
+
+    def test_new_questions_without_returned_ids(self):
+        # MySQL: el INSERT no devuelve ids y las preguntas nuevas se vuelven a leer con una consulta
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            for size in (10, 100):
+                questionnaire = self.make_questionnaire(questions=size)
+                url, payload = self.edited_payload(questionnaire)
+                with self.assertNumQueries(28):
+                    response = self.client.put(url, payload, format='json')
+                self.assertEqual(response.status_code, 200)
+                added = questionnaire.questions.filter(text__startswith='Pregunta nueva').order_by('id')
+                self.assertEqual(
+                    [[option.text for option in question.options.order_by('id')] for question in added],
+                    [['Sí', 'No']] * 5,
+                )
+
+    def test_keeps_unchanged_rows_and_their_answers(self):
+        questionnaire = self.make_questionnaire(questions=3)
+        untouched = questionnaire.questions.order_by('id').last()
+        option = untouched.options.first()
+        submission = Submission.objects.create(questionnaire=questionnaire, session_key='s1')
+        Answer.objects.create(submission=submission, question=untouched, selected_option=option)
+        url = reverse('questionnaire-admin-detail', args=[questionnaire.id])
+        payload = self.client.get(url).json()
+        payload['questions'][0]['text'] = 'Pregunta editada'
+
+        response = self.client.put(url, payload, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Question.objects.get(id=payload['questions'][0]['id']).text, 'Pregunta editada')
+        self.assertEqual(Option.objects.filter(question__questionnaire=questionnaire).count(), 15)
+        self.assertTrue(Answer.objects.filter(selected_option=option).exists())
+
+    def test_rejects_question_from_another_questionnaire(self):
+        questionnaire = self.make_questionnaire(questions=1)
+        other = self.make_questionnaire(questions=1)
+        url = reverse('questionnaire-admin-detail', args=[questionnaire.id])
+        payload = self.client.get(url).json()
+        payload['questions'][0]['id'] = other.questions.get().id
+
+        response = self.client.put(url, payload, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(other.questions.get().options.count(), 5)
+
+
+class QuestionnaireImportTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def record(self, index, questions=3):
+        return {
+            'title': f'Importado {index}',
+            'questions': [
+                {'text': f'Pregunta {q_index}', 'options': [{'text': 'Sí'}, {'text': 'No'}]}
+                for q_index in range(questions)
+            ],
+        }
+
+    def test_create_inserts_each_level_once(self):
+        # Cuestionario, preguntas, opciones y la respuesta: igual con 2 que con 50 preguntas
+        for size in (2, 50):
+            with self.assertNumQueries(7):
+                response = self.client.post(
+                    reverse('questionnaire-admin-list'), self.record(0, questions=size), format='json')
+            self.assertEqual(response.status_code, 201)
+            questionnaire = Questionnaire.objects.get(id=response.json()['id'])
+            self.assertEqual(Option.objects.filter(question__questionnaire=questionnaire).count(), size * 2)
+
+    def test_imports_ndjson_and_json_array_by_batches(self):
+        ndjson = '\n'.join(json.dumps(self.record(index)) for index in range(5)) + '\n{"title": ""}\n'
+        with override_settings(SURVEY_IMPORT_BATCH_SIZE=2):
+            response = self.client.post(
+                reverse('questionnaire-admin-import'), ndjson, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['questionnaires'], 5)
+        self.assertEqual(response.json()['rejected'], 1)
+        self.assertEqual(response.json()['errors'][0]['record'], 5)
+
+        # Array JSON leído en trozos más pequeños que un registro
+        body = json.dumps([self.record(index) for index in range(3)]).encode()
+        summary = importer.import_questionnaires(_SmallReads(body), self.owner)
+        self.assertEqual((summary['questionnaires'], summary['questions'], summary['options']), (3, 9, 18))
+
+        imported = Questionnaire.objects.filter(created_by=self.owner, title='Importado 4').get()
+        self.assertFalse(imported.is_active)
+        self.assertEqual([question.options.count() for question in imported.questions.all()], [2, 2, 2])
+
+    def test_rejects_truncated_file(self):
+        response = self.client.post(
+            reverse('questionnaire-admin-import'), '[{"title": "x"', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class QuestionnaireExportTests(SyncToAsyncTestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.questionnaire = Questionnaire.objects.create(title='Exportar', created_by=self.owner)
+        self.colour = Question.objects.create(questionnaire=self.questionnaire, text='Color, favorito')
+        self.size = Question.objects.create(questionnaire=self.questionnaire, text='Tamaño')
+        red = Option.objects.create(question=self.colour, text='Rojo')
+        blue = Option.objects.create(question=self.colour, text='Azul "claro"')
+        big = Option.objects.create(question=self.size, text='Grande')
+        for index in range(5):
+            submission = Submission.objects.create(questionnaire=self.questionnaire, session_key=f's{index}')
+            Answer.objects.create(submission=submission, question=self.colour, selected_option=red if index % 2 else blue)
+            if index != 3:
+                Answer.objects.create(submission=submission, question=self.size, selected_option=big)
+        self.url = reverse('questionnaire-admin-export', args=[self.questionnaire.id])
+
+    def test_streams_csv_by_pages(self):
+        with override_settings(SURVEY_EXPORT_CHUNK_SIZE=2):
+            response = self.client.get(self.url)
+            self.assertTrue(response.streaming)
+            # Cabecera + 3 páginas de submissions
+            chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+
+        rows = list(csv.reader(io.StringIO(b''.join(chunks).decode('utf-8-sig'))))
+        self.assertEqual(rows[0][2:], ['Color, favorito', 'Tamaño'])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1][2:], ['Azul "claro"', 'Grande'])
+        self.assertEqual(rows[4][2:], ['Rojo', ''])
+
+    def test_ndjson_with_gzip(self):
+        response = self.client.get(self.url, {'format': 'ndjson', 'gzip': '1'})
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('.ndjson.gz', response['Content-Disposition'])
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[3])['answers'], {str(self.colour.id): 'Rojo'})
+
+    @override_settings(SURVEY_DB_EXECUTOR_WORKERS=0)
+    async def test_streams_asynchronously_under_asgi(self):
+        token = await sync_to_async(Token.objects.create)(user=self.owner)
+        response = await AsyncClient().get(self.url, {'format': 'ndjson'}, headers={'Authorization': f'Token {token.key}'})
+
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body.splitlines()), 5)
+
+    def test_other_owners_cannot_export(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='secret')
+        self.client.force_authenticate(other)
+
+        self.assertEqual(self.client.get(self.url, {'format': 'csv'}).status_code, 404)
+
+
+class CrosstabTests(TestCase):
+
+    def setUp(self):
+        crosstabs._matrices.clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.questionnaire = Questionnaire.objects.create(title='Cruces', created_by=self.owner)
+        self.first = Question.objects.create(questionnaire=self.questionnaire, text='Q1')
+        self.third = Question.objects.create(questionnaire=self.questionnaire, text='Q3')
+        self.a, self.b = (Option.objects.create(question=self.first, text=text) for text in 'AB')
+        self.x, self.y, self.z = (Option.objects.create(question=self.third, text=text) for text in 'XYZ')
+        votes = [(self.a, self.x), (self.a, self.x), (self.a, self.z), (self.b, self.y), (self.b, None)]
+        for index, (first, third) in enumerate(votes):
+            self.vote(f's{index}', first, third)
+        self.url = reverse('questionnaire-admin-crosstab', args=[self.questionnaire.id])
+
+    def vote(self, session_key, first, third):
+        submission = Submission.objects.create(questionnaire=self.questionnaire, session_key=session_key)
+        Answer.objects.create(submission=submission, question=self.first, selected_option=first)
+        if third is not None:
+            Answer.objects.create(submission=submission, question=self.third, selected_option=third)
+        tallies.bump_stats_version(Questionnaire.objects.filter(id=self.questionnaire.id))
+
+    def test_counts_pairs_and_caches_per_stats_version(self):
+        response = self.client.get(self.url, {'row': self.first.id, 'col': self.third.id})
+
+        self.assertEqual(response.status_code, 200)
+        (table,) = response.json()['crosstabs']
+        # Filas A, B; columnas X, Y, Z. El último evaluado no respondió Q3
+        self.assertEqual(table['counts'], [[2, 0, 1], [0, 1, 0]])
+        self.assertEqual(table['total'], 4)
+
+        # Misma versión: solo el cuestionario y su dueño (IsOwner); la matriz no se recarga
+        with self.assertNumQueries(2):
+            self.client.get(self.url, {'row': self.first.id, 'col': self.third.id})
+        with self.assertNumQueries(2):
+            reverse_table = self.client.get(self.url, {'row': self.third.id}).json()['crosstabs'][0]
+        self.assertEqual(reverse_table['counts'], [[2, 0], [0, 1], [1, 0]])
+
+        self.vote('s5', self.b, self.z)
+        table = self.client.get(self.url, {'row': self.first.id, 'col': self.third.id}).json()['crosstabs'][0]
+        self.assertEqual(table['counts'], [[2, 0, 1], [0, 1, 1]])
+
+    def test_rejects_questions_from_other_questionnaires(self):
+        other = Questionnaire.objects.create(title='Otro', created_by=self.owner)
+        foreign = Question.objects.create(questionnaire=other, text='Ajena')
+
+        self.assertEqual(self.client.get(self.url, {'row': foreign.id}).status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+
+class AnswerSnapshotTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(SURVEY_SNAPSHOT_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        crosstabs._matrices.clear()
+
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.questionnaire = Questionnaire.objects.create(title='Cerrada', created_by=self.owner)
+        self.first = Question.objects.create(questionnaire=self.questionnaire, text='Q1')
+        self.second = Question.objects.create(questionnaire=self.questionnaire, text='Q2')
+        self.a, self.b = (Option.objects.create(question=self.first, text=text) for text in 'AB')
+        self.x, self.y = (Option.objects.create(question=self.second, text=text) for text in 'XY')
+        for index, options in enumerate([(self.a, self.x), (self.a, self.y), (self.b, self.y)]):
+            self.vote(f's{index}', options)
+
+    def vote(self, session_key, options):
+        submission = Submission.objects.create(questionnaire=self.questionnaire, session_key=session_key)
+        for option in options:
+            Answer.objects.create(submission=submission, question_id=option.question_id, selected_option=option)
+        tallies.record_answers([option.id for option in options])
+        return submission
+
+    def current(self):
+        self.questionnaire.refresh_from_db()
+        return snapshots.current(self.questionnaire)
+
+    def test_appends_new_submissions_and_rebuilds_when_old_votes_change(self):
+        self.assertEqual(snapshots.build(self.questionnaire.id), (6, 'rebuilt'))
+        snapshot = self.current()
+        self.assertEqual(snapshot.option.dtype, 'int32')
+        self.assertEqual(snapshot.option.tolist(), [self.a.id, self.x.id, self.a.id, self.y.id, self.b.id, self.y.id])
+
+        latest = self.vote('s3', [self.b])
+        # Un voto nuevo deja el snapshot sin usar hasta el próximo build
+        self.assertIsNone(self.current())
+        self.assertEqual(snapshots.build(self.questionnaire.id), (7, 'appended'))
+        self.assertEqual(self.current().meta['last_submission_id'], latest.id)
+
+        # Cambiar un voto antiguo obliga a rehacerlo entero
+        first_submission = Submission.objects.get(session_key='s0')
+        tallies.record_change(Answer.objects.upsert(first_submission.id, self.first.id, self.b.id), self.b.id)
+        self.assertEqual(snapshots.build(self.questionnaire.id), (7, 'rebuilt'))
+        self.assertEqual(self.current().option.tolist()[0], self.b.id)
+
+    def test_rebuilds_when_old_votes_move_without_changing_the_totals(self):
+        snapshots.build(self.questionnaire.id)
+        # s0 pasa de A a B y s2 de B a A: los conteos por opción no cambian
+        for session_key, option in [('s0', self.b), ('s2', self.a)]:
+            submission = Submission.objects.get(session_key=session_key)
+            tallies.record_change(Answer.objects.upsert(submission.id, self.first.id, option.id), option.id)
+
+        self.assertEqual(snapshots.build(self.questionnaire.id), (6, 'rebuilt'))
+        self.assertEqual(self.current().option.tolist()[::2], [self.b.id, self.a.id, self.a.id])
+        # Sin más cambios, los votos nuevos se vuelven a añadir
+        self.vote('s3', [self.b])
+        self.assertEqual(snapshots.build(self.questionnaire.id), (7, 'appended'))
+
+    def test_export_and_crosstabs_read_the_snapshot(self):
+        from_database = b''.join(export.Exporter(self.questionnaire, 'ndjson').chunks())
+        snapshots.build(self.questionnaire.id)
+        self.questionnaire.refresh_from_db()
+
+        with CaptureQueriesContext(connection) as queries:
+            exporter = export.Exporter(self.questionnaire, 'ndjson')
+            self.assertIsNotNone(exporter.snapshot)
+            from_snapshot = b''.join(exporter.chunks())
+            table = crosstabs.get_matrix(self.questionnaire).crosstab(self.first.id, self.second.id)
+        self.assertEqual(from_snapshot, from_database)
+        self.assertEqual(table.tolist(), [[1, 1], [0, 1]])
+        self.assertFalse([query for query in queries if 'questionnaires_answer' in query['sql']])
+
+
+class TallyTests(TestCase):
+
+    def setUp(self):
+        owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.questionnaire = Questionnaire.objects.create(title='Conteos', created_by=owner)
+        question = Question.objects.create(questionnaire=self.questionnaire, text='Q')
+        self.yes = Option.objects.create(question=question, text='Sí')
+        self.no = Option.objects.create(question=question, text='No')
+        submission = Submission.objects.create(questionnaire=self.questionnaire, session_key='s1')
+        Answer.objects.create(submission=submission, question=question, selected_option=self.yes)
+
+    def counts(self):
+        return dict(OptionTally.objects.values_list('option_id', 'count'))
+
+    def test_apply_deltas_creates_missing_rows_and_bumps_version(self):
+        tallies.apply_deltas({self.yes.id: 2, self.no.id: 0})
+        tallies.apply_deltas({self.yes.id: -1, self.no.id: 1})
+
+        self.assertEqual(self.counts(), {self.yes.id: 1, self.no.id: 1})
+        self.questionnaire.refresh_from_db()
+        self.assertEqual(self.questionnaire.stats_version, 2)
+        self.assertIsNotNone(self.questionnaire.stats_updated_at)
+
+    def test_rebuild_reports_and_fixes_drift(self):
+        tallies.apply_deltas({self.no.id: 3})
+
+        mismatches = tallies.rebuild(fix=False)
+        self.assertEqual(
+            sorted(mismatches, key=lambda mismatch: mismatch[0]), [(self.yes.id, None, 1), (self.no.id, 3, 0)])
+        self.assertEqual(self.counts(), {self.no.id: 3})
+
+        tallies.rebuild()
+        self.assertEqual(self.counts(), {self.yes.id: 1, self.no.id: 0})
+        self.assertEqual(tallies.rebuild(fix=False), [])
+
+    def test_rebuild_tallies_check_fails_on_drift(self):
+        tallies.apply_deltas({self.yes.id: 5})
+        with self.assertRaises(CommandError):
+            call_command('rebuild_tallies', '--check', stdout=io.StringIO())
+
+        call_command('rebuild_tallies', stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('rebuild_tallies', '--check', '--questionnaire', str(self.questionnaire.id), stdout=out)
+        self.assertIn("Todos los conteos coinciden", out.getvalue())
+
+
+class _RecordingLayer:
+    """Channel layer falso: guarda los group_send."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, message):
+        self.sent.append((group, message))
+
+
+class RoomAggregatorTests(SimpleTestCase):
+
+    async def test_idle_room_sends_first_vote_at_once_and_coalesces_the_rest_per_tick(self):
+        layer = _RecordingLayer()
+        room = RoomAggregator(layer, 'ABC123', tick=0.05, max_batch=100)
+
+        await room.add(1, {10: 1, 11: 0})
+        self.assertEqual(len(layer.sent), 1)
+        self.assertEqual(layer.sent[0][1]['updates'], {'1': {'10': 1, '11': 0}})
+
+        # Dentro del tick: se acumulan y solo sale el último valor de cada pregunta
+        await room.add(1, {10: 2, 11: 0})
+        await room.add(1, {10: 2, 11: 1})
+        await room.add(2, {20: 1})
+        self.assertEqual(len(layer.sent), 1)
+        await asyncio.sleep(0.1)
+        self.assertEqual(len(layer.sent), 2)
+        group, message = layer.sent[1]
+        self.assertEqual(group, 'survey_ABC123')
+        self.assertEqual(message['updates'], {'1': {'10': 2, '11': 1}, '2': {'20': 1}})
+
+    async def test_full_batch_is_sent_without_waiting_for_the_tick(self):
+        layer = _RecordingLayer()
+        room = RoomAggregator(layer, 'ABC123', tick=60, max_batch=3)
+        await room.add(1, {10: 1})  # sala inactiva: inmediato
+
+        for _ in range(3):
+            await room.add_deltas(1, {10: 1})
+        self.assertEqual(len(layer.sent), 2)
+        self.assertEqual(layer.sent[1][1]['deltas'], {'1': {'10': 3}})
+        self.assertIsNone(room._timer)
+
+    async def test_stats_older_than_the_last_published_version_are_dropped(self):
+        layer = _RecordingLayer()
+        room = RoomAggregator(layer, 'ABC123', tick=60, max_batch=100)
+        await room.add(1, {10: 2}, stats_version=7)
+
+        # Un hilo del pool más lento publica después unas estadísticas anteriores
+        await room.add(1, {10: 1}, stats_version=6)
+        await room.flush()
+        self.assertEqual(len(layer.sent), 1)
+        self.assertEqual(layer.sent[0][1]['versions'], {'1': 7})
+
+        await room.add(1, {10: 3}, stats_version=8)
+        await room.flush()
+        self.assertEqual(layer.sent[1][1]['updates'], {'1': {'10': 3}})
+
+    def test_room_state_ignores_updates_with_an_older_version(self):
+        state = RoomState('ABC123', buffer_size=8)
+        state.load({1: {10: 0}})
+        state.apply('p:1', {'1': {'10': 2}}, versions={'1': 7})
+        # Otro proceso envió antes su lote, con una versión anterior
+        seq, changes = state.apply('q:1', {'1': {'10': 1}}, versions={'1': 6})
+        self.assertEqual(changes, {})
+        self.assertEqual(state.stats, {'1': {'10': 2}})
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    SURVEY_DB_EXECUTOR_WORKERS=0,  # la BD del test solo se ve desde este hilo
+    SURVEY_BROADCAST_TICK_MS=0,  # cada voto sale en su propio mensaje
+)
+class SurveySocketTestCase(SyncToAsyncTestCase):
+    """Base de los tests del SurveyConsumer: un cuestionario con dos preguntas de dos opciones."""
+
+    def setUp(self):
+        owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.questionnaire = Questionnaire.objects.create(title='En vivo', created_by=owner, is_active=True)
+        self.first = Question.objects.create(questionnaire=self.questionnaire, text='Q1')
+        self.second = Question.objects.create(questionnaire=self.questionnaire, text='Q2')
+        self.a, self.b = (Option.objects.create(question=self.first, text=text) for text in 'AB')
+        self.x, self.y = (Option.objects.create(question=self.second, text=text) for text in 'XY')
+
+    async def open_socket(self, query='', session=None):
+        if session is None:
+            session = SessionStore()
+            await sync_to_async(session.create)()
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/survey/{self.questionnaire.access_code}/?{query}')
+        communicator.scope['session'] = session
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive(self, communicator):
+        return json.loads(await communicator.receive_from(timeout=2))
+
+    async def vote(self, communicator, option):
+        await communicator.send_to(text_data=json.dumps({'question_id': option.question_id, 'option_id': option.id}))
+
+
+class StatsProtocolV2Tests(SurveySocketTestCase):
+
+    async def test_deltas_carry_consecutive_sequence_numbers(self):
+        socket = await self.open_socket('protocol=2')
+        snapshot = await self.receive(socket)
+        self.assertEqual((snapshot['type'], snapshot['seq']), ('snapshot', 0))
+
+        await self.vote(socket, self.a)
+        first = await self.receive(socket)
+        await self.vote(socket, self.x)
+        second = await self.receive(socket)
+
+        self.assertEqual((first['type'], first['seq'], first['since']), ('stats_delta', 1, 0))
+        self.assertEqual(first['changes'], {str(self.first.id): {str(self.a.id): 1}})
+        self.assertEqual((second['seq'], second['since'], second['epoch']), (2, 1, snapshot['epoch']))
+        self.assertEqual(second['changes'], {str(self.second.id): {str(self.x.id): 1}})
+        await socket.disconnect()
+
+    async def test_gap_is_filled_by_resync_and_reconnect(self):
+        socket = await self.open_socket('protocol=2')
+        epoch = (await self.receive(socket))['epoch']
+        for option in (self.a, self.x):
+            await self.vote(socket, option)
+            await self.receive(socket)
+
+        # El cliente perdió todo desde seq 0: recibe los cambios acumulados
+        await socket.send_to(text_data=json.dumps({'type': 'resync', 'since': 0, 'epoch': epoch}))
+        merged = await self.receive(socket)
+        self.assertEqual((merged['type'], merged['seq']), ('stats_delta', 2))
+        self.assertEqual(set(merged['changes']), {str(self.first.id), str(self.second.id)})
+
+        # Al reconectar con since/epoch solo llega lo posterior
+        again = await self.open_socket(f'protocol=2&since=1&epoch={epoch}')
+        delta = await self.receive(again)
+        self.assertEqual(delta['changes'], {str(self.second.id): {str(self.x.id): 1}})
+        await socket.disconnect()
+        await again.disconnect()
+
+    @override_settings(SURVEY_RESYNC_BUFFER=1)
+    async def test_overflow_or_new_epoch_falls_back_to_snapshot(self):
+        socket = await self.open_socket('protocol=2')
+        epoch = (await self.receive(socket))['epoch']
+        for option in (self.a, self.x):
+            await self.vote(socket, option)
+            await self.receive(socket)
+
+        # El buffer solo guarda seq 2: desde 0 ya no se puede reconstruir
+        await socket.send_to(text_data=json.dumps({'type': 'resync', 'since': 0, 'epoch': epoch}))
+        snapshot = await self.receive(socket)
+        self.assertEqual((snapshot['type'], snapshot['seq']), ('snapshot', 2))
+        self.assertEqual(snapshot['stats'][str(self.first.id)], {str(self.a.id): 1, str(self.b.id): 0})
+
+        # Secuencias de otra instancia de la sala: no son comparables
+        await socket.send_to(text_data=json.dumps({'type': 'resync', 'since': 2, 'epoch': 'otra'}))
+        self.assertEqual((await self.receive(socket))['type'], 'snapshot')
+        await socket.disconnect()
+
+
+class RoomRegistryTests(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = RoomRegistry()
+        self.layer = InMemoryChannelLayer()
+
+    async def test_concurrent_connections_load_once(self):
+        calls = []
+
+        async def loader(access_code):
+            calls.append(access_code)
+            await asyncio.sleep(0.01)
+            return {1: {10: 3}}
+
+        loaded = await asyncio.gather(*(self.registry.acquire('ROOM1', self.layer, loader) for _ in range(5)))
+        self.assertEqual(calls, ['ROOM1'])
+        self.assertEqual({id(room) for room in loaded}, {id(loaded[0])})
+        self.assertEqual((loaded[0].subscribers, loaded[0].stats), (5, {'1': {'10': 3}}))
+
+    async def test_unknown_codes_are_not_cached(self):
+        async def missing(access_code):
+            return None
+
+        self.assertIsNone(await self.registry.acquire('NOPE', self.layer, missing))
+        self.assertNotIn('NOPE', self.registry.rooms)
+        self.assertEqual(self.layer.groups.get('survey_NOPE', {}), {})
+
+    async def test_idle_rooms_are_evicted_by_size_and_ttl(self):
+        async def loader(access_code):
+            return {}
+
+        with override_settings(SURVEY_ROOM_CACHE_SIZE=2):
+            for code in ('R1', 'R2', 'R3'):
+                self.registry.release(await self.registry.acquire(code, self.layer, loader))
+            busy = await self.registry.acquire('R4', self.layer, loader)
+            # Sale la menos usada; las que tienen suscriptores nunca
+            self.assertEqual(list(self.registry.rooms), ['R3', 'R4'])
+
+        with override_settings(SURVEY_ROOM_CACHE_TTL=0):
+            await asyncio.sleep(0.01)
+            await self.registry.evict()
+            self.assertEqual(list(self.registry.rooms), ['R4'])
+            self.assertIs(self.registry.get('R4'), busy)
+
+
+class SurveySocketConnectTests(SurveySocketTestCase):
+
+    async def test_unknown_code_closes_without_creating_a_room(self):
+        session = SessionStore()
+        await sync_to_async(session.create)()
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/survey/NOEXISTE/')
+        communicator.scope['session'] = session
+        await communicator.connect()
+
+        self.assertEqual(await communicator.receive_output(timeout=2), {'type': 'websocket.close', 'code': 4404})
+        self.assertIsNone(rooms.get('NOEXISTE'))
+
+
+class SurveySocketVoteValidationTests(SurveySocketTestCase):
+
+    async def assertRejected(self, socket, question_id, option_id):
+        with self.assertLogs('questionnaires.consumers', 'WARNING'):
+            await socket.send_to(text_data=json.dumps({'question_id': question_id, 'option_id': option_id}))
+            rejection = await self.receive(socket)
+        self.assertEqual(rejection, {
+            'type': 'vote_rejected', 'question_id': question_id, 'option_id': option_id, 'reason': 'invalid',
+        })
+
+    async def test_unknown_option_is_rejected(self):
+        socket = await self.open_socket()
+        await self.receive(socket)
+        await self.assertRejected(socket, self.first.id, 999999)
+        self.assertFalse(await Answer.objects.aexists())
+        await socket.disconnect()
+
+    async def test_option_of_another_question_is_rejected(self):
+        socket = await self.open_socket()
+        await self.receive(socket)
+        await self.assertRejected(socket, self.first.id, self.x.id)
+        self.assertFalse(await Answer.objects.aexists())
+        await socket.disconnect()
+
+    async def test_structure_is_reloaded_after_an_admin_edit(self):
+        socket = await self.open_socket()
+        await self.receive(socket)
+        added = await Option.objects.acreate(question=self.first, text='C')
+        # La estructura en caché es la de la conexión: la opción nueva aún no vale
+        await self.assertRejected(socket, self.first.id, added.id)
+
+        await sync_to_async(broadcast.publish_structure_changed)(self.questionnaire.access_code)
+        await socket.receive_nothing(timeout=0.1)
+        await self.vote(socket, added)
+        update = await self.receive(socket)
+        self.assertEqual(update['stats'][str(added.id)], 1)
+        self.assertTrue(await Answer.objects.filter(selected_option=added).aexists())
+        await socket.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class WriteBehindTests(SyncToAsyncTestCase):
+
+    def setUp(self):
+        owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.questionnaire = Questionnaire.objects.create(title='Diferida', created_by=owner, is_active=True)
+        self.question = Question.objects.create(questionnaire=self.questionnaire, text='Q')
+        self.a, self.b = (Option.objects.create(question=self.question, text=text) for text in 'AB')
+
+    def vote(self, session_key, option, previous=None):
+        return ingest.PendingVote(self.questionnaire.access_code, self.questionnaire.id, session_key,
+                                  self.question.id, option.id, previous.id if previous else None)
+
+    def counts(self):
+        return dict(OptionTally.objects.values_list('option_id', 'count'))
+
+    def test_batch_keeps_the_last_vote_per_submission_and_question(self):
+        batch = [self.vote('s1', self.a), self.vote('s2', self.a), self.vote('s1', self.b, self.a)]
+        touched = async_to_sync(ingest.write_votes)(batch)
+
+        self.assertEqual(Submission.objects.count(), 2)
+        self.assertEqual(
+            dict(Answer.objects.values_list('submission__session_key', 'selected_option_id')),
+            {'s1': self.b.id, 's2': self.a.id},
+        )
+        self.assertEqual(self.counts(), {self.a.id: 1, self.b.id: 1})
+        self.assertEqual(touched, {self.questionnaire.access_code: {self.question.id: {self.a.id: 1, self.b.id: 1}}})
+
+    def test_changes_and_new_votes_without_conflict_target(self):
+        # Como en MySQL: bulk_create no puede indicar la restricción del upsert
+        async_to_sync(ingest.write_votes)([self.vote('s1', self.a), self.vote('s2', self.a)])
+        with mock.patch.object(type(connection.features), 'supports_update_conflicts_with_target', False):
+            batch = [self.vote('s1', self.b, self.a), self.vote('s2', self.a), self.vote('s3', self.b)]
+            async_to_sync(ingest.write_votes)(batch)
+
+        self.assertEqual(
+            dict(Answer.objects.values_list('submission__session_key', 'selected_option_id')),
+            {'s1': self.b.id, 's2': self.a.id, 's3': self.b.id},
+        )
+        self.assertEqual(self.counts(), {self.a.id: 1, self.b.id: 2})
+
+    def test_votes_of_a_questionnaire_closed_meanwhile_are_dropped(self):
+        async_to_sync(ingest.write_votes)([self.vote('s1', self.a)])
+        # Otro worker lo desactivó mientras el voto esperaba en la cola
+        Questionnaire.objects.filter(id=self.questionnaire.id).update(is_active=False)
+
+        with self.assertLogs('questionnaires.ingest', 'INFO'):
+            touched = async_to_sync(ingest.write_votes)([self.vote('s2', self.b)])
+
+        self.assertEqual(Submission.objects.count(), 1)
+        self.assertEqual(self.counts(), {self.a.id: 1})
+        # La sala recibe igualmente los conteos reales para deshacer el incremento optimista
+        self.assertEqual(touched, {self.questionnaire.access_code: {self.question.id: {self.a.id: 1, self.b.id: 0}}})
+
+    async def test_full_queue_rejects_and_counts_the_vote(self):
+        writer = ingest.VoteWriter(maxsize=1, batch_size=10, flush_interval=60)
+        self.assertTrue(writer.submit(self.vote('s1', self.a)))
+        with self.assertLogs('questionnaires.ingest', 'WARNING'):
+            self.assertFalse(writer.submit(self.vote('s2', self.a)))
+        self.assertEqual((writer.accepted, writer.dropped), (1, 1))
+        with self.assertLogs('questionnaires.ingest', 'ERROR'):
+            await writer.stop()
+
+    async def test_shutdown_writes_what_is_still_queued(self):
+        writer = ingest.VoteWriter(maxsize=10, batch_size=10, flush_interval=60)
+        with mock.patch.object(ingest, 'vote_writer', writer):
+            writer.submit(self.vote('s1', self.a))
+            writer.submit(self.vote('s2', self.b))
+            await ingest.shutdown()
+
+        self.assertEqual(await Answer.objects.acount(), 2)
+        self.assertEqual((writer.written, writer.task), (2, None))
+
+    async def test_published_counts_keep_votes_not_written_yet(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(f'survey_{self.questionnaire.access_code}', channel)
+
+        writer = ingest.VoteWriter(maxsize=10, batch_size=1, flush_interval=60)
+        writer.submit(self.vote('s1', self.a))
+        writer.submit(self.vote('s2', self.a))
+        writer.submit(self.vote('s3', self.b))
+        # Solo se escribe el primer lote: los otros dos siguen en la cola
+        await writer._publish(await writer._store([writer.queue.get_nowait()]))
+
+        message = await asyncio.wait_for(layer.receive(channel), timeout=2)
+        self.assertEqual(message['updates'], {str(self.question.id): {str(self.a.id): 2, str(self.b.id): 1}})
+
+        await writer.stop()
+        self.assertEqual(writer.unwritten, {})
+        self.assertEqual(await sync_to_async(self.counts)(), {self.a.id: 2, self.b.id: 1})
+
+
+class AnswerUpsertTests(TestCase):
+
+    def setUp(self):
+        owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        questionnaire = Questionnaire.objects.create(title='Upsert', created_by=owner)
+        self.question = Question.objects.create(questionnaire=questionnaire, text='Q')
+        self.a, self.b = (Option.objects.create(question=self.question, text=text) for text in 'AB')
+        self.submission = Submission.objects.create(questionnaire=questionnaire, session_key='s1')
+
+    def test_upsert_returns_the_previous_option(self):
+        # Sin restricción en el upsert (MySQL): se elige UPDATE o INSERT según la respuesta anterior
+        with mock.patch.object(type(connection.features), 'supports_update_conflicts_with_target', False):
+            self.assertIsNone(Answer.objects.upsert(self.submission.id, self.question.id, self.a.id))
+            self.assertEqual(Answer.objects.upsert(self.submission.id, self.question.id, self.b.id), self.a.id)
+            # La misma opción otra vez no escribe nada
+            with self.assertNumQueries(1):
+                self.assertEqual(Answer.objects.upsert(self.submission.id, self.question.id, self.b.id), self.b.id)
+
+        answer = Answer.objects.get()
+        self.assertEqual(answer.selected_option_id, self.b.id)
+
+
+class DedupeAnswersMigrationTests(TransactionTestCase):
+    before = [('questionnaires', '0003_optiontally')]
+    after = [('questionnaires', '0004_answer_unique_per_question')]
+
+    def tearDown(self):
+        # Deja el esquema como lo esperan los demás tests
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_keeps_the_latest_answer_and_corrects_tallies(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        Answer = apps.get_model('questionnaires', 'Answer')
+        OptionTally = apps.get_model('questionnaires', 'OptionTally')
+
+        owner = apps.get_model('users', 'User').objects.create(username='owner', email='owner@example.com')
+        questionnaire = apps.get_model('questionnaires', 'Questionnaire').objects.create(
+            title='Duplicadas', created_by_id=owner.id, access_code='DUP001')
+        question = apps.get_model('questionnaires', 'Question').objects.create(
+            questionnaire_id=questionnaire.id, text='Q')
+        Option = apps.get_model('questionnaires', 'Option')
+        a, b = Option.objects.create(question_id=question.id, text='A'), Option.objects.create(question_id=question.id, text='B')
+        submission = apps.get_model('questionnaires', 'Submission').objects.create(
+            questionnaire_id=questionnaire.id, session_key='s1')
+        for option in (a, a, b):
+            Answer.objects.create(submission_id=submission.id, question_id=question.id, selected_option_id=option.id)
+        for option, count in ((a, 2), (b, 1)):
+            OptionTally.objects.create(option_id=option.id, question_id=question.id,
+                                       questionnaire_id=questionnaire.id, count=count)
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+
+        self.assertEqual(list(Answer.objects.values_list('selected_option_id', flat=True)), [b.id])
+        self.assertEqual(dict(OptionTally.objects.values_list('option_id', 'count')), {a.id: 0, b.id: 1})
+
+
+class OutboundQueueTests(SimpleTestCase):
+
+    def setUp(self):
+        self.sent = []
+
+    async def send_changes(self, question_ids):
+        self.sent.append(question_ids)
+
+    async def test_marks_before_a_send_are_coalesced(self):
+        queue = OutboundQueue(self.send_changes, max_lag=5)
+        self.assertTrue(queue.mark(['1']))
+        self.assertTrue(queue.mark(['1', '2']))
+        self.assertEqual((queue.depth, queue.coalesced), (2, 1))
+
+        await asyncio.sleep(0)
+        self.assertEqual(self.sent, [{'1', '2'}])
+        self.assertEqual(queue.depth, 0)
+        queue.close()
+
+    async def test_pending_changes_older_than_max_lag_refuse_marks(self):
+        release = asyncio.Event()
+
+        async def slow_send(question_ids):
+            await release.wait()
+
+        queue = OutboundQueue(slow_send, max_lag=0.01)
+        queue.mark(['1'])
+        await asyncio.sleep(0)
+        # El envío sigue en curso y el cambio siguiente se queda esperando
+        self.assertTrue(queue.mark(['2']))
+        await asyncio.sleep(0.02)
+        self.assertFalse(queue.mark(['3']))
+        queue.close(lagging=True)
+        release.set()
+
+    async def test_failed_send_closes_the_queue(self):
+        failures = []
+
+        async def broken_send(question_ids):
+            raise RuntimeError('socket roto')
+
+        async def on_error():
+            failures.append(True)
+
+        queue = OutboundQueue(broken_send, max_lag=5, on_error=on_error)
+        with self.assertLogs('questionnaires.outbound', 'ERROR'):
+            queue.mark(['1'])
+            await asyncio.sleep(0)
+        self.assertEqual(failures, [True])
+        self.assertIsNone(queue._task)
+
+
+class SurveySocketClosedTests(SurveySocketTestCase):
+
+    async def test_vote_after_another_worker_closed_the_questionnaire(self):
+        socket = await self.open_socket()
+        await self.receive(socket)
+        await Questionnaire.objects.filter(id=self.questionnaire.id).aupdate(is_deleted=True)
+
+        await self.vote(socket, self.a)
+        rejection = await self.receive(socket)
+        self.assertEqual((rejection['type'], rejection['reason']), ('vote_rejected', 'closed'))
+        self.assertFalse(await Answer.objects.aexists())
+        # Cierre terminal: el formulario no vuelve a conectar
+        self.assertEqual(await socket.receive_output(timeout=2), {'type': 'websocket.close', 'code': 4410})
+        await socket.disconnect()
+
+
+class SurveySocketLagTests(SurveySocketTestCase):
+
+    async def test_lagging_client_is_closed_with_resync_code(self):
+        socket = await self.open_socket()
+        await self.receive(socket)
+        with mock.patch.object(OutboundQueue, 'mark', return_value=False), \
+                self.assertLogs('questionnaires.consumers', 'WARNING'):
+            await self.vote(socket, self.a)
+            closed = await socket.receive_output(timeout=2)
+        self.assertEqual(closed, {'type': 'websocket.close', 'code': CLOSE_RESYNC, 'reason': 'resync'})
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    SURVEY_BROADCAST_TICK_MS=0,
+    SURVEY_DB_EXECUTOR_WORKERS=0,  # sqlite en memoria no admite escrituras desde varios hilos a la vez
+)
+class SurveyLoadtestCommandTests(TransactionTestCase):
+    # Los consumers consultan desde otros hilos: hace falta ver lo que se confirma
+
+    def test_reports_every_vote_and_cleans_up(self):
+        out = io.StringIO()
+        call_command('survey_loadtest', voters=2, watchers=1, votes=2, questions=2, options=2,
+                     seed=1, timeout=2, stdout=out)
+        result = json.loads(out.getvalue())
+
+        self.assertEqual(result['votes'], 4)
+        self.assertEqual(result['broadcasts_measured'], 4)
+        self.assertEqual((result['timeouts'], result['rejected']), (0, 0))
+        self.assertGreater(result['db_queries'], 0)
+        self.assertEqual(result['config']['voters'], 2)
+        self.assertFalse(Questionnaire.all_objects.exists())
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    SURVEY_DB_EXECUTOR_WORKERS=0,
+    DASHBOARD_PUSH_DEBOUNCE_MS=50,
+)
+class DashboardConsumerTests(SyncToAsyncTestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.token = Token.objects.create(user=self.owner)
+
+    async def open_dashboard(self, token):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/dashboard/?token={token}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_invalid_token_is_closed_with_4401(self):
+        communicator = await self.open_dashboard('no-es-un-token')
+        self.assertEqual(await communicator.receive_output(timeout=2), {'type': 'websocket.close', 'code': 4401})
+
+    async def test_snapshot_on_connect_and_one_push_per_burst_of_changes(self):
+        communicator = await self.open_dashboard(self.token.key)
+        snapshot = json.loads(await communicator.receive_from(timeout=2))
+        self.assertEqual(snapshot['type'], 'dashboard_stats')
+        self.assertEqual(snapshot['data']['total_questionnaires'], 0)
+
+        await Questionnaire.objects.acreate(title='Nuevo', created_by=self.owner)
+        for _ in range(3):
+            await get_channel_layer().group_send(dashboard.GROUP_NAME, {'type': 'dashboard_changed'})
+        pushed = json.loads(await communicator.receive_from(timeout=2))
+        self.assertEqual(pushed['data']['total_questionnaires'], 1)
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+        await communicator.disconnect()
+        self.assertFalse(dashboard.hub.consumers)
+
+
+class DashboardHubTests(SimpleTestCase):
+
+    @override_settings(DASHBOARD_PUSH_DEBOUNCE_MS=0)
+    async def test_change_during_a_build_schedules_another_refresh(self):
+        hub = dashboard.DashboardHub()
+        sent = []
+
+        class Panel:
+            async def send(self, text_data):
+                sent.append(text_data)
+
+        builds = iter(['primero', 'segundo'])
+
+        async def build():
+            message = next(builds)
+            if message == 'primero':
+                hub.changed()  # llega mientras se calcula
+            return message
+
+        hub.consumers.add(Panel())
+        with mock.patch.object(hub, '_build', build):
+            hub.changed()
+            for _ in range(10):
+                await asyncio.sleep(0)
+        self.assertEqual(sent, ['primero', 'segundo'])
+        self.assertIsNone(hub._refresh)
+
+
+class _SmallReads:
+    def __init__(self, data, size=7):
+        self.data = data
+        self.size = size
+
+    def read(self, size=-1):
+        chunk, self.data = self.data[:self.size], self.data[self.size:]
+        return chunk
@@ -1,13 +1,25 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 # Asegúrate de que DashboardStatsView esté importada aquí
 from .views import CheckSubmissionView, QuestionnaireViewSet, PublicQuestionnaireView, SubmissionView, DashboardStatsView
+from .views import AsyncCheckSubmissionView, AsyncPublicQuestionnaireView, AsyncSubmissionView
 
 
 router = DefaultRouter()
 # Usamos r'' para que las rutas del admin sean: /api/questionnaires/
 router.register(r'', QuestionnaireViewSet, basename='questionnaire-admin')
 
+# Vistas públicas async (ASGI) o las de DRF de siempre (WSGI), ver SURVEY_ASYNC_PUBLIC_VIEWS
+if getattr(settings, 'SURVEY_ASYNC_PUBLIC_VIEWS', True):
+    public_form_view = AsyncPublicQuestionnaireView.as_view()
+    submission_view = AsyncSubmissionView.as_view()
+    check_submission_view = AsyncCheckSubmissionView.as_view()
+else:
+    public_form_view = PublicQuestionnaireView.as_view()
+    submission_view = SubmissionView.as_view()
+    check_submission_view = CheckSubmissionView.as_view()
+
 urlpatterns = [
     # --- RUTA PARA LAS ESTADÍSTICAS DEL DASHBOARD (DEBE IR PRIMERO) ---
     path('dashboard-stats/', DashboardStatsView.as_view(), name='dashboard-stats'), # <-- Mover esta línea aquí
@@ -16,7 +28,7 @@ urlpatterns = [
     path('', include(router.urls)),
     
     # --- Rutas Públicas ---
-    path('public/forms/<str:access_code>/', PublicQuestionnaireView.as_view(), name='public-questionnaire'),
-    path('public/forms/<str:access_code>/submit/', SubmissionView.as_view(), name='public-submission'),
-    path('public/check-submission/', CheckSubmissionView.as_view(), name='public-check-submission'),
+    path('public/forms/<str:access_code>/', public_form_view, name='public-questionnaire'),
+    path('public/forms/<str:access_code>/submit/', submission_view, name='public-submission'),
+    path('public/check-submission/', check_submission_view, name='public-check-submission'),
 ]
\ No newline at end of file
@@ -1,16 +1,23 @@
-from django.db.models import Count, Sum
+from django.db.models import Count
 from rest_framework import viewsets, status, generics
 from rest_framework.decorators import action
-from django.utils import timezone # <--- AÑADIR ESTA LÍNEA
-from datetime import timedelta # <--- AÑADIR ESTA LÍNEA
-from django.http import Http404 # <--- AÑADIR ESTA LÍNEA
-from django.db.models.functions import TruncDay
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse # <--- AÑADIR ESTA LÍNEA
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.views import APIView
 from users.models import User
 from django.db import transaction, IntegrityError
-from .models import Questionnaire, Submission, Question, Option, Answer
+from channels.db import database_sync_to_async
+from .models import Questionnaire, Submission, Question, Option, Answer, OptionTally
+from . import broadcast, crosstabs, dashboard, export, importer, public_cache, rollups, stats_cache, tallies
+from .metrics import HTTP_VOTES, SUBMISSIONS
+from .pagination import QuestionnaireCursorPagination
+from .resolver import QuestionnaireClosed, resolver
 from .serializers import (
     QuestionnaireAdminSerializer,
     QuestionnaireListSerializer,
@@ -18,6 +25,97 @@ from .serializers import (
     SubmissionSerializer
 )
 from users.permissions import IsOwner
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- Envío del formulario público (lo comparten las vistas síncronas y async) ---
+
+NOT_FOUND_ERROR = "Cuestionario no encontrado o inactivo."
+DUPLICATE_ERROR = "Ya has respondido a este cuestionario."
+CONFLICT_ERROR = "Hubo un conflicto al procesar tu respuesta. Por favor, inténtalo de nuevo."
+
+
+def allowed_options_map(rows):
+    """{question_id: {option_id, ...}} a partir de filas (question_id, option_id)."""
+    allowed_options = {}
+    for question_id, option_id in rows:
+        allowed_options.setdefault(question_id, set()).add(option_id)
+    return allowed_options
+
+
+def check_answers(answers_data, allowed_options):
+    """Devuelve el mensaje de error del primer voto inválido, o None si todos valen."""
+    answered = set()
+    for answer_data in answers_data:
+        question_id = answer_data['question_id']
+        if question_id in answered:
+            return f"La pregunta {question_id} está respondida más de una vez."
+        if answer_data['option_id'] not in allowed_options.get(question_id, ()):
+            return f"La opción {answer_data['option_id']} no pertenece a la pregunta {question_id} de este cuestionario."
+        answered.add(question_id)
+    return None
+
+
+def save_submission(questionnaire, session_key, answers_data):
+    """
+    Guarda el envío y sus respuestas en una transacción y devuelve
+    (submission, estadísticas de las preguntas respondidas para las salas,
+    stats_version de esas estadísticas), o (None, None, None) si la sesión ya
+    había respondido. Lanza IntegrityError si dos
+    envíos de la misma sesión chocan y QuestionnaireClosed si el cuestionario
+    (un QuestionnaireRef) ya no está abierto en la BD.
+    """
+    questionnaire_id = questionnaire.id
+    with transaction.atomic():
+        # La caché del resolver de este worker puede no saber aún que se cerró
+        if not resolver.confirm_open(questionnaire):
+            raise QuestionnaireClosed(questionnaire.access_code)
+        # Esta lógica de get_or_create es más segura que la validación separada
+        submission, created = Submission.objects.get_or_create(
+            questionnaire_id=questionnaire_id,
+            session_key=session_key,
+            defaults={} # No hay campos extra que llenar en la creación
+        )
+        if not created:
+            return None, None, None
+        # Respuestas del día antes que los conteos: el mismo orden de bloqueos que los
+        # votos del socket (respuestas del día, conteos y luego cuestionario)
+        rollups.record_submission(questionnaire_id)
+
+        # Un solo INSERT para todas las respuestas, sea cual sea la longitud del formulario
+        Answer.objects.bulk_create([
+            Answer(
+                submission=submission,
+                question_id=answer_data['question_id'],
+                selected_option_id=answer_data['option_id']
+            )
+            for answer_data in answers_data
+        ])
+
+        # Actualizamos los conteos en la misma transacción
+        tallies.record_answers([answer_data['option_id'] for answer_data in answers_data])
+    stats, stats_version = tallies.questions_stats_with_version(
+        {answer_data['question_id'] for answer_data in answers_data})
+    return submission, stats, stats_version
+
+
+def log_submission(access_code, submission, answers, started, validated, saved):
+    SUBMISSIONS.labels('created').inc()
+    HTTP_VOTES.inc(answers)
+    finished = time.perf_counter()
+    # Dónde se va el tiempo: validación, transacción y aviso a las salas
+    logger.info("submission.created", extra={
+        'access_code': access_code,
+        'submission_id': submission.id,
+        'answers': answers,
+        'validate_ms': round((validated - started) * 1000, 1),
+        'save_ms': round((saved - validated) * 1000, 1),
+        'broadcast_ms': round((finished - saved) * 1000, 1),
+    })
+
 
 # --- Vistas para el Administrador ---
 
@@ -25,110 +123,90 @@ class SubmissionView(APIView):
     permission_classes = [AllowAny]
 
     def post(self, request, access_code, format=None):
-        # ▼▼▼ AÑADIMOS LOGS AQUÍ ▼▼▼
-        print("\n" + "="*50)
-        print(f"INICIO DE PETICIÓN DE VOTO - HORA: {timezone.now()}")
-        
-        try:
-            questionnaire = Questionnaire.objects.get(access_code=access_code, is_active=True, is_deleted=False)
-        except Questionnaire.DoesNotExist:
-            return Response({"error": "Cuestionario no encontrado o inactivo."}, status=status.HTTP_404_NOT_FOUND)
+        started = time.perf_counter()
+
+        # id y estado del cuestionario desde la caché del proceso, sin consultar la BD
+        questionnaire = resolver.resolve(access_code)
+        if questionnaire is None or not questionnaire.is_open:
+            SUBMISSIONS.labels('not_found').inc()
+            return Response({"error": NOT_FOUND_ERROR}, status=status.HTTP_404_NOT_FOUND)
 
         if not request.session.session_key:
             request.session.create()
         session_key = request.session.session_key
-        
-        print(f"SESIÓN ID: {session_key}")
 
         serializer = SubmissionSerializer(data=request.data)
         if not serializer.is_valid():
-            print(f"Error de validación: {serializer.errors}")
+            SUBMISSIONS.labels('invalid').inc()
+            logger.info("submission.invalid", extra={'access_code': access_code, 'errors': serializer.errors})
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         answers_data = serializer.validated_data['answers']
-        print(f"DATOS RECIBIDOS: {answers_data}")
 
-        try:
-            with transaction.atomic():
-                # Esta lógica de get_or_create es más segura que la validación separada
-                submission, created = Submission.objects.get_or_create(
-                    questionnaire=questionnaire, 
-                    session_key=session_key,
-                    defaults={} # No hay campos extra que llenar en la creación
-                )
+        # Validamos todas las respuestas contra un único mapa pregunta -> opciones
+        allowed_options = allowed_options_map(
+            Option.objects.filter(question__questionnaire_id=questionnaire.id).values_list('question_id', 'id')
+        )
+        error = check_answers(answers_data, allowed_options)
+        if error:
+            SUBMISSIONS.labels('invalid').inc()
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        validated = time.perf_counter()
 
-                if not created:
-                    # Si la sumisión ya existía, no hacemos nada o devolvemos error
-                    print(f"VOTO DUPLICADO DETECTADO para sesión {session_key}. No se guarda.")
-                    return Response({"error": "Ya has respondido a este cuestionario."}, status=status.HTTP_400_BAD_REQUEST)
-
-                print(f"SUBMISSION CREADO: ID={submission.id} para sesión {session_key}")
-
-                for answer_data in answers_data:
-                    ans = Answer.objects.create(
-                        submission=submission,
-                        question_id=answer_data['question_id'],
-                        selected_option_id=answer_data['option_id']
-                    )
-                    print(f"  -> ANSWER CREADO: ID={ans.id} para opción {ans.selected_option_id}")
-
-                print("FIN DE PETICIÓN DE VOTO - ÉXITO")
-                print("="*50)
-                return Response({"success": "Respuestas enviadas correctamente."}, status=status.HTTP_201_CREATED)
-        
+        try:
+            submission, stats, stats_version = save_submission(questionnaire, session_key, answers_data)
+        except QuestionnaireClosed:
+            SUBMISSIONS.labels('not_found').inc()
+            return Response({"error": NOT_FOUND_ERROR}, status=status.HTTP_404_NOT_FOUND)
         except IntegrityError:
-            print("ERROR DE INTEGRIDAD - Hubo una condición de carrera.")
-            return Response({"error": "Hubo un conflicto al procesar tu respuesta. Por favor, inténtalo de nuevo."}, status=status.HTTP_409_CONFLICT)
+            SUBMISSIONS.labels('conflict').inc()
+            logger.warning("submission.conflict", extra={'access_code': access_code, 'session': session_key})
+            return Response({"error": CONFLICT_ERROR}, status=status.HTTP_409_CONFLICT)
+        if submission is None:
+            # Si la sumisión ya existía, no hacemos nada o devolvemos error
+            SUBMISSIONS.labels('duplicate').inc()
+            logger.info("submission.duplicate", extra={'access_code': access_code, 'session': session_key})
+            return Response({"error": DUPLICATE_ERROR}, status=status.HTTP_400_BAD_REQUEST)
+        saved = time.perf_counter()
+
+        # Avisamos a las salas en vivo (y a su caché) con los conteos nuevos, y a los paneles
+        broadcast.publish_sync(access_code, stats, stats_version)
+        dashboard.notify_changed()
+
+        log_submission(access_code, submission, len(answers_data), started, validated, saved)
+        return Response({"success": "Respuestas enviadas correctamente."}, status=status.HTTP_201_CREATED)
 
 # ...
 
 class QuestionnaireViewSet(viewsets.ModelViewSet):
-    # ... (todo tu código de permission_classes, get_queryset, etc. se queda igual) ...
-
-    @action(detail=True, methods=['get'])
-    def stats(self, request, pk=None):
-        # ▼▼▼ AÑADIMOS LOGS AQUÍ ▼▼▼
-        print("\n" + "-"*50)
-        print(f"PETICIÓN DE STATS RECIBIDA - HORA: {timezone.now()}")
-        
-        questionnaire = self.get_object()
-        
-        vote_counts = Option.objects.filter(question__questionnaire=questionnaire)\
-            .annotate(votes=Count('answer'))\
-            .values('id', 'votes', 'text') # Añadimos text para que el log sea legible
-
-        print("RESULTADO DEL CONTEO DE VOTOS EN LA BD:")
-        print(list(vote_counts))
-        print("-"*50)
-
-        # El resto de tu lógica para construir la respuesta se queda igual
-        votes_map = {item['id']: item['votes'] for item in vote_counts}
-        questions = Question.objects.filter(questionnaire=questionnaire).prefetch_related('options')
-        stats_data = {}
-        for question in questions:
-            stats_data[question.id] = {
-                'question_text': question.text,
-                'options': [
-                    {
-                        'option_id': option.id,
-                        'option_text': option.text,
-                        'votes': votes_map.get(option.id, 0)
-                    }
-                    for option in question.options.all()
-                ]
-            }
-        return Response(stats_data)
-    
-    # ... (el resto de tus actions como toggle_active se quedan igual) ...
-
     """
     ViewSet para que los Admins gestionen SUS PROPIOS cuestionarios.
     """
     permission_classes = [IsAuthenticated, IsOwner]
+    pagination_class = QuestionnaireCursorPagination
 
     def get_queryset(self):
         # Solo mostrar los cuestionarios del usuario logueado que no estén borrados
-        return Questionnaire.objects.filter(created_by=self.request.user)
+        queryset = Questionnaire.objects.filter(created_by=self.request.user)
+        if self.action == 'list':
+            queryset = self.filter_list(queryset)
+        return queryset
+
+    def filter_list(self, queryset):
+        """
+        Filtros de la lista (?active=true|false, ?title=texto) y el total de
+        respuestas de cada cuestionario, todo en una sola consulta agrupada.
+        """
+        params = self.request.query_params
+        active = params.get('active')
+        if active in ('true', '1'):
+            queryset = queryset.filter(is_active=True)
+        elif active in ('false', '0'):
+            queryset = queryset.filter(is_active=False)
+        title = params.get('title', '').strip()
+        if title:
+            queryset = queryset.filter(title__icontains=title)
+        return queryset.annotate(total_submissions=Count('submission'))
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -138,54 +216,107 @@ class QuestionnaireViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         # Asignar el cuestionario al usuario que lo crea
         serializer.save(created_by=self.request.user)
+        transaction.on_commit(dashboard.notify_changed)
+
+    def perform_update(self, serializer):
+        questionnaire = serializer.save()
+        # Los sockets conectados recargan las preguntas y opciones válidas
+        transaction.on_commit(lambda: broadcast.publish_structure_changed(questionnaire.access_code))
+        transaction.on_commit(dashboard.notify_changed)
 
     def perform_destroy(self, instance):
         # Usar borrado lógico en lugar de físico
         instance.is_deleted = True
         instance.is_active = False # Un cuestionario borrado no puede estar activo
         instance.save()
+        transaction.on_commit(lambda: broadcast.publish_structure_changed(instance.access_code))
+        transaction.on_commit(dashboard.notify_changed)
         
     @action(detail=True, methods=['post'], url_path='toggle-active')
     def toggle_active(self, request, pk=None):
         questionnaire = self.get_object()
         questionnaire.is_active = not questionnaire.is_active
         questionnaire.save()
+        transaction.on_commit(dashboard.notify_changed)
         return Response({'status': f"Cuestionario {'activado' if questionnaire.is_active else 'desactivado'}"})
 
+    @action(detail=False, methods=['post'], url_path='import', url_name='import')
+    def import_questionnaires(self, request):
+        """
+        Importa cuestionarios desde un array JSON o NDJSON, enviado como
+        archivo ('file' en multipart) o como cuerpo de la petición. Se lee por
+        trozos: no se carga el cuerpo entero en memoria.
+        """
+        if request.content_type.startswith('multipart/'):
+            stream = request.FILES.get('file')
+        else:
+            # El cuerpo se lee como archivo, sin pasar por los parsers (None si está vacío)
+            stream = request.stream
+        if stream is None:
+            return Response({'detail': "No se envió ningún archivo."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            summary = importer.import_questionnaires(stream, request.user)
+        except importer.ImportFormatError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if summary['questionnaires']:
+            transaction.on_commit(dashboard.notify_changed)
+        return Response(summary, status=status.HTTP_201_CREATED if summary['questionnaires'] else status.HTTP_200_OK)
+
     @action(detail=True, methods=['get'])
     def stats(self, request, pk=None):
         """
         Vista de estadísticas mejorada que incluye opciones con 0 votos.
         """
         questionnaire = self.get_object()
+        # Con el ETag de stats_version: sin votos nuevos es un 304 y no se agrega nada
+        return stats_cache.response_for(request, questionnaire)
 
-        # 1. Obtenemos todos los votos y los agrupamos por opción
-        vote_counts = Option.objects.filter(question__questionnaire=questionnaire)\
-            .annotate(votes=Count('answer'))\
-            .values('id', 'votes')
-
-        # Creamos un diccionario para buscar los votos de cada opción fácilmente
-        votes_map = {item['id']: item['votes'] for item in vote_counts}
-
-        # 2. Obtenemos todas las preguntas y opciones para construir la respuesta
-        questions = Question.objects.filter(questionnaire=questionnaire).prefetch_related('options')
-        
-        stats_data = {}
-        for question in questions:
-            stats_data[question.id] = {
-                'question_text': question.text,
-                'options': [
-                    {
-                        'option_id': option.id,
-                        'option_text': option.text,
-                        # Usamos el mapa, si no hay votos para una opción, será 0
-                        'votes': votes_map.get(option.id, 0)
-                    }
-                    for option in question.options.all()
-                ]
-            }
-            
-        return Response(stats_data)
+    @action(detail=True, methods=['get'])
+    def crosstab(self, request, pk=None):
+        """
+        Tabla de contingencia: ?row=<pregunta> contra ?col=<pregunta>, o contra
+        todas las demás si no se indica 'col'. Versionada igual que 'stats'.
+        """
+        questionnaire = self.get_object()
+        if not crosstabs.is_available():
+            return Response({'detail': "Las tablas cruzadas necesitan numpy."},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        try:
+            row = int(request.query_params['row'])
+            col = int(request.query_params['col']) if request.query_params.get('col') else None
+        except (KeyError, ValueError):
+            return Response({'detail': "Indica 'row' (y opcionalmente 'col') con ids de pregunta."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return stats_cache.response_for(
+                request, questionnaire, lambda questionnaire: crosstabs.get_body(questionnaire, row, col))
+        except crosstabs.CrosstabError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['get'], url_path='export', url_name='export',
+            renderer_classes=[JSONRenderer, export.CSVRenderer, export.NDJSONRenderer])
+    def export_answers(self, request, pk=None):
+        """
+        Respuestas en crudo, una fila por submission: ?format=csv (por defecto)
+        o ?format=ndjson, y ?gzip=1 para comprimir al vuelo. Se envía por
+        streaming con memoria constante (ver questionnaires/export.py).
+        """
+        questionnaire = self.get_object()
+        format = request.accepted_renderer.format
+        exporter = export.Exporter(questionnaire, format if format in export.FORMATS else 'csv')
+        compressed = request.query_params.get('gzip') in ('true', '1')
+
+        chunks = exporter.chunks()
+        if compressed:
+            chunks = export.gzip_chunks(chunks)
+        if isinstance(request._request, ASGIRequest):
+            # Con ASGI Django solo transmite iteradores async: cada página pasa por el pool de BD
+            chunks = export.aiter_chunks(chunks)
+        response = StreamingHttpResponse(
+            chunks, content_type='application/gzip' if compressed else exporter.content_type,
+        )
+        response['Content-Disposition'] = f'attachment; filename="{exporter.filename(compressed)}"'
+        return response
 
 
 # --- Vistas para el Usuario Público (Evaluado) ---
@@ -198,23 +329,19 @@ class PublicQuestionnaireView(generics.RetrieveAPIView):
     lookup_field = 'access_code'
 
     def retrieve(self, request, *args, **kwargs):
-        try:
-            instance = self.get_object()
-            # Verificamos si está activo aquí
-            if not instance.is_active:
-                # Si no está activo, devolvemos un error 403 Forbidden con un mensaje claro
-                return Response(
-                    {"detail": "Esta encuesta ha sido desactivada por el administrador."},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-            serializer = self.get_serializer(instance)
-            return Response(serializer.data)
-        except Http404:
+        access_code = kwargs[self.lookup_field]
+        # Los códigos que no existen se descartan en memoria (caché negativa del resolver) y el
+        # JSON sale ya serializado de la caché con su ETag: solo se toca la BD tras una edición
+        questionnaire = resolver.resolve(access_code)
+        payload = public_cache.get_payload(questionnaire) if questionnaire else None
+        if payload is None:
             # Si el código no existe, devolvemos un 404 con un mensaje claro
             return Response(
                 {"detail": "No se encontró ninguna encuesta con ese código de acceso."},
                 status=status.HTTP_404_NOT_FOUND
             )
+        # Si no está activo, la caché guarda el 403 con su mensaje
+        return public_cache.response_for(request, payload)
         
 
     """
@@ -321,8 +448,10 @@ class CheckSubmissionView(APIView):
         session_key = request.session.session_key
 
         # Verificamos si ya existe una respuesta para esa encuesta y esa sesión
-        has_submitted = Submission.objects.filter(
-            questionnaire__access_code=access_code,
+        # (el id sale de la caché del resolver; un código que no existe no tiene respuestas)
+        questionnaire = resolver.resolve(access_code)
+        has_submitted = questionnaire is not None and Submission.objects.filter(
+            questionnaire_id=questionnaire.id,
             session_key=session_key
         ).exists()
 
@@ -330,6 +459,150 @@ class CheckSubmissionView(APIView):
     
 
 
+# --- Vistas async del Usuario Público (SURVEY_ASYNC_PUBLIC_VIEWS) ---
+#
+# Las mismas respuestas que SubmissionView, PublicQuestionnaireView y
+# CheckSubmissionView, pero sin ocupar un hilo por petición: con ASGI corren en
+# el event loop y solo pasan a un hilo para las consultas (ORM async) y para
+# la transacción del envío, que va entera en un único salto. DRF no tiene
+# vistas async, así que son vistas de Django que leen el JSON y lo devuelven
+# en el mismo formato.
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    # Mismo JSON que el JSONRenderer de DRF (UTF-8 y sin espacios)
+    return JsonResponse(data, status=status_code, safe=False,
+                        json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
+def read_request_data(request):
+    """
+    Cuerpo de la petición como lo entregaría DRF (JSON o formulario). Devuelve
+    (datos, None) o (None, respuesta de error).
+    """
+    content_type = request.content_type or ''
+    if content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        return request.POST, None
+    if content_type != 'application/json' and request.body:
+        return None, json_response(
+            {'detail': f'Unsupported media type "{request.META.get("CONTENT_TYPE", "")}" in request.'},
+            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    if not request.body:
+        return {}, None
+    try:
+        return json.loads(request.body), None
+    except ValueError as exc:
+        return None, json_response({'detail': f'JSON parse error - {exc}'}, status.HTTP_400_BAD_REQUEST)
+
+
+async def ensure_session_key(request):
+    if not request.session.session_key:
+        await request.session.acreate()
+    return request.session.session_key
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncSubmissionView(View):
+    http_method_names = ['post', 'options']
+
+    async def post(self, request, access_code):
+        started = time.perf_counter()
+
+        questionnaire = await resolver.aresolve(access_code)
+        if questionnaire is None or not questionnaire.is_open:
+            SUBMISSIONS.labels('not_found').inc()
+            return json_response({"error": NOT_FOUND_ERROR}, status.HTTP_404_NOT_FOUND)
+
+        data, error_response = read_request_data(request)
+        if error_response is not None:
+            return error_response
+        serializer = SubmissionSerializer(data=data)
+        if not serializer.is_valid():
+            # Igual que la vista síncrona: la sesión existe aunque el envío no sea válido
+            await ensure_session_key(request)
+            SUBMISSIONS.labels('invalid').inc()
+            logger.info("submission.invalid", extra={'access_code': access_code, 'errors': serializer.errors})
+            return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        answers_data = serializer.validated_data['answers']
+        validated = time.perf_counter()
+
+        try:
+            # Sesión, mapa de opciones y transacción en un solo salto a un hilo
+            error, submission, stats, stats_version = await database_sync_to_async(self.check_and_save)(
+                request.session, questionnaire, answers_data)
+        except QuestionnaireClosed:
+            SUBMISSIONS.labels('not_found').inc()
+            return json_response({"error": NOT_FOUND_ERROR}, status.HTTP_404_NOT_FOUND)
+        except IntegrityError:
+            SUBMISSIONS.labels('conflict').inc()
+            logger.warning("submission.conflict", extra={'access_code': access_code, 'session': request.session.session_key})
+            return json_response({"error": CONFLICT_ERROR}, status.HTTP_409_CONFLICT)
+        session_key = request.session.session_key
+        if error:
+            SUBMISSIONS.labels('invalid').inc()
+            return json_response({"error": error}, status.HTTP_400_BAD_REQUEST)
+        if submission is None:
+            SUBMISSIONS.labels('duplicate').inc()
+            logger.info("submission.duplicate", extra={'access_code': access_code, 'session': session_key})
+            return json_response({"error": DUPLICATE_ERROR}, status.HTTP_400_BAD_REQUEST)
+        saved = time.perf_counter()
+
+        await broadcast.publish_now(access_code, stats, stats_version)
+        await dashboard.anotify_changed()
+
+        log_submission(access_code, submission, len(answers_data), started, validated, saved)
+        return json_response({"success": "Respuestas enviadas correctamente."}, status.HTTP_201_CREATED)
+
+    @staticmethod
+    def check_and_save(session, questionnaire, answers_data):
+        """Devuelve (error, submission, estadísticas, stats_version); submission es None si la sesión ya respondió."""
+        if not session.session_key:
+            session.create()
+        allowed_options = allowed_options_map(
+            Option.objects.filter(question__questionnaire_id=questionnaire.id).values_list('question_id', 'id')
+        )
+        error = check_answers(answers_data, allowed_options)
+        if error:
+            return error, None, None, None
+        return (None, *save_submission(questionnaire, session.session_key, answers_data))
+
+
+class AsyncPublicQuestionnaireView(View):
+    http_method_names = ['get', 'head', 'options']
+
+    async def get(self, request, access_code):
+        # Igual que PublicQuestionnaireView.retrieve: resolver y caché, sin hilos si ambos aciertan
+        questionnaire = await resolver.aresolve(access_code)
+        payload = await public_cache.aget_payload(questionnaire) if questionnaire else None
+        if payload is None:
+            return json_response(
+                {"detail": "No se encontró ninguna encuesta con ese código de acceso."},
+                status.HTTP_404_NOT_FOUND
+            )
+        return public_cache.response_for(request, payload)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncCheckSubmissionView(View):
+    http_method_names = ['post', 'options']
+
+    async def post(self, request):
+        data, error_response = read_request_data(request)
+        if error_response is not None:
+            return error_response
+        access_code = data.get('access_code') if isinstance(data, dict) else None
+        if not access_code:
+            return json_response({'error': 'No se proporcionó código de acceso.'}, status.HTTP_400_BAD_REQUEST)
+
+        session_key = await ensure_session_key(request)
+
+        questionnaire = await resolver.aresolve(access_code)
+        has_submitted = questionnaire is not None and await Submission.objects.filter(
+            questionnaire_id=questionnaire.id,
+            session_key=session_key
+        ).aexists()
+        return json_response({'has_submitted': has_submitted})
+
+
 # ... (resto de tus vistas como PublicQuestionnaireView, SubmissionView, CheckSubmissionView) ...
 
 class DashboardStatsView(APIView):
@@ -340,66 +613,5 @@ class DashboardStatsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, format=None):
-        # 1. Total de Cuestionarios Creados (solo activos, no borrados)
-        total_questionnaires = Questionnaire.objects.filter(is_deleted=False).count()
-
-        # 2. Total de Respuestas Recibidas (sumar las de todos los cuestionarios)
-        # Asegúrate de que Submission exista y esté relacionado correctamente
-        total_submissions = Submission.objects.count()
-
-        # 3. Total de Usuarios Registrados (en tu sistema, asumiendo todos los roles)
-        total_users = User.objects.count() # Contar todos los usuarios en el sistema
-
-        # 4. Tendencia de Respuestas Recibidas (ej. últimos 30 días)
-        # Puedes ajustar el rango de días según lo necesites
-        end_date = timezone.now()
-        start_date = end_date - timedelta(days=30)
-
-        # Agrupar respuestas por día y contarlas
-        submissions_by_day = Submission.objects.filter(
-            created_at__range=[start_date, end_date]
-        ).annotate(
-            day=TruncDay('created_at')
-        ).values('day').annotate(
-            count=Count('id')
-        ).order_by('day')
-
-        # Formatear los datos para Chart.js
-        trend_labels = []
-        trend_data = []
-        current_date = start_date
-        while current_date <= end_date:
-            # Buscar el conteo para este día, si no existe, es 0
-            count_for_day = next((item['count'] for item in submissions_by_day if item['day'].date() == current_date.date()), 0)
-            trend_labels.append(current_date.strftime('%d/%b')) # Formato "01/Jul"
-            trend_data.append(count_for_day)
-            current_date += timedelta(days=1)
-
-
-        # 5. Distribución de Cuestionarios por Tipo/Título (ej. los 5 más populares por respuestas)
-        # Esto asume que el "tipo" se infiere del título o una categoría
-        # Contaremos las respuestas por cuestionario y luego tomaremos los N primeros
-        questionnaire_responses = Questionnaire.objects.filter(
-            is_deleted=False, # Solo cuestionarios no borrados
-            is_active=True # Opcional: solo cuestionarios activos
-        ).annotate(
-            total_responses=Count('submission')
-        ).order_by('-total_responses')[:5] # Los 5 con más respuestas
-
-        type_labels = [q.title for q in questionnaire_responses]
-        type_data = [q.total_responses for q in questionnaire_responses]
-
-
-        return Response({
-            'total_questionnaires': total_questionnaires,
-            'total_submissions': total_submissions,
-            'total_users': total_users,
-            'submissions_trend': {
-                'labels': trend_labels,
-                'data': trend_data,
-            },
-            'questionnaire_type_distribution': {
-                'labels': type_labels,
-                'data': type_data,
-            },
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+        # Los paneles abiertos reciben lo mismo por WebSocket (DashboardConsumer)
+        return Response(dashboard.snapshot(), status=status.HTTP_200_OK)